@@ -1,109 +1,176 @@
-from typing import Dict, Any
-from yaspin import yaspin
-
-from lib.config import GAME_CONFIG, SCHEMAS_DIR
+import argparse
+
+from lib import agent_runtime
+from lib.agent_runtime import shared
+from lib.async_bridge import Blocking, run_sync
+from lib.config import (
+    ASYNC_AGENTS,
+    GAME_CONFIG,
+    MUD_HOST,
+    MUD_PORT,
+    SCHEMAS_DIR,
+    SPEAK_TO_ME,
+    UNDO_DEPTH,
+    schedulers,
+)
 from lib.logger import logger
-from lib.color import color
-from lib.game_state import GameState, State
-from lib.narrator_agent import Narrator
-
-
-def format_readable_scene(scene: Dict[str, Any], state) -> str:
-    "Print the scene JSON in a human-readable format."
-    scene_description = ""
-
-    if "title" in scene:
-        scene_description = (
-            scene_description
-            + color.bold
-            + color.underline
-            + scene["title"]
-            + color.end
-            + "\n"
+from lib import game
+from lib.game import PlayerQuit, end_turn, format_readable_scene, start_turn
+from lib.game_state import GameState, History, State
+from lib.background_plotter import BackgroundPlotter
+from lib.dispatcher import print_feedback
+from lib.journal import Journal, recording_commands
+from lib.narrator_agent import AsyncNarrator, Narrator
+from lib.prompt_assembly import prompt_cache_stats
+from lib.retrieval import MemoryIndex
+from lib.speculative import speculator
+from lib.speech import Speaker
+from lib.tracing import tracer
+
+
+def new_narrator() -> Narrator:
+    "With ASYNC_AGENTS, an AsyncNarrator on the agents' event loop that blocks like a Narrator."
+    return Blocking(shared(AsyncNarrator)) if ASYNC_AGENTS else shared(Narrator)
+
+
+def speak_feedback(speaker: Speaker):
+    "Streamed feedback is read out as it arrives, as well as printed."
+
+    def on_feedback(text: str):
+        print_feedback(text)
+        speaker.feed(text)
+
+    narrator = shared(AsyncNarrator) if ASYNC_AGENTS else shared(Narrator)
+    narrator.on_feedback = on_feedback
+
+
+def dispatch_user_action(
+    user_action: str, state: GameState, memory: MemoryIndex
+) -> GameState:
+    try:
+        return game.dispatch_user_action(
+            user_action, state, new_narrator(), memory=memory
         )
-
-    scene_description += scene["description"]
-
-    if "exits" in scene:
-        scene_description += "\n\n" + color.underline + "Exits:" + color.end + "\n"
-        for exit_data in scene["exits"]:
-            if "hidden" in exit_data:
-                continue
-            scene_description += (
-                f"- {exit_data['direction'].capitalize()}: {exit_data['description']}\n"
+    except PlayerQuit:
+        local_fraction = tracer.local_fraction()
+        if local_fraction is not None:
+            logger.info("%.0f%% of turns were served locally", local_fraction * 100)
+        for (agent, tier, model), stats in tracer.tier_stats().items():
+            logger.info(
+                "%s tier %s (%s): %.0f%% of %s attempts accepted, %.2fs on average",
+                agent,
+                tier,
+                model,
+                stats["success_rate"] * 100,
+                stats["attempts"],
+                stats["mean_seconds"],
             )
-
-    scene_description = (
-        state.feedback + "\n\n" + scene_description + "\nWhat do you do?\n"
-    )
-
-    return scene_description
-
-
-def dispatch_user_action(user_action: str, state: GameState) -> GameState:
-    match user_action.split(" ", 1):
-        case ["quit"]:
-            print("Goodbye!")
-            exit(0)
-        case ["inventory"]:
-            if state.inventory:
-                print("Inventory:")
-                for item in state.inventory:
-                    print(f"- {item}")
-            else:
-                print("You have no items in your inventory.")
-            return state
-        case ["look"]:
-            return state
-        case ["look", *rest]:
-            with yaspin(text="Interpreting command...", color="cyan"):
-                return Narrator().look_at(" ".join(rest), state)
-        case ["go", *rest]:
-            with yaspin(text="Generating...", color="cyan"):
-                return Narrator().go(user_action, state)
-        case ["use", *rest]:
-            with yaspin(text="Generating...", color="cyan"):
-                state = Narrator().use(user_action, state)
-            return state
-        case [_, *rest]:
-            print("Oops! I don't understand that command.")
-            return state
-
-
-def game_loop(state: GameState):
+        for backend, scheduler in schedulers().items():
+            stats = scheduler.stats()
+            logger.info("%s: %s requests coalesced", backend, stats["coalesced"])
+            for name, wait in stats["queue_wait_seconds"].items():
+                if wait["count"]:
+                    logger.info(
+                        "%s: %s %s requests waited %.2fs on average, %.2fs at most",
+                        backend,
+                        wait["count"],
+                        name,
+                        wait["total"] / wait["count"],
+                        wait["max"],
+                    )
+        for agent, stats in prompt_cache_stats.snapshot().items():
+            logger.info(
+                "%s: %.0f%% of %s prompt tokens were cached, %.0fms evaluating prompts",
+                agent,
+                stats["cached_fraction"] * 100,
+                stats["prompt_tokens"],
+                stats["prompt_ms"],
+            )
+        exit(0)
+
+
+def game_loop(
+    state: GameState,
+    journal: Journal | None = None,
+    speaker: Speaker | None = None,
+):
+    """With a journal, every turn is saved to it as it ends. With a speaker,
+    scenes are read out.
+
+    `undo` goes back to the state before the last turn, up to UNDO_DEPTH turns.
+    The story is updated in the background every PLOTTER_EVERY turns. What
+    the narrator recalls is indexed again from the journal, if there is one.
+    """
+    history = History(UNDO_DEPTH)
+    plotter = BackgroundPlotter()
+    memory = MemoryIndex()
+    if journal is not None:
+        memory.rebuild(journal.replay())
+    (shared(AsyncNarrator) if ASYNC_AGENTS else shared(Narrator)).memory = memory
     while True:
 
         # Show the current scene by default at the top of the loop, unless we set engine.describe_current_scene to False
         if state.engine["describe_current_scene"]:
-            print(format_readable_scene(state.current_scene, state))
-
-        # Turn describe_current_scene back on and delete the feedback from the previous turn
-        state = GameState(
-            current_scene=state.current_scene,
-            inventory=state.inventory,
-            engine={
-                "describe_current_scene": True,
-                "last_action": state.engine["last_action"],
-            },
-            story=state.story,
-            feedback="",
-        )
+            description = format_readable_scene(state.current_scene, state)
+            print(description)
+            if speaker is not None:
+                speaker.say(description)
+
+        # Get the scenes behind each exit going while the player reads
+        speculator.prefetch(state)
+
+        previous = state
+        state = plotter.merge(start_turn(state))
 
         user_action = input("> ")
 
-        state = dispatch_user_action(user_action, state)
-
-        state = GameState(
-            current_scene=state.current_scene,
-            inventory=state.inventory,
-            engine={
-                "describe_current_scene": state.engine["describe_current_scene"],
-                "last_action": user_action,
-            },
-            story=state.story,
-            feedback=state.feedback,
-        )
+        with recording_commands() as commands:
+            if user_action == "undo":
+                state = history.undo()
+                if state is None:
+                    print("There's nothing to undo.")
+                    state = previous
+                memory.rewind(state)
+            else:
+                history.push(previous)
+                state = dispatch_user_action(user_action, state, memory)
+                state = end_turn(state, user_action)
+                plotter.after_turn(state)
+
+        if journal is not None:
+            journal.record(
+                user_action, previous if journal.turn else None, state, commands
+            )
 
 
 if __name__ == "__main__":
-    game_loop(State)
+    parser = argparse.ArgumentParser(description="Dungeonmaster MUD spike")
+    subcommands = parser.add_subparsers(dest="command")
+    serve = subcommands.add_parser("serve", help="host a multiplayer MUD server")
+    serve.add_argument("--host", default=MUD_HOST)
+    serve.add_argument("--port", type=int, default=MUD_PORT)
+    compact = subcommands.add_parser("compact", help="compact a saved session")
+    compact.add_argument("session")
+    parser.add_argument(
+        "--session", help="save the game under this name, resuming it if it exists"
+    )
+    args = parser.parse_args()
+
+    if args.command == "compact":
+        Journal.for_session(args.session).compact()
+        exit(0)
+
+    agent_runtime.start()
+
+    if args.command == "serve":
+        from lib.mud_server import serve_forever
+
+        run_sync(serve_forever(args.host, args.port))
+    else:
+        speaker = None
+        if SPEAK_TO_ME:
+            speaker = Speaker()
+            speak_feedback(speaker)
+
+        journal = Journal.for_session(args.session) if args.session else None
+        game_loop((journal and journal.resume()) or State, journal, speaker)
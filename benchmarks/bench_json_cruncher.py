@@ -0,0 +1,62 @@
+"""Per-call overhead of JSONCruncher outside the LLM call: building the prompt
+and validating the response.
+
+"before" is what json_from_text/handle_llm_response used to do on every call:
+read the schema file, json.loads it, re-render the examples and validate
+with a freshly built validator. "after" goes through the schema registry and
+the cached prompt parts.
+
+    python benchmarks/bench_json_cruncher.py
+"""
+
+import json
+import os
+import sys
+import timeit
+
+script_dir = os.path.dirname(__file__)
+root_dir = os.path.abspath(os.path.join(script_dir, ".."))
+sys.path.append(root_dir)
+
+import jsonschema
+
+from lib.config import GAME_CONFIG, SCHEMAS_DIR
+from lib.json_cruncher_agent import JSONCruncher
+from lib.schema_registry import schemas
+
+OBJ_TYPE = "scene"
+TEXT = "A library with a giant window, a spiral staircase, two other exits, and a secret map."
+NUMBER = 2000
+
+
+def before(scene: dict):
+    with open(SCHEMAS_DIR / f"{OBJ_TYPE}_schema.json", "r") as f:
+        schema = f.read()
+
+    object_prompt = GAME_CONFIG["agents"]["json_cruncher"]["object_prompts"][OBJ_TYPE]
+    prompt_text = (
+        object_prompt["user_prompt"]
+        + f"\n\n{TEXT}\n\nExample {OBJ_TYPE} object(s):\n\n"
+    )
+    for example in object_prompt["examples"]:
+        prompt_text += f"```json\n{json.dumps(example, indent=2)}\n```\n\n"
+
+    jsonschema.validate(scene, json.loads(schema))
+
+
+def after(cruncher: JSONCruncher, scene: dict):
+    cruncher.build_prompt(TEXT, OBJ_TYPE)
+    schemas.validator(OBJ_TYPE).validate(scene)
+
+
+if __name__ == "__main__":
+    scene = GAME_CONFIG["initial_scene"]
+    cruncher = JSONCruncher()
+    after(cruncher, scene)  # load and compile everything up front
+
+    before_time = timeit.timeit(lambda: before(scene), number=NUMBER) / NUMBER
+    after_time = timeit.timeit(lambda: after(cruncher, scene), number=NUMBER) / NUMBER
+
+    print(f"before: {before_time * 1e6:8.1f} µs per call")
+    print(f"after:  {after_time * 1e6:8.1f} µs per call")
+    print(f"speedup: {before_time / after_time:.1f}x")
@@ -0,0 +1,90 @@
+"""Import time of the game's modules, from `python -X importtime`.
+
+Runs a fresh interpreter that imports the narrator and the dispatcher (what
+`__main__` needs before the first prompt) a few times and reports the median
+total, the slowest imports, and whether openai or yaml were imported at all.
+The first run uses an empty config cache, so it includes parsing config.yml.
+
+    python benchmarks/bench_startup.py
+    python benchmarks/bench_startup.py --pytest   # also time test collection
+"""
+
+import os
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+script_dir = os.path.dirname(__file__)
+root_dir = os.path.abspath(os.path.join(script_dir, ".."))
+
+IMPORTS = "import lib.narrator_agent, lib.dispatcher"
+RUNS = 5
+SLOWEST = 10
+LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+
+def import_times(env: dict) -> dict:
+    "Cumulative import time in µs for each module, top-level imports only."
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", IMPORTS],
+        cwd=root_dir,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    times = {}
+    for match in LINE.finditer(result.stderr):
+        _, cumulative, indent, module = match.groups()
+        times[module] = (int(cumulative), len(indent))
+    return times
+
+
+def total(times: dict) -> int:
+    return sum(cumulative for cumulative, depth in times.values() if depth == 1)
+
+
+def collection_time(env: dict) -> float:
+    start = time.perf_counter()
+    subprocess.run(
+        [
+            sys.executable,
+            "-m",
+            "pytest",
+            "--collect-only",
+            "-q",
+            "-p",
+            "no:cacheprovider",
+        ],
+        cwd=root_dir,
+        env=env,
+        capture_output=True,
+        check=True,
+    )
+    return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    env = {**os.environ, "OPENAI_API_KEY": os.getenv("OPENAI_API_KEY", "sk-bench")}
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        env["CONFIG_CACHE_DIR"] = cache_dir
+        runs = [import_times(env) for _ in range(RUNS)]
+
+        print(f"cold config cache: {total(runs[0]) / 1000:8.1f} ms")
+        print(
+            f"warm config cache: {statistics.median(map(total, runs[1:])) / 1000:8.1f} ms"
+        )
+        print(f"openai imported:   {'openai' in runs[-1]}")
+        print(f"yaml imported:     {'yaml' in runs[-1]}")
+
+        print(f"\nslowest {SLOWEST} imports (cumulative):")
+        slowest = sorted(runs[-1].items(), key=lambda item: -item[1][0])[:SLOWEST]
+        for module, (cumulative, _) in slowest:
+            print(f"  {cumulative / 1000:8.1f} ms  {module}")
+
+        if "--pytest" in sys.argv:
+            print(f"\npytest collection: {collection_time(env):.2f} s")
@@ -0,0 +1,259 @@
+"""Microbenchmarks for the pure-Python code that runs on every turn.
+
+Each case is timed with timeit (best of several repeats) and compared with
+benchmarks/baselines.json. A case more than `--threshold` times slower than
+its baseline (default 1.5) counts as a regression, and the script exits 1.
+
+Inputs are realistic (a narrator response, a typical scene) and adversarial
+(long responses, hundreds of tags, scenes with hundreds of exits, broken
+fences), so it shows whether these paths stay negligible as scenes and the
+number of players grow.
+
+Baselines depend on the machine, so re-record them with `--update` when
+moving to a new one, and commit the result.
+
+    python benchmarks/microbench.py
+    python benchmarks/microbench.py --update
+    python benchmarks/microbench.py --filter scene
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import logging
+import os
+import sys
+import timeit
+from typing import Callable, Dict, List, Tuple
+
+script_dir = os.path.dirname(__file__)
+root_dir = os.path.abspath(os.path.join(script_dir, ".."))
+sys.path.append(root_dir)
+
+from lib.dispatcher import extract_commands
+from lib.game import end_turn, format_readable_scene, start_turn
+from lib.game_state import new_game_state
+from lib.schema_registry import schemas
+from lib.retrieval import MemoryIndex
+from lib.token_budget import scene_to_prompt_text
+from utils import (
+    extract_fenced_json,
+    extract_from_fenced_code_block,
+    scene_to_compact_text,
+    scene_to_text,
+)
+
+BASELINES = os.path.join(script_dir, "baselines.json")
+REPEAT = 5
+# Aim for about this long per repeat, so quick and slow cases are both stable
+TARGET_SECONDS = 0.05
+PLAYERS = 100
+
+DIRECTIONS = ["north", "south", "east", "west", "up", "down"]
+
+
+def scene_with(exits: int, description_sentences: int) -> dict:
+    return {
+        "id": f"scene_{exits}",
+        "title": "The Hall of Many Doors",
+        "summary": "A hall with a great many doors.",
+        "description": " ".join(
+            f"Sentence {i} describes the cold stone, the dripping water and the doors."
+            for i in range(description_sentences)
+        ),
+        "internal_notes": "The third door from the left is a mimic. " * 5,
+        "exits": [
+            {
+                "id": f"door_{i}",
+                "direction": DIRECTIONS[i % len(DIRECTIONS)],
+                "description": f"Door number {i}, banded with iron",
+                **({"locked": True} if i % 3 == 0 else {}),
+                **({"hidden": True} if i % 7 == 0 else {}),
+            }
+            for i in range(exits)
+        ],
+    }
+
+
+TYPICAL_SCENE = scene_with(exits=3, description_sentences=4)
+HUGE_SCENE = scene_with(exits=500, description_sentences=400)
+
+NARRATOR_RESPONSE = (
+    "<FEEDBACK> You push the heavy door open and step through into the dark. "
+    "<GENERATE SCENE> A long corridor lit by guttering torches, with a door at "
+    "the far end and a narrow stair going down."
+)
+LONG_RESPONSE = (
+    "<FEEDBACK> "
+    + "The walls seem to close in as you walk. " * 2000
+    + "<UPDATE SCENE> "
+    + "The torches have gone out. " * 500
+)
+MANY_TAGS = "".join(
+    f"<FEEDBACK> Line {i}. <UPDATE SCENE> Change {i}. " for i in range(500)
+)
+UNCLOSED_TAGS = "<" * 5000 + " " + "not a tag " * 500
+
+FENCED_JSON = (
+    "Here is the scene:\n\n"
+    f"```json\n{json.dumps(TYPICAL_SCENE, indent=2)}\n```\n\nEnjoy!"
+)
+HUGE_FENCED_JSON = f"```json\n{json.dumps(HUGE_SCENE, indent=2)}\n```"
+UNCLOSED_FENCE = "Here you go:\n\n```json\n" + json.dumps(HUGE_SCENE, indent=2)
+MANY_FENCES = "".join(f'```json\n{{"n": {i}}}\n```\nand then\n' for i in range(2000))
+BROKEN_JSON_FENCE = "```json\n" + json.dumps(HUGE_SCENE)[:-50] + "\n```"
+
+STATE = new_game_state().evolve(current_scene=TYPICAL_SCENE)
+HUGE_STATE = new_game_state().evolve(current_scene=HUGE_SCENE)
+VALID_SCENE = {k: v for k, v in TYPICAL_SCENE.items() if k != "internal_notes"}
+VALID_HUGE_SCENE = {k: v for k, v in HUGE_SCENE.items() if k != "internal_notes"}
+
+MEMORY = MemoryIndex()
+for n in range(5000):
+    MEMORY.add(f"scene:{n}", f"Room {n}: {TYPICAL_SCENE['description']}")
+
+
+def quietly(function: Callable, *args) -> Callable[[], object]:
+    "extract_fenced_json prints when a code block isn't valid JSON."
+
+    def call():
+        with contextlib.redirect_stdout(io.StringIO()):
+            return function(*args)
+
+    return call
+
+
+def validate(scene: dict):
+    schemas.validator("scene").validate(scene)
+
+
+def turn(state):
+    return end_turn(start_turn(state), "look")
+
+
+def turns_for_players(state):
+    for _ in range(PLAYERS):
+        end_turn(start_turn(state), "look")
+
+
+CASES: List[Tuple[str, Callable[[], object]]] = [
+    (
+        "extract_commands/narrator_response",
+        lambda: extract_commands(NARRATOR_RESPONSE, STATE),
+    ),
+    ("extract_commands/long_response", lambda: extract_commands(LONG_RESPONSE, STATE)),
+    ("extract_commands/500_tag_pairs", lambda: extract_commands(MANY_TAGS, STATE)),
+    ("extract_commands/unclosed_tags", lambda: extract_commands(UNCLOSED_TAGS, STATE)),
+    ("extract_fenced_json/typical", lambda: extract_fenced_json(FENCED_JSON)),
+    ("extract_fenced_json/huge_scene", lambda: extract_fenced_json(HUGE_FENCED_JSON)),
+    (
+        "extract_fenced_json/unclosed_fence",
+        quietly(extract_fenced_json, UNCLOSED_FENCE),
+    ),
+    (
+        "extract_fenced_json/broken_json",
+        quietly(extract_fenced_json, BROKEN_JSON_FENCE),
+    ),
+    (
+        "extract_from_fenced_code_block/typical",
+        lambda: extract_from_fenced_code_block(FENCED_JSON),
+    ),
+    (
+        "extract_from_fenced_code_block/2000_fences",
+        lambda: extract_from_fenced_code_block(MANY_FENCES),
+    ),
+    ("scene_to_text/typical", lambda: scene_to_text(TYPICAL_SCENE)),
+    ("scene_to_text/huge", lambda: scene_to_text(HUGE_SCENE)),
+    ("scene_to_compact_text/huge", lambda: scene_to_compact_text(HUGE_SCENE)),
+    (
+        "scene_to_prompt_text/huge_trimmed",
+        lambda: scene_to_prompt_text(HUGE_SCENE, 1500),
+    ),
+    (
+        "format_readable_scene/typical",
+        lambda: format_readable_scene(TYPICAL_SCENE, STATE),
+    ),
+    (
+        "format_readable_scene/huge",
+        lambda: format_readable_scene(HUGE_SCENE, HUGE_STATE),
+    ),
+    ("game_state/turn", lambda: turn(STATE)),
+    (f"game_state/turn_for_{PLAYERS}_players", lambda: turns_for_players(HUGE_STATE)),
+    ("validate/typical_scene", lambda: validate(VALID_SCENE)),
+    ("validate/huge_scene", lambda: validate(VALID_HUGE_SCENE)),
+    (
+        "retrieval/recall_from_5000_scenes",
+        lambda: MEMORY.recall("look at the dripping water", k=4, max_tokens=200),
+    ),
+]
+
+
+def measure(case: Callable[[], object]) -> float:
+    "Best seconds per call."
+    timer = timeit.Timer(case)
+    number, _ = timer.autorange()
+    number = max(1, int(number * TARGET_SECONDS / 0.2))
+    return min(timer.repeat(repeat=REPEAT, number=number)) / number
+
+
+def load_baselines() -> Dict[str, float]:
+    if not os.path.exists(BASELINES):
+        return {}
+    with open(BASELINES, encoding="utf-8") as f:
+        return json.load(f)["seconds_per_call"]
+
+
+def save_baselines(results: Dict[str, float]):
+    with open(BASELINES, "w", encoding="utf-8") as f:
+        json.dump(
+            {
+                "python": sys.version.split()[0],
+                "seconds_per_call": {name: results[name] for name in sorted(results)},
+            },
+            f,
+            indent=2,
+        )
+        f.write("\n")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--update", action="store_true", help="record new baselines")
+    parser.add_argument("--threshold", type=float, default=1.5)
+    parser.add_argument("--filter", default="", help="only run cases containing this")
+    args = parser.parse_args()
+    # Trimming a huge scene logs at INFO on every call
+    logging.disable(logging.INFO)
+
+    baselines = load_baselines()
+    results = {}
+    regressions = []
+
+    print(f"{'case':48} {'per call':>12} {'baseline':>12} {'ratio':>7}")
+    for name, case in CASES:
+        if args.filter not in name:
+            continue
+        results[name] = measure(case)
+        baseline = baselines.get(name)
+        ratio = results[name] / baseline if baseline else None
+        flag = ""
+        if ratio is not None and ratio > args.threshold:
+            regressions.append(name)
+            flag = "  REGRESSION"
+        compared = f"{baseline * 1e6:10.1f}µs {ratio:6.2f}x" if baseline else ""
+        print(f"{name:48} {results[name] * 1e6:10.1f}µs {compared}{flag}")
+
+    if args.update:
+        save_baselines({**baselines, **results})
+        print(f"\nBaselines written to {BASELINES}")
+        return 0
+
+    if regressions:
+        print(f"\n{len(regressions)} case(s) over {args.threshold}x their baseline.")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,93 @@
+import threading
+from functools import cache
+from typing import Dict, Type, TypeVar
+
+from lib.config import (
+    GAME_CONFIG,
+    LLM_WARMUP,
+    backend_client,
+    cascade_for,
+    client,
+    endpoints_for,
+    routed,
+    llm_config_for,
+    uses_openai,
+)
+from lib.logger import logger
+
+T = TypeVar("T")
+
+
+@cache
+def shared(agent_class: Type[T]) -> T:
+    """The one instance of an agent class for this process.
+
+    Agents only hold their config and client, so there's no reason to build
+    a new one (and re-read the config) for every command.
+    """
+    return agent_class()
+
+
+def check_backends() -> Dict[str, bool]:
+    """Ask each backend the agents use for its models. Returns whether each answered.
+
+    Agents routed across several endpoints have each endpoint checked, by URL,
+    and every model in an agent's cascade counts, whatever backend it's on.
+    """
+    backends = {}
+    for agent_name in GAME_CONFIG["agents"]:
+        endpoints = endpoints_for(agent_name)
+        if endpoints:
+            router, _ = routed(endpoints)
+            for endpoint in router.endpoints:
+                backends[endpoint.base_url] = router.client_for(endpoint, False)
+            continue
+        for model in cascade_for(agent_name):
+            name = "openai" if uses_openai({"model": model}) else "local"
+            backends[name] = backend_client(name)
+
+    healthy = {}
+    for name, llm_client in sorted(backends.items()):
+        try:
+            llm_client.with_options(timeout=5, max_retries=0).models.list()
+            healthy[name] = True
+        except Exception as e:
+            logger.warning(
+                "LLM backend %s (%s) isn't answering: %s", name, llm_client.base_url, e
+            )
+            healthy[name] = False
+    return healthy
+
+
+def warm_up():
+    """Send each model the agents use a one-token request.
+
+    That makes the backend load the model and opens the pooled connections
+    before the player's first turn, rather than during it.
+    """
+    warmed = set()
+    for agent_name in GAME_CONFIG["agents"]:
+        llm_config = llm_config_for(agent_name)
+        if llm_config["model"] in warmed:
+            continue
+        warmed.add(llm_config["model"])
+        try:
+            client(llm_config, agent_name).chat.completions.create(
+                model=llm_config["model"],
+                messages=[{"role": "user", "content": "Hello"}],
+                max_tokens=1,
+            )
+        except Exception as e:
+            logger.warning("Warm-up for %s failed: %s", llm_config["model"], e)
+
+
+def start(warm: bool = LLM_WARMUP) -> Dict[str, bool]:
+    "Check the backends, and warm them up in the background if asked to."
+    healthy = check_backends()
+    for name, ok in healthy.items():
+        if not ok:
+            print(f"Warning: the {name} LLM backend isn't answering.")
+
+    if warm and any(healthy.values()):
+        threading.Thread(target=warm_up, name="llm-warm-up", daemon=True).start()
+    return healthy
@@ -0,0 +1,77 @@
+import asyncio
+import concurrent.futures
+import contextvars
+import inspect
+import threading
+from typing import Any, Coroutine, TypeVar
+
+T = TypeVar("T")
+
+_loop: asyncio.AbstractEventLoop | None = None
+_lock = threading.Lock()
+
+
+def event_loop() -> asyncio.AbstractEventLoop:
+    """The process-wide event loop the async agents run on.
+
+    It lives on its own daemon thread and is never closed, so the AsyncOpenAI
+    clients (whose connection pools are bound to a loop) can be reused from
+    one turn to the next.
+    """
+    global _loop
+
+    with _lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(
+                target=_loop.run_forever, name="agents-event-loop", daemon=True
+            ).start()
+    return _loop
+
+
+def run_sync(coroutine: Coroutine[Any, Any, T]) -> T:
+    """Run a coroutine on the agents' event loop and block until it's done.
+
+    It runs in a copy of the caller's context, so context variables such as
+    the LLM session and the current trace span carry over.
+    """
+    loop = event_loop()
+    context = contextvars.copy_context()
+    result: concurrent.futures.Future = concurrent.futures.Future()
+
+    def finished(task: asyncio.Task):
+        if task.cancelled():
+            result.cancel()
+        elif task.exception() is not None:
+            result.set_exception(task.exception())
+        else:
+            result.set_result(task.result())
+
+    def start():
+        loop.create_task(coroutine, context=context).add_done_callback(finished)
+
+    loop.call_soon_threadsafe(start)
+    return result.result()
+
+
+class Blocking:
+    """Wraps an object with async methods so they can be called like sync ones.
+
+    e.g. `Blocking(AsyncNarrator()).go(...)` returns a GameState, not a coroutine.
+    """
+
+    def __init__(self, target):
+        self.target = target
+
+    def __getattr__(self, name: str):
+        attribute = getattr(self.target, name)
+        if not callable(attribute):
+            return attribute
+
+        def call(*args, **kwargs):
+            result = attribute(*args, **kwargs)
+            if inspect.iscoroutine(result):
+                return run_sync(result)
+            return result
+
+        return call
@@ -0,0 +1,87 @@
+import contextvars
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Deque, List
+
+from lib.agent_runtime import shared
+from lib.config import PLOTTER_EVERY
+from lib.game_state import GameState
+from lib.llm_scheduler import Priority, prioritised
+from lib.logger import logger
+from lib.plotter_agent import Plotter
+
+# What happened in the turns since the last update that goes in the prompt
+EVENTS_KEPT = 20
+
+_executor: ThreadPoolExecutor | None = None
+_executor_lock = threading.Lock()
+
+
+def executor() -> ThreadPoolExecutor:
+    "One worker for every player's story updates, so they never compete with turns."
+    global _executor
+
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="plotter")
+    return _executor
+
+
+class BackgroundPlotter:
+    """Keeps one player's story up to date without ever holding up a turn.
+
+    `after_turn` notes what happened and, once `every` turns have passed
+    since the last update started, starts the Plotter on a worker thread. `merge`, at the start of a later turn, puts
+    the new story into the state if the Plotter has finished, and otherwise
+    leaves the state alone and checks again next turn.
+    """
+
+    def __init__(self, every: int = PLOTTER_EVERY):
+        self.every = every
+        self.events: Deque[str] = deque(maxlen=EVENTS_KEPT)
+        self.job: Future | None = None
+        self.last_plotted_turn = 0
+
+    def after_turn(self, state: GameState):
+        if self.every <= 0:
+            return
+        action = state.engine.get("last_action")
+        if action:
+            self.events.append(
+                f"'{action}': {state.feedback}" if state.feedback else f"'{action}'"
+            )
+
+        turn_count = state.engine.get("turn_count", 0)
+        # Not `turn_count % every`: a slow update would skip every multiple it overlaps
+        if turn_count - self.last_plotted_turn >= self.every and self.job is None:
+            events = list(self.events)
+            self.events.clear()
+            self.last_plotted_turn = turn_count
+            logger.info("Updating the story in the background at turn %s", turn_count)
+            # In the player's context, so the update is queued as their session
+            context = contextvars.copy_context()
+            self.job = executor().submit(context.run, self._plot, state, events)
+
+    def merge(self, state: GameState) -> GameState:
+        "The state with the latest story, if there's a new one ready."
+        if self.job is None or not self.job.done():
+            return state
+
+        job, self.job = self.job, None
+        try:
+            story = job.result()
+        except Exception:
+            logger.exception("Background story update failed")
+            return state
+        if story is None:
+            return state
+        return state.evolve(story=story)
+
+    def _plot(self, state: GameState, events: List[str]) -> dict | None:
+        plotter = shared(Plotter)
+        with prioritised(Priority.BACKGROUND):
+            new_state = plotter.prompt(plotter.user_prompt(state, events), state)
+        if new_state.story is state.story:
+            return None
+        return new_state.story
@@ -0,0 +1,177 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+from types import SimpleNamespace
+from typing import TYPE_CHECKING, Any, Callable, Dict
+
+from lib.logger import logger
+from lib.tracing import start_span
+
+if TYPE_CHECKING:
+    from openai.types.chat import ChatCompletion
+
+# Set this around a request to only keep responses the caller would accept,
+# so a rejected one isn't handed back to every later attempt. Anything with
+# content is kept otherwise.
+cache_accepts: ContextVar[Callable[[str], bool]] = ContextVar(
+    "cache_accepts", default=bool
+)
+
+
+@contextmanager
+def cached_if(accept: Callable[[str], bool]):
+    token = cache_accepts.set(accept)
+    try:
+        yield
+    finally:
+        cache_accepts.reset(token)
+
+
+def cacheable(response: Any) -> bool:
+    choices = getattr(response, "choices", None)
+    content = choices[0].message.content if choices else None
+    return bool(content) and cache_accepts.get()(content)
+
+
+class CompletionCache:
+    """Chat completions on disk, one JSON file per request, named by its hash.
+
+    The key covers everything sent to the backend (model, sampling params and
+    messages), so a change to any of them is a miss. Entries older than
+    `max_age` seconds are dropped when read, and the least recently used
+    entries go once the directory grows past `max_bytes`.
+    """
+
+    def __init__(self, directory: str | Path, max_bytes: int, max_age: int):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+        # key -> file size, least recently used first
+        self.entries: OrderedDict[str, int] = OrderedDict()
+        for path in sorted(
+            self.directory.glob("*.json"), key=lambda path: path.stat().st_mtime
+        ):
+            self.entries[path.stem] = path.stat().st_size
+        self.size = sum(self.entries.values())
+
+    @staticmethod
+    def key(request: Dict[str, Any]) -> str:
+        payload = json.dumps(request, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> "ChatCompletion | None":
+        from openai.types.chat import ChatCompletion
+
+        path = self.directory / f"{key}.json"
+        with self.lock:
+            if key not in self.entries:
+                self.misses += 1
+                return None
+            try:
+                if time.time() - path.stat().st_mtime > self.max_age:
+                    self._evict(key)
+                    self.misses += 1
+                    return None
+                response = ChatCompletion.model_validate_json(path.read_bytes())
+            except (OSError, ValueError):
+                self._evict(key)
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return response
+
+    def put(self, key: str, response: "ChatCompletion"):
+        data = response.model_dump_json().encode("utf-8")
+        with self.lock:
+            (self.directory / f"{key}.json").write_bytes(data)
+            self.size += len(data) - self.entries.pop(key, 0)
+            self.entries[key] = len(data)
+            while self.size > self.max_bytes and len(self.entries) > 1:
+                self._evict(next(iter(self.entries)))
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "entries": len(self.entries),
+            "bytes": self.size,
+        }
+
+    def _evict(self, key: str):
+        self.size -= self.entries.pop(key, 0)
+        self.evictions += 1
+        try:
+            os.remove(self.directory / f"{key}.json")
+        except FileNotFoundError:
+            pass
+
+
+class CachingClient:
+    """Wraps an OpenAI client so `chat.completions.create` goes through the cache.
+
+    Streamed requests are passed straight through, and responses that aren't
+    `cacheable` are returned without being stored.
+    """
+
+    def __init__(self, llm_client, cache: CompletionCache):
+        self.llm_client = llm_client
+        self.cache = cache
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def record_hit(self, request: Dict[str, Any]):
+        "An llm span for a request the cache answered. No tokens were spent on it."
+        hit_span = start_span(
+            "llm",
+            agent=getattr(self.llm_client, "agent", None),
+            model=request.get("model"),
+            cache_hit=True,
+        )
+        hit_span.end()
+
+    def create(self, **request):
+        if request.get("stream"):
+            return self.llm_client.chat.completions.create(**request)
+
+        key = self.cache.key(request)
+        response = self.cache.get(key)
+        if response is not None:
+            logger.info("Completion cache hit: %s", key)
+            self.record_hit(request)
+            return response
+
+        response = self.llm_client.chat.completions.create(**request)
+        if cacheable(response):
+            self.cache.put(key, response)
+        return response
+
+
+class AsyncCachingClient(CachingClient):
+    async def create(self, **request):
+        if request.get("stream"):
+            return await self.llm_client.chat.completions.create(**request)
+
+        key = self.cache.key(request)
+        response = self.cache.get(key)
+        if response is not None:
+            logger.info("Completion cache hit: %s", key)
+            self.record_hit(request)
+            return response
+
+        response = await self.llm_client.chat.completions.create(**request)
+        if cacheable(response):
+            self.cache.put(key, response)
+        return response
@@ -1,20 +1,58 @@
+import hashlib
+import marshal
 import os
+from functools import cache
 from pathlib import Path
-from xml.etree.ElementInclude import include
+from typing import TYPE_CHECKING, Any
 
-import openai
-from referencing import Registry, Resource
-from referencing.exceptions import NoSuchResource
+from referencing import Registry
 
-import yaml
-from openai import OpenAI
+from lib.completion_cache import AsyncCachingClient, CachingClient, CompletionCache
+from lib.llm_scheduler import AsyncScheduledClient, ScheduledClient, Scheduler
+from lib.router import AsyncRoutedClient, Endpoint, RoutedClient, Router
+
+if TYPE_CHECKING:
+    from openai import AsyncOpenAI, OpenAI
 
 registry = Registry()
 
 PROJECT_PATH = Path(__file__).resolve().parent.parent.absolute()
 MODULE_NAME = os.getenv("CONTENT_MODULE", "default")
 MODULE_DIR = PROJECT_PATH / "content_modules" / MODULE_NAME
-GAME_CONFIG = yaml.safe_load(open(f"{MODULE_DIR}/config.yml", "r", encoding="utf-8"))
+CONFIG_CACHE_DIR = Path(os.getenv("CONFIG_CACHE_DIR", PROJECT_PATH / "__pycache__"))
+
+
+def load_yaml(path: Path) -> Any:
+    """Parses a YAML file, through a marshal cache keyed by the file's hash.
+
+    Parsing the content module's config is most of what importing this module
+    costs, and it rarely changes between runs. If the cache can't be written
+    the file is just parsed every time.
+    """
+    data = path.read_bytes()
+    digest = hashlib.sha256(data).hexdigest()
+    cache_path = CONFIG_CACHE_DIR / f"{path.parent.name}.{path.name}.marshal"
+
+    try:
+        cached_digest, parsed = marshal.loads(cache_path.read_bytes())
+        if cached_digest == digest:
+            return parsed
+    except (OSError, EOFError, ValueError, TypeError):
+        pass
+
+    import yaml
+
+    parsed = yaml.safe_load(data)
+    try:
+        CONFIG_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        cache_path.write_bytes(marshal.dumps((digest, parsed)))
+    except (OSError, ValueError):
+        # Not writable, or holds something marshal can't store (e.g. dates)
+        pass
+    return parsed
+
+
+GAME_CONFIG = load_yaml(MODULE_DIR / "config.yml")
 SCHEMAS_DIR = MODULE_DIR / "schemas"
 
 
@@ -23,17 +61,217 @@ LLM_BASE_URL = "http://localhost:1234/v1"  # for LM Studio
 API_KEY = "lm-studio"
 
 SPEAK_TO_ME = True if os.getenv("SPEAK_TO_ME") == "true" else False
+TTS_BACKEND = os.getenv("TTS_BACKEND", "openai")  # or "stub"
+TTS_MODEL = os.getenv("TTS_MODEL", "tts-1")
+TTS_VOICE = os.getenv("TTS_VOICE", "alloy")
+TTS_WORKERS = int(os.getenv("TTS_WORKERS", "3"))
+TTS_CACHE_DIR = Path(os.getenv("TTS_CACHE_DIR", CONFIG_CACHE_DIR / "speech"))
+ASYNC_AGENTS = True if os.getenv("ASYNC_AGENTS") == "true" else False
+SPECULATIVE_SCENES = True if os.getenv("SPECULATIVE_SCENES") == "true" else False
+SPECULATIVE_WORKERS = int(os.getenv("SPECULATIVE_WORKERS", "2"))
+WORLD_DB = os.getenv("WORLD_DB", ":memory:")
+WORLD_CACHE_SIZE = int(os.getenv("WORLD_CACHE_SIZE", "256"))
+MUD_HOST = os.getenv("MUD_HOST", "127.0.0.1")
+MUD_PORT = int(os.getenv("MUD_PORT", "4000"))
+LLM_CACHE_DIR = os.getenv("LLM_CACHE_DIR")
+LLM_CACHE_MAX_BYTES = int(os.getenv("LLM_CACHE_MAX_BYTES", str(100 * 1024 * 1024)))
+LLM_CACHE_MAX_AGE = int(os.getenv("LLM_CACHE_MAX_AGE", str(7 * 24 * 60 * 60)))
+LOCAL_LLM_CONCURRENCY = int(os.getenv("LOCAL_LLM_CONCURRENCY", "2"))
+OPENAI_CONCURRENCY = int(os.getenv("OPENAI_CONCURRENCY", "8"))
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "120"))
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", "5"))
+LLM_KEEPALIVE = float(os.getenv("LLM_KEEPALIVE", "300"))
+LLM_WARMUP = True if os.getenv("LLM_WARMUP") == "true" else False
+PROMPT_BUDGET = int(os.getenv("PROMPT_BUDGET", "2000"))
+MEMORY_TOKENS = int(os.getenv("MEMORY_TOKENS", "200"))
+MEMORY_TOP_K = int(os.getenv("MEMORY_TOP_K", "4"))
+LOCAL_RESOLVER = False if os.getenv("LOCAL_RESOLVER") == "false" else True
+PLOTTER_EVERY = int(os.getenv("PLOTTER_EVERY", "5"))
+UNDO_DEPTH = int(os.getenv("UNDO_DEPTH", "20"))
+JOURNAL_DIR = os.getenv("JOURNAL_DIR", str(PROJECT_PATH / "saves"))
+JOURNAL_SNAPSHOT_EVERY = int(os.getenv("JOURNAL_SNAPSHOT_EVERY", "20"))
+JOURNAL_MAX_ENTRIES = int(os.getenv("JOURNAL_MAX_ENTRIES", "1000"))
+
+completion_cache = (
+    CompletionCache(LLM_CACHE_DIR, LLM_CACHE_MAX_BYTES, LLM_CACHE_MAX_AGE)
+    if LLM_CACHE_DIR
+    else None
+)
+
+
+# One scheduler per backend, shared by its sync and async clients
+local_scheduler = Scheduler(LOCAL_LLM_CONCURRENCY)
+openai_scheduler = Scheduler(OPENAI_CONCURRENCY)
+
+
+def with_completion_cache(llm_client, is_async: bool):
+    if completion_cache is None:
+        return llm_client
+    if is_async:
+        return AsyncCachingClient(llm_client, completion_cache)
+    return CachingClient(llm_client, completion_cache)
+
+
+def http_options(concurrency: int) -> dict:
+    """Connection pool settings for one backend's HTTP client.
+
+    There's no point holding more connections open than the scheduler will
+    ever use at once, and keeping them alive between turns saves the
+    connection setup on every request.
+    """
+    from openai import DEFAULT_CONNECTION_LIMITS, Timeout
+
+    # The Limits class of whichever httpx the openai package is built on
+    Limits = type(DEFAULT_CONNECTION_LIMITS)
+    return {
+        "limits": Limits(
+            max_connections=concurrency,
+            max_keepalive_connections=concurrency,
+            keepalive_expiry=LLM_KEEPALIVE,
+        ),
+        "timeout": Timeout(LLM_TIMEOUT, connect=LLM_CONNECT_TIMEOUT),
+    }
+
+
+def backend_client(backend: str, is_async: bool = False) -> "OpenAI | AsyncOpenAI":
+    """The OpenAI client for "local" (LM Studio) or "openai", built on first use.
+
+    Importing openai takes most of a second, so it waits until a request is
+    actually made, and a backend no agent uses is never built at all.
+    """
+    return _backend_client(backend, is_async)
+
+
+@cache
+def _backend_client(backend: str, is_async: bool):
+    import openai
+
+    if is_async:
+        client_class, http_client = openai.AsyncOpenAI, openai.DefaultAsyncHttpxClient
+    else:
+        client_class, http_client = openai.OpenAI, openai.DefaultHttpxClient
+
+    if backend == "openai":
+        return client_class(
+            api_key=OPENAI_API_KEY,
+            http_client=http_client(**http_options(OPENAI_CONCURRENCY)),
+        )
+    return client_class(
+        base_url=LLM_BASE_URL,
+        api_key=API_KEY,
+        http_client=http_client(**http_options(LOCAL_LLM_CONCURRENCY)),
+    )
 
-local_client = OpenAI(base_url=LLM_BASE_URL, api_key=API_KEY)
-openai_client = OpenAI(api_key=OPENAI_API_KEY)
 
+_BACKEND_CLIENTS = {
+    "local_client": ("local", False),
+    "openai_client": ("openai", False),
+    "async_local_client": ("local", True),
+    "async_openai_client": ("openai", True),
+}
 
-def client(llm_config: dict = {}) -> OpenAI:
+
+def __getattr__(name: str):
+    # The old module-level clients, so `from lib.config import local_client` still works
+    if name in _BACKEND_CLIENTS:
+        return backend_client(*_BACKEND_CLIENTS[name])
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def uses_openai(llm_config: dict) -> bool:
     openai_models = ["gpt-3.5-turbo", "gpt-4-turbo", "gpt-4", "gpt-4o"]
 
-    if llm_config.get("model") in openai_models:
-        return openai_client
-    return local_client
+    return llm_config.get("model") in openai_models
+
+
+def endpoints_for(agent_name: str | None) -> tuple:
+    """Each (base_url, api_key, concurrency) an agent's requests are routed to.
+
+    Empty unless the agent has an `endpoints` list in config.yml.
+    """
+    if agent_name is None:
+        return ()
+    endpoints = GAME_CONFIG["agents"].get(agent_name, {}).get("endpoints") or []
+    return tuple(
+        (
+            endpoint["base_url"],
+            endpoint.get("api_key", API_KEY),
+            endpoint.get("concurrency", LOCAL_LLM_CONCURRENCY),
+        )
+        for endpoint in endpoints
+    )
+
+
+@cache
+def routed(endpoints: tuple) -> tuple[Router, Scheduler]:
+    """The router and scheduler for a set of endpoints.
+
+    Agents configured with the same endpoints share them, so what one agent
+    learns about an endpoint's speed and health the others use too.
+    """
+    router = Router([Endpoint(*endpoint) for endpoint in endpoints], endpoint_client)
+    return router, Scheduler(sum(endpoint.concurrency for endpoint in router.endpoints))
+
+
+def schedulers() -> dict[str, Scheduler]:
+    "Every scheduler in use, by the backend or endpoints it schedules for."
+    named = {"local": local_scheduler, "openai": openai_scheduler}
+    for agent_name in GAME_CONFIG["agents"]:
+        endpoints = endpoints_for(agent_name)
+        if endpoints:
+            _, scheduler = routed(endpoints)
+            named[",".join(base_url for base_url, _, _ in endpoints)] = scheduler
+    return named
+
+
+def endpoint_client(endpoint: Endpoint, is_async: bool) -> "OpenAI | AsyncOpenAI":
+    return _endpoint_client(
+        endpoint.base_url, endpoint.api_key, endpoint.concurrency, is_async
+    )
+
+
+@cache
+def _endpoint_client(base_url: str, api_key: str, concurrency: int, is_async: bool):
+    import openai
+
+    if is_async:
+        client_class, http_client = openai.AsyncOpenAI, openai.DefaultAsyncHttpxClient
+    else:
+        client_class, http_client = openai.OpenAI, openai.DefaultHttpxClient
+    # No retries: the router moves on to another endpoint rather than wait
+    return client_class(
+        base_url=base_url,
+        api_key=api_key,
+        max_retries=0,
+        http_client=http_client(**http_options(concurrency)),
+    )
+
+
+def client(llm_config: dict = {}, agent: str | None = None) -> "OpenAI":
+    "The client for an agent's requests: completion cache, then the backend's scheduler."
+    endpoints = endpoints_for(agent)
+    if endpoints:
+        router, scheduler = routed(endpoints)
+        scheduled = ScheduledClient(RoutedClient(router), scheduler, agent)
+    elif uses_openai(llm_config):
+        scheduled = ScheduledClient(backend_client("openai"), openai_scheduler, agent)
+    else:
+        scheduled = ScheduledClient(backend_client("local"), local_scheduler, agent)
+    return with_completion_cache(scheduled, is_async=False)
+
+
+def async_client(llm_config: dict = {}, agent: str | None = None) -> "AsyncOpenAI":
+    endpoints = endpoints_for(agent)
+    if endpoints:
+        router, scheduler = routed(endpoints)
+        scheduled = AsyncScheduledClient(AsyncRoutedClient(router), scheduler, agent)
+    elif uses_openai(llm_config):
+        raw = backend_client("openai", is_async=True)
+        scheduled = AsyncScheduledClient(raw, openai_scheduler, agent)
+    else:
+        raw = backend_client("local", is_async=True)
+        scheduled = AsyncScheduledClient(raw, local_scheduler, agent)
+    return with_completion_cache(scheduled, is_async=True)
 
 
 def llm_config_for(agent_name: str) -> dict:
@@ -60,3 +298,25 @@ def llm_config_for(agent_name: str) -> dict:
             "presence_penalty", default_config["presence_penalty"]
         ),
     }
+
+
+def cascade_for(agent_name: str) -> list[str]:
+    """The models an agent tries in turn, cheapest first.
+
+    Just its `model`, unless it has a `cascade` list in config.yml.
+    """
+    cascade = GAME_CONFIG["agents"][agent_name].get("cascade")
+    return list(cascade) if cascade else [llm_config_for(agent_name)["model"]]
+
+
+def prompt_budget_for(agent_name: str) -> int:
+    """Roughly how many tokens an agent's prompts may take.
+
+    Kept out of llm_config_for, since that is passed straight to the API.
+    """
+    return GAME_CONFIG["agents"][agent_name].get("prompt_budget", PROMPT_BUDGET)
+
+
+def memory_tokens_for(agent_name: str) -> int:
+    "How many tokens of recalled snippets an agent's prompts get; 0 for none."
+    return GAME_CONFIG["agents"][agent_name].get("memory_tokens", MEMORY_TOKENS)
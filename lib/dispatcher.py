@@ -1,12 +1,65 @@
+import asyncio
+import contextvars
 import re
 
-from typing import Any, Dict, List
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, AsyncIterable, Callable, Dict, Iterable, List
 
+from lib.agent_runtime import shared
 from lib.logger import logger
-from lib.json_cruncher_agent import JSONCruncher
-from lib.scene_generator_agent import SceneGenerator
+from lib.journal import note_command
+from lib.json_cruncher_agent import AsyncJSONCruncher, InvalidJSONError, JSONCruncher
+from lib.scene_generator_agent import AsyncSceneGenerator, SceneGenerator
+from lib.speculative import speculator
+from lib.tracing import traced
+from lib.world_graph import world
 from lib.game_state import GameState
 
+# A tag can't contain < or >, so a stray < fails to match at once instead of
+# scanning to the end of the text, which made runs of them quadratic
+COMMAND_PATTERN = re.compile(r"(?s)<([^<>]*)>\s(.*?)(?=<|$)")
+TAG_PATTERN = re.compile(r"(?s)<([^<>]*)>\s")
+# The commands dispatch_command knows how to carry out
+COMMANDS = frozenset(
+    {"generate_scene", "update_scene", "noop", "feedback", "restructure_scene"}
+)
+
+
+def command_dict_for(command: str, parameters: str, state: GameState) -> Dict[str, Any]:
+    "Build the dictionary for a single <TAG> and the text that followed it."
+    command_dict = {
+        "command": command_name(command),
+        "parameters": parameters.strip(),
+    }
+    # If the command is "generate_scene", add the "last_scene" key to the dictionary,
+    # and the exit being taken, if the narrator was asked to move the player
+    if command_dict["command"] == "generate_scene":
+        command_dict["last_scene"] = state.current_scene
+        command_dict["exit"] = state.engine.get("exit")
+
+    # If the command is "update_scene", add the "scene" key to the dictionary
+    if command_dict["command"] == "update_scene":
+        command_dict["scene"] = state.current_scene
+
+    return command_dict
+
+
+def command_name(tag: str) -> str:
+    return tag.lower().replace(" ", "_")
+
+
+def known_command(tag: str) -> bool:
+    "Whether a <TAG> can be dispatched. Others are logged and skipped."
+    if command_name(tag) in COMMANDS:
+        return True
+    logger.warning("Skipping unknown command <%s>", tag)
+    return False
+
+
+def has_command(text: str) -> bool:
+    "Whether a response has at least one <TAG> that can be dispatched."
+    return any(command_name(tag) in COMMANDS for tag in TAG_PATTERN.findall(text))
+
 
 def extract_commands(text: str, state: GameState) -> List[Dict[str, Any]]:
     """Extract commands and their parameters from an response. Returns a dictionary of the command, its parameters, and its receiver.
@@ -20,72 +73,237 @@ def extract_commands(text: str, state: GameState) -> List[Dict[str, Any]]:
 
     logger.info("Extracting commands from text: %s", text)
     # Extract all commands bracketed by < > symbols and the text following them through to the end of the line or the next command
-    pattern = r"(?s)<(.*?)>\s(.*?)(?=<|$)"
+    matches = COMMAND_PATTERN.findall(text)
 
-    # Find all matches in the text
-    matches = re.findall(pattern, text)
+    return [
+        command_dict_for(command, parameters, state)
+        for command, parameters in matches
+        if known_command(command)
+    ]
 
-    # Initialize the list of commands
-    commands = []
 
-    # For each match, create a dictionary with the command and parameters
-    for command, parameters in matches:
-        command_dict = {
-            "command": command.lower().replace(" ", "_"),
-            "parameters": parameters.strip(),
-        }
-        # If the command is "generate_scene", add the "last_scene" key to the dictionary
-        if command_dict["command"] == "generate_scene":
-            command_dict["last_scene"] = state.current_scene
+class CommandStream:
+    """Incremental version of `extract_commands` for streamed responses.
 
-        # If the command is "update_scene", add the "scene" key to the dictionary
-        if command_dict["command"] == "update_scene":
-            command_dict["scene"] = state.current_scene
+    Feed it chunks as they arrive. A `<TAG> ...` segment is complete once the
+    next `<` shows up or the stream is closed, and `feed`/`close` return the
+    commands completed by that chunk. Text for an open `<FEEDBACK>` segment is
+    handed to `on_feedback` as it arrives, so it can be shown straight away.
 
-        # Add the command dictionary to the list of commands
-        commands.append(command_dict)
+    Splits the text exactly like `extract_commands` does, and skips the same
+    unknown tags.
+    """
+
+    def __init__(
+        self,
+        state: GameState,
+        on_feedback: Callable[[str], None] | None = None,
+    ):
+        self.state = state
+        self.on_feedback = on_feedback
+        self.buffer = ""
+        self.position = 0  # everything before this has been dealt with
+        self.command: str | None = None  # tag of the open segment, if any
+        self.parameters_start = 0
+        self.feedback_sent = 0  # how much of the open segment went to on_feedback
+        self.text = ""
+
+    def feed(self, chunk: str) -> List[Dict[str, Any]]:
+        self.buffer += chunk
+        return self._scan(final=False)
+
+    def close(self) -> List[Dict[str, Any]]:
+        commands = self._scan(final=True)
+        self.text = self.buffer
+        return commands
+
+    def _scan(self, final: bool) -> List[Dict[str, Any]]:
+        commands = []
+        while True:
+            if self.command is None:
+                match = TAG_PATTERN.search(self.buffer, self.position)
+                if not match:
+                    break
+                self.command = match.group(1)
+                self.parameters_start = match.end()
+                self.feedback_sent = match.end()
+                self.position = match.end()
 
-    return commands
+            end = self.buffer.find("<", self.parameters_start)
+            if end == -1 and not final:
+                self._send_feedback(len(self.buffer))
+                break
+            if end == -1:
+                end = len(self.buffer)
 
+            self._send_feedback(end, finished=True)
+            if known_command(self.command):
+                commands.append(
+                    command_dict_for(
+                        self.command,
+                        self.buffer[self.parameters_start : end],
+                        self.state,
+                    )
+                )
+            self.command = None
+            self.position = end
+            if end == len(self.buffer):
+                break
+        return commands
 
+    def _send_feedback(self, end: int, finished: bool = False):
+        if self.on_feedback is None or self.command.lower() != "feedback":
+            return
+        text = self.buffer[self.feedback_sent : end]
+        if self.feedback_sent == self.parameters_start:
+            text = text.lstrip()
+        if finished:
+            text = text.rstrip() + "\n"
+        if text:
+            self.on_feedback(text)
+            self.feedback_sent = end
+
+
+def print_feedback(text: str):
+    print(text, end="", flush=True)
+
+
+@traced("dispatch")
 def dispatch(text: str, state: GameState) -> GameState:
     commands = extract_commands(text, state)
     logger.info("Commands to dispatch: %s", commands)
 
     for command in commands:
-        state = dispatch_command(command, state)
+        try:
+            state = dispatch_command(command, state)
+        except InvalidJSONError as e:
+            state = command_failed(command, state, e)
+
+    return state
+
+
+def command_failed(
+    command_dict: Dict[str, Any], state: GameState, error: Exception
+) -> GameState:
+    "Leave the state as it was and tell the player, rather than ending the game."
+    logger.error("Command %s failed: %s", command_dict["command"], error)
+    return state.evolve(
+        feedback="I'm sorry, something went wrong while changing the scene."
+    )
+
+
+def _dispatch_after(
+    command_dict: Dict[str, Any], previous: Future | None, state: GameState
+) -> GameState:
+    if previous is not None:
+        state = previous.result()
+    try:
+        return dispatch_command(command_dict, state)
+    except InvalidJSONError as e:
+        return command_failed(command_dict, state, e)
+
 
+@traced("dispatch_stream")
+def dispatch_stream(
+    chunks: Iterable[str],
+    state: GameState,
+    on_feedback: Callable[[str], None] | None = print_feedback,
+) -> GameState:
+    """Dispatch commands from a streamed response as soon as each one is complete.
+
+    Commands still run one after another, in order, on a single worker thread,
+    so the resulting state is the same as `dispatch` on the whole text. The
+    difference is that a `<GENERATE SCENE>` gets going while the rest of the
+    response is still arriving.
+    """
+    stream = CommandStream(state, on_feedback)
+    pending: Future | None = None
+
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix="dispatch") as executor:
+
+        def submit(command: Dict[str, Any], previous: Future | None) -> Future:
+            # In this thread's context, for the LLM session, priority and span
+            context = contextvars.copy_context()
+            return executor.submit(
+                context.run, _dispatch_after, command, previous, state
+            )
+
+        for chunk in chunks:
+            for command in stream.feed(chunk):
+                pending = submit(command, pending)
+        for command in stream.close():
+            pending = submit(command, pending)
+
+        logger.info("Streamed text: %s", stream.text)
+        if pending is not None:
+            state = pending.result()
+
+    if on_feedback is not None and state.feedback:
+        state = state.with_engine(feedback_streamed=True)
     return state
 
 
+def known_scene(command_dict: Dict[str, Any]) -> dict | None:
+    "A scene for generate_scene that needs no LLM call: visited before, or pre-generated."
+    last_scene = command_dict.get("last_scene")
+    exit_data = command_dict.get("exit")
+
+    return world.destination(last_scene, exit_data) or speculator.take(
+        last_scene, exit_data
+    )
+
+
+def remember_scene(command_dict: Dict[str, Any], state: GameState) -> GameState:
+    "Add the scene a generate_scene command arrived at to the world graph."
+    last_scene = command_dict.get("last_scene")
+    exit_data = command_dict.get("exit")
+
+    if state.current_scene is last_scene:
+        return state
+    if last_scene and exit_data and world.destination(last_scene, exit_data):
+        return state
+
+    new_scene = world.add_scene(state.current_scene)
+    if last_scene and exit_data:
+        world.connect(last_scene, exit_data, new_scene)
+    if new_scene is state.current_scene:
+        return state
+    return state.evolve(current_scene=new_scene)
+
+
+def command_attributes(command_dict: Dict[str, Any], state: GameState) -> dict:
+    return {"command": command_dict["command"]}
+
+
+@traced("dispatch_command", command_attributes)
 def dispatch_command(command_dict: Dict[str, Any], state: GameState) -> GameState:
+    note_command(command_dict)
 
     match command_dict["command"]:
         case "generate_scene":
-            state = SceneGenerator().new_scene(command_dict["parameters"], state)
+            scene = known_scene(command_dict)
+            if scene:
+                state = shared(SceneGenerator).with_scene(scene, state)
+            else:
+                state = shared(SceneGenerator).new_scene(
+                    command_dict["parameters"], state
+                )
+            state = remember_scene(command_dict, state)
         case "update_scene":
-            state = SceneGenerator().update_scene(command_dict["parameters"], state)
+            state = shared(SceneGenerator).update_scene(
+                command_dict["parameters"], state
+            )
+            world.put_scene(state.current_scene)
         case "noop":
             pass
         case "feedback":
-            state = GameState(
-                current_scene=state.current_scene,
-                inventory=state.inventory,
-                engine=state.engine,
-                story=state.story,
-                feedback=command_dict["parameters"],
-            )
+            state = state.evolve(feedback=command_dict["parameters"])
         case "restructure_scene":
-            new_scene = JSONCruncher().json_from_text(
+            new_scene = shared(JSONCruncher).json_from_text(
                 command_dict["parameters"], "scene"
             )
-            state = GameState(
-                current_scene=new_scene,
-                inventory=state.inventory,
-                engine=state.engine,
-                story=state.story,
-                feedback=state.feedback,
-            )
+            world.put_scene(new_scene)
+            state = state.evolve(current_scene=new_scene)
         case _:
             raise ValueError(
                 f"Dispatcher: Command {command_dict['command']} not recognized."
@@ -93,3 +311,95 @@ def dispatch_command(command_dict: Dict[str, Any], state: GameState) -> GameStat
             return state
 
     return state
+
+
+@traced("dispatch")
+async def dispatch_async(text: str, state: GameState) -> GameState:
+    commands = extract_commands(text, state)
+    logger.info("Commands to dispatch: %s", commands)
+
+    for command in commands:
+        try:
+            state = await dispatch_command_async(command, state)
+        except InvalidJSONError as e:
+            state = command_failed(command, state, e)
+
+    return state
+
+
+async def _dispatch_after_async(
+    command_dict: Dict[str, Any], previous: asyncio.Task | None, state: GameState
+) -> GameState:
+    if previous is not None:
+        state = await previous
+    try:
+        return await dispatch_command_async(command_dict, state)
+    except InvalidJSONError as e:
+        return command_failed(command_dict, state, e)
+
+
+@traced("dispatch_stream")
+async def dispatch_stream_async(
+    chunks: AsyncIterable[str],
+    state: GameState,
+    on_feedback: Callable[[str], None] | None = print_feedback,
+) -> GameState:
+    "The async version of `dispatch_stream`: each command becomes a task chained on the last."
+    stream = CommandStream(state, on_feedback)
+    pending: asyncio.Task | None = None
+
+    async for chunk in chunks:
+        for command in stream.feed(chunk):
+            pending = asyncio.create_task(
+                _dispatch_after_async(command, pending, state)
+            )
+    for command in stream.close():
+        pending = asyncio.create_task(_dispatch_after_async(command, pending, state))
+
+    logger.info("Streamed text: %s", stream.text)
+    if pending is not None:
+        state = await pending
+
+    if on_feedback is not None and state.feedback:
+        state = state.with_engine(feedback_streamed=True)
+    return state
+
+
+@traced("dispatch_command", command_attributes)
+async def dispatch_command_async(
+    command_dict: Dict[str, Any], state: GameState
+) -> GameState:
+    "The async version of `dispatch_command`, with the async agents."
+    note_command(command_dict)
+
+    match command_dict["command"]:
+        case "generate_scene":
+            scene = await asyncio.to_thread(known_scene, command_dict)
+            if scene:
+                state = shared(AsyncSceneGenerator).with_scene(scene, state)
+            else:
+                state = await shared(AsyncSceneGenerator).new_scene(
+                    command_dict["parameters"], state
+                )
+            state = remember_scene(command_dict, state)
+        case "update_scene":
+            state = await shared(AsyncSceneGenerator).update_scene(
+                command_dict["parameters"], state
+            )
+            world.put_scene(state.current_scene)
+        case "restructure_scene":
+            new_scene = await shared(AsyncJSONCruncher).json_from_text(
+                command_dict["parameters"], "scene"
+            )
+            world.put_scene(new_scene)
+            state = state.evolve(current_scene=new_scene)
+        case "noop":
+            pass
+        case "feedback":
+            state = state.evolve(feedback=command_dict["parameters"])
+        case _:
+            raise ValueError(
+                f"Dispatcher: Command {command_dict['command']} not recognized."
+            )
+
+    return state
@@ -0,0 +1,145 @@
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeEndpoint:
+    """A local OpenAI-compatible server that answers every chat request the same way.
+
+    For trying out the router: `delay` makes it slow and `status` makes it
+    fail (e.g. 500 or 429), and both can be changed while it runs, to take
+    it down in the middle of a session. `requests` counts what it was sent.
+    Answers are streamed if the request asks for that.
+    """
+
+    def __init__(
+        self,
+        reply: str = "<FEEDBACK> Nothing happens.",
+        delay: float = 0.0,
+        status: int = 200,
+        port: int = 0,
+    ):
+        self.reply = reply
+        self.delay = delay
+        self.status = status
+        self.requests = 0
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), self._handler())
+        self.server.daemon_threads = True
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self) -> "FakeEndpoint":
+        threading.Thread(
+            target=self.server.serve_forever, name="fake-endpoint", daemon=True
+        ).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self) -> "FakeEndpoint":
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def completion(self, model: str) -> dict:
+        return {
+            "id": "chatcmpl-fake",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [
+                {
+                    "index": 0,
+                    "message": {"role": "assistant", "content": self.reply},
+                    "finish_reason": "stop",
+                }
+            ],
+        }
+
+    def chunks(self, model: str):
+        for n, word in enumerate(self.reply.split(" ")):
+            yield {
+                "id": "chatcmpl-fake",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [
+                    {
+                        "index": 0,
+                        "delta": {"content": word if n == 0 else " " + word},
+                        "finish_reason": None,
+                    }
+                ],
+            }
+
+    def _handler(self):
+        endpoint = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def send_json(self, status: int, body: dict):
+                data = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                if not self.path.endswith("/models"):
+                    return self.send_json(404, {"error": {"message": "Not found"}})
+                self.send_json(
+                    200, {"object": "list", "data": [{"id": "fake", "object": "model"}]}
+                )
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                request = json.loads(self.rfile.read(length) or b"{}")
+                endpoint.requests += 1
+                time.sleep(endpoint.delay)
+
+                if endpoint.status != 200:
+                    return self.send_json(
+                        endpoint.status, {"error": {"message": "Fake failure"}}
+                    )
+                if not self.path.endswith("/chat/completions"):
+                    return self.send_json(404, {"error": {"message": "Not found"}})
+
+                model = request.get("model", "fake")
+                if not request.get("stream"):
+                    return self.send_json(200, endpoint.completion(model))
+
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.end_headers()
+                for chunk in endpoint.chunks(model):
+                    self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+                self.wfile.write(b"data: [DONE]\n\n")
+
+        return Handler
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a fake LLM endpoint.")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--delay", type=float, default=0.0)
+    parser.add_argument("--status", type=int, default=200)
+    parser.add_argument("--reply", default="<FEEDBACK> Nothing happens.")
+    args = parser.parse_args()
+
+    endpoint = FakeEndpoint(args.reply, args.delay, args.status, args.port)
+    print(f"Fake LLM endpoint at {endpoint.base_url}")
+    try:
+        endpoint.server.serve_forever()
+    except KeyboardInterrupt:
+        endpoint.stop()
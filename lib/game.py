@@ -0,0 +1,198 @@
+import inspect
+from contextlib import nullcontext
+from typing import Any, Awaitable, Callable, ContextManager, Dict
+
+from lib.color import color
+from lib.config import LOCAL_RESOLVER
+from lib.game_state import FrozenDict, GameState
+from lib.local_resolver import local_resolver
+from lib.narrator_agent import Narrator
+from lib.retrieval import MemoryIndex
+from lib.spinner import spinner
+from lib.tracing import current_span, in_span
+
+# Turn span labels; anything else the player types is "other", so metrics
+# get a fixed set of series however creative the input
+TURN_COMMANDS = frozenset({"look", "go", "use", "inventory", "undo", "quit"})
+
+
+class PlayerQuit(Exception):
+    "The player typed `quit`."
+
+
+def format_readable_scene(scene: Dict[str, Any], state) -> str:
+    "Print the scene JSON in a human-readable format."
+    scene_description = ""
+
+    if "title" in scene:
+        scene_description = (
+            scene_description
+            + color.bold
+            + color.underline
+            + scene["title"]
+            + color.end
+            + "\n"
+        )
+
+    scene_description += scene["description"]
+
+    if "exits" in scene:
+        scene_description += "\n\n" + color.underline + "Exits:" + color.end + "\n"
+        for exit_data in scene["exits"]:
+            if "hidden" in exit_data:
+                continue
+            scene_description += (
+                f"- {exit_data['direction'].capitalize()}: {exit_data['description']}\n"
+            )
+
+    # Streamed feedback was already printed as it arrived
+    feedback = "" if state.engine.get("feedback_streamed") else state.feedback
+    scene_description = feedback + "\n\n" + scene_description + "\nWhat do you do?\n"
+
+    return scene_description
+
+
+def narrator_spinner(narrator: Narrator, text: str) -> ContextManager:
+    "Streaming narrators print as they go, so they don't get a spinner."
+    if narrator.stream:
+        return nullcontext()
+    return spinner(text, color="cyan")
+
+
+def dispatch_user_action(
+    user_action: str,
+    state: GameState,
+    narrator: Narrator,
+    say: Callable[[str], None] = print,
+    busy: Callable[[Narrator, str], ContextManager] = narrator_spinner,
+    memory: MemoryIndex | None = None,
+) -> GameState | Awaitable[GameState]:
+    """Carry out one player action.
+
+    Anything the player should see right away goes to `say`. With an
+    AsyncNarrator, actions that need the narrator return a coroutine for the
+    caller to await. Raises PlayerQuit on `quit`. The turn is traced as a
+    "turn" span, labelled with the command and with what `served` it: the
+    local resolver ("local"), the narrator ("narrator"), the game itself, like
+    `inventory` ("builtin"), or nothing, for input it didn't understand
+    ("none"). What the narrator says goes into the game's
+    `memory`, which is the narrator's own unless another is given.
+    """
+    command = user_action.split(" ", 1)[0]
+    if command not in TURN_COMMANDS:
+        command = "other"
+    return in_span(
+        "turn",
+        lambda: carry_out(
+            user_action,
+            state,
+            narrator,
+            say,
+            busy,
+            memory if memory is not None else narrator.memory,
+        ),
+        command=command,
+        served="builtin",
+    )
+
+
+def carry_out(
+    user_action: str,
+    state: GameState,
+    narrator: Narrator,
+    say: Callable[[str], None],
+    busy: Callable[[Narrator, str], ContextManager],
+    memory: MemoryIndex,
+) -> GameState | Awaitable[GameState]:
+    resolved = local_resolver.resolve(user_action, state) if LOCAL_RESOLVER else None
+    if resolved is not None:
+        served("local")
+        return resolved
+
+    match user_action.split(" ", 1):
+        case ["quit"]:
+            say("Goodbye!")
+            raise PlayerQuit()
+        case ["inventory"]:
+            if state.inventory:
+                say("Inventory:")
+                for item in state.inventory:
+                    say(f"- {item}")
+            else:
+                say("You have no items in your inventory.")
+            return state
+        case ["look"]:
+            return state
+        case ["look", *rest]:
+            target = " ".join(rest)
+            with busy(narrator, "Interpreting command..."):
+                narrated = then(
+                    narrator.look_at(target, state),
+                    lambda after: local_resolver.remember_look(target, state, after),
+                )
+        case ["go", *rest]:
+            with busy(narrator, "Generating..."):
+                narrated = narrator.go(user_action, state)
+        case ["use", *rest]:
+            with busy(narrator, "Generating..."):
+                narrated = narrator.use(user_action, state)
+        case [_, *rest]:
+            say("Oops! I don't understand that command.")
+            served("none")
+            return state
+
+    served("narrator")
+    return then(narrated, lambda after: memory.remember(after, user_action))
+
+
+def served(by: str):
+    "Labels the turn span with what served it, if it wasn't the game itself."
+    span = current_span.get()
+    if span is not None:
+        span.set("served", by)
+
+
+def then(
+    result: GameState | Awaitable[GameState], call: Callable[[GameState], GameState]
+) -> GameState | Awaitable[GameState]:
+    "Applies `call` to a state, or to what an awaitable state resolves to."
+    if not inspect.isawaitable(result):
+        return call(result)
+
+    async def awaited():
+        return call(await result)
+
+    return awaited()
+
+
+def start_turn(state: GameState) -> GameState:
+    "Turn describe_current_scene back on and delete the feedback from the previous turn."
+    # Built directly rather than with `evolve`: this runs every turn for every player
+    return GameState(
+        current_scene=state.current_scene,
+        inventory=state.inventory,
+        engine=FrozenDict(
+            describe_current_scene=True,
+            last_action=state.engine["last_action"],
+            feedback_streamed=False,
+            turn_count=state.engine.get("turn_count", 0),
+        ),
+        story=state.story,
+        feedback="",
+    )
+
+
+def end_turn(state: GameState, user_action: str) -> GameState:
+    "Record the action and count the turn."
+    return GameState(
+        current_scene=state.current_scene,
+        inventory=state.inventory,
+        engine=FrozenDict(
+            describe_current_scene=state.engine["describe_current_scene"],
+            last_action=user_action,
+            feedback_streamed=state.engine.get("feedback_streamed", False),
+            turn_count=state.engine.get("turn_count", 0) + 1,
+        ),
+        story=state.story,
+        feedback=state.feedback,
+    )
@@ -1,22 +1,83 @@
-from typing import NamedTuple
+from collections import deque
+from typing import Any, Dict, NamedTuple, Tuple
 
 from lib.config import GAME_CONFIG
 
-GameState = NamedTuple(
-    "State",
-    [
-        ("current_scene", dict),
-        ("inventory", list),
-        ("engine", dict),
-        ("story", dict),
-        ("feedback", str),
-    ],
-)
-
-State = GameState(
-    current_scene=GAME_CONFIG["initial_scene"],
-    inventory=[],
-    engine={"describe_current_scene": True, "last_action": None, "turn_count": 0},
-    story=GAME_CONFIG["story"],
-    feedback="",
-)
+
+class FrozenDict(dict):
+    """A dict that can't be changed once it's made, so states can share it.
+
+    Build a changed copy instead, e.g. `FrozenDict(engine, last_action="look")`.
+    """
+
+    def _read_only(self, *args, **kwargs):
+        raise TypeError("FrozenDict can't be changed; build a new one instead")
+
+    __setitem__ = __delitem__ = __ior__ = _read_only
+    clear = pop = popitem = setdefault = update = _read_only
+
+    def __reduce__(self):
+        return FrozenDict, (dict(self),)
+
+
+def frozen(fields: Dict[str, Any]) -> Dict[str, Any]:
+    "The fields, with `inventory` as a tuple and `engine` as a FrozenDict."
+    if "inventory" in fields and not isinstance(fields["inventory"], tuple):
+        fields["inventory"] = tuple(fields["inventory"])
+    if "engine" in fields and not isinstance(fields["engine"], FrozenDict):
+        fields["engine"] = FrozenDict(fields["engine"])
+    return fields
+
+
+class GameState(NamedTuple):
+    """Everything about one player's game at the end of a step.
+
+    States are never changed in place: `evolve` returns a new state that
+    shares every field it doesn't replace with the old one, so keeping old
+    states (e.g. for undo) only costs what changed. Scenes and the story are
+    replaced whole, never edited.
+    """
+
+    current_scene: dict
+    inventory: Tuple[str, ...]
+    engine: Dict[str, Any]
+    story: dict
+    feedback: str
+
+    @classmethod
+    def of(cls, **fields) -> "GameState":
+        return cls(**frozen(fields))
+
+    def evolve(self, **changes) -> "GameState":
+        return self._replace(**frozen(changes))
+
+    def with_engine(self, **updates) -> "GameState":
+        return self.evolve(engine=FrozenDict(self.engine, **updates))
+
+
+class History:
+    "The last `depth` states, for undo."
+
+    def __init__(self, depth: int):
+        self.states: deque[GameState] = deque(maxlen=depth)
+
+    def push(self, state: GameState):
+        self.states.append(state)
+
+    def undo(self) -> GameState | None:
+        "The most recently pushed state, or None if there's nothing to undo."
+        return self.states.pop() if self.states else None
+
+
+def new_game_state() -> GameState:
+    "A fresh game, with its own inventory and engine state."
+    return GameState.of(
+        current_scene=GAME_CONFIG["initial_scene"],
+        inventory=(),
+        engine={"describe_current_scene": True, "last_action": None, "turn_count": 0},
+        story=GAME_CONFIG["story"],
+        feedback="",
+    )
+
+
+State = new_game_state()
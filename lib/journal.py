@@ -0,0 +1,241 @@
+import gzip
+import json
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Tuple
+
+from lib.config import JOURNAL_DIR, JOURNAL_MAX_ENTRIES, JOURNAL_SNAPSHOT_EVERY
+from lib.game_state import GameState
+from lib.logger import logger
+
+JOURNAL_FILE = "journal.jsonl"
+SNAPSHOT_GLOB = "snapshot-*.json.gz"
+
+# The commands dispatched so far this turn, while a turn is being recorded
+turn_commands: ContextVar[List[Dict[str, Any]] | None] = ContextVar(
+    "turn_commands", default=None
+)
+
+
+@contextmanager
+def recording_commands() -> Iterator[List[Dict[str, Any]]]:
+    "Collects the commands dispatched inside the block, for the journal entry."
+    commands: List[Dict[str, Any]] = []
+    token = turn_commands.set(commands)
+    try:
+        yield commands
+    finally:
+        turn_commands.reset(token)
+
+
+def note_command(command_dict: Dict[str, Any]):
+    commands = turn_commands.get()
+    if commands is not None:
+        commands.append(command_dict)
+
+
+def changes_between(before: GameState, after: GameState) -> Dict[str, Any]:
+    "The fields of `after` that differ from `before`."
+    return {
+        field: getattr(after, field)
+        for field in GameState._fields
+        if getattr(after, field) is not getattr(before, field)
+        and getattr(after, field) != getattr(before, field)
+    }
+
+
+def write_atomically(path: Path, data: bytes):
+    temporary = path.with_name(path.name + ".tmp")
+    temporary.write_bytes(data)
+    os.replace(temporary, path)
+
+
+class Journal:
+    """One session's save: an append-only log of turns plus gzipped snapshots.
+
+    Each turn appends the player's action, the commands it dispatched and the
+    GameState fields it changed. Every `snapshot_every` turns the whole state
+    is written to `snapshot-<turn>.json.gz`, so resuming loads the latest
+    snapshot and replays only the turns after it, with no LLM calls.
+    `compact` drops the entries and snapshots the latest snapshot covers; it
+    also runs by itself once the journal holds over `max_entries` turns.
+    """
+
+    def __init__(
+        self,
+        directory: Path,
+        snapshot_every: int = JOURNAL_SNAPSHOT_EVERY,
+        max_entries: int = JOURNAL_MAX_ENTRIES,
+    ):
+        self.directory = Path(directory)
+        self.snapshot_every = snapshot_every
+        self.max_entries = max_entries
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.path = self.directory / JOURNAL_FILE
+        self.file = None
+        self.turn = 0
+        self.entries = 0
+
+    @classmethod
+    def for_session(cls, name: str, **options) -> "Journal":
+        return cls(Path(JOURNAL_DIR) / name, **options)
+
+    def snapshots(self) -> List[Tuple[int, Path]]:
+        "(turn, path) for every snapshot, oldest first."
+        return sorted(
+            (int(path.name.split("-")[1].split(".")[0]), path)
+            for path in self.directory.glob(SNAPSHOT_GLOB)
+        )
+
+    def read_entries(self) -> Iterator[Dict[str, Any]]:
+        if not self.path.exists():
+            return
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    # Only the last line can be cut short, by a crash mid-write
+                    logger.warning("Skipping a broken journal entry in %s", self.path)
+
+    def read_snapshot(self, path: Path) -> Tuple[GameState, int]:
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            snapshot = json.load(f)
+        return GameState.of(**snapshot["state"]), snapshot["turn"]
+
+    def replay(self) -> Iterator[Tuple[str, GameState]]:
+        """(action, state after it) for every turn the journal still has, oldest first.
+
+        Turns that compaction folded into a snapshot are gone, so a compacted
+        journal starts with that snapshot's state, with no action.
+        """
+        entries = list(self.read_entries())
+        state, turn = None, 0
+        if not entries or entries[0]["turn"] > 1:
+            start = entries[0]["turn"] - 1 if entries else None
+            for snapshot_turn, path in reversed(self.snapshots()):
+                if start is None or snapshot_turn <= start:
+                    state, turn = self.read_snapshot(path)
+                    yield "", state
+                    break
+
+        for entry in entries:
+            if entry["turn"] <= turn:
+                continue
+            if state is None:
+                state = GameState.of(**entry["changes"])
+            else:
+                state = state.evolve(**entry["changes"])
+            turn = entry["turn"]
+            yield entry["action"], state
+
+    def load(self) -> Tuple[GameState | None, int]:
+        "The saved state and its turn number, or (None, 0) if nothing is saved."
+        state, turn = None, 0
+        snapshots = self.snapshots()
+        if snapshots:
+            state, turn = self.read_snapshot(snapshots[-1][1])
+
+        self.entries = 0
+        for entry in self.read_entries():
+            self.entries += 1
+            if entry["turn"] <= turn:
+                continue
+            if state is None:
+                state = GameState.of(**entry["changes"])
+            else:
+                state = state.evolve(**entry["changes"])
+            turn = entry["turn"]
+        return state, turn
+
+    def resume(self) -> GameState | None:
+        "Loads the saved state and carries on numbering turns after it."
+        started = time.perf_counter()
+        state, self.turn = self.load()
+        if state is not None:
+            logger.info(
+                "Resumed %s at turn %s in %.1fms",
+                self.directory,
+                self.turn,
+                (time.perf_counter() - started) * 1000,
+            )
+        return state
+
+    def record(
+        self,
+        action: str,
+        before: GameState | None,
+        after: GameState,
+        commands: List[Dict[str, Any]] | None = None,
+    ):
+        """Appends one turn. `before` is None for the first turn of a session.
+
+        The first entry of a session holds every field, so the journal can be
+        replayed before any snapshot exists.
+        """
+        self.turn += 1
+        changes = after._asdict() if before is None else changes_between(before, after)
+        entry = {
+            "turn": self.turn,
+            "time": time.time(),
+            "action": action,
+            "commands": [
+                {"command": command["command"], "parameters": command.get("parameters")}
+                for command in commands or []
+            ],
+            "changes": changes,
+        }
+        if self.file is None:
+            self.file = open(self.path, "a", encoding="utf-8")
+        self.file.write(json.dumps(entry, default=str) + "\n")
+        self.file.flush()
+        self.entries += 1
+
+        if self.turn % self.snapshot_every == 0:
+            self.snapshot(after)
+            if self.entries > self.max_entries:
+                self.compact()
+
+    def snapshot(self, state: GameState):
+        data = json.dumps({"turn": self.turn, "state": state._asdict()}, default=str)
+        write_atomically(
+            self.directory / f"snapshot-{self.turn:08d}.json.gz",
+            gzip.compress(data.encode("utf-8")),
+        )
+
+    def compact(self, keep_snapshots: int = 1):
+        """Rewrites the journal without the turns the latest snapshot covers.
+
+        If the journal has turns past the latest snapshot, a new snapshot is
+        taken first. Only the newest `keep_snapshots` snapshots are kept.
+        """
+        self.close()
+        state, turn = self.load()
+        if state is None:
+            return
+        snapshots = self.snapshots()
+        if not snapshots or snapshots[-1][0] < turn:
+            self.turn = turn
+            self.snapshot(state)
+            snapshots = self.snapshots()
+
+        latest = snapshots[-1][0]
+        kept = [entry for entry in self.read_entries() if entry["turn"] > latest]
+        write_atomically(
+            self.path,
+            "".join(json.dumps(entry, default=str) + "\n" for entry in kept).encode(
+                "utf-8"
+            ),
+        )
+        for _, path in snapshots[:-keep_snapshots]:
+            path.unlink()
+        self.entries = len(kept)
+        logger.info("Compacted %s to the snapshot at turn %s", self.directory, latest)
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
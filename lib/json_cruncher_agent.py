@@ -1,69 +1,273 @@
 import json
 import jsonschema
-from yaspin import yaspin
 
-from typing import Any, Dict
+import threading
 
-from lib.config import GAME_CONFIG, client, SCHEMAS_DIR, llm_config_for
+from collections import defaultdict
+from functools import cache
+from typing import Any, Dict, List, Tuple
+
+from lib.completion_cache import cached_if
+from lib.config import (
+    GAME_CONFIG,
+    async_client,
+    cascade_for,
+    client,
+    llm_config_for,
+    uses_openai,
+)
 from lib.logger import logger
+from lib.prompt_assembly import assemble, chat_messages
+from lib.schema_registry import schemas
+from lib.spinner import spinner
+from lib.tracing import span
 from utils import extract_fenced_json
 
 
+@cache
+def object_prompt_parts(agent_name: str, obj_type: str) -> Tuple[str, str]:
+    "The static parts of an object prompt: the instructions and the rendered examples."
+    object_prompt = GAME_CONFIG["agents"][agent_name]["object_prompts"][obj_type]
+
+    examples = "".join(
+        f"```json\n{json.dumps(example, indent=2)}\n```\n\n"
+        for example in object_prompt["examples"]
+    )
+    return object_prompt["user_prompt"], examples
+
+
+class InvalidJSONError(ValueError):
+    "The LLM couldn't produce a valid object within the attempts it was given."
+
+
+class CrunchStats:
+    "Attempts and tokens spent per object type, across every JSONCruncher."
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.by_type: Dict[str, Dict[str, int]] = defaultdict(
+            lambda: {
+                "attempts": 0,
+                "repairs": 0,
+                "successes": 0,
+                "failures": 0,
+                "prompt_tokens": 0,
+                "completion_tokens": 0,
+            }
+        )
+
+    def record_attempt(self, obj_type: str, response, repair: bool):
+        usage = getattr(response, "usage", None)
+        with self.lock:
+            stats = self.by_type[obj_type]
+            stats["attempts"] += 1
+            stats["repairs"] += 1 if repair else 0
+            if usage is not None:
+                stats["prompt_tokens"] += usage.prompt_tokens or 0
+                stats["completion_tokens"] += usage.completion_tokens or 0
+
+    def record_result(self, obj_type: str, success: bool):
+        with self.lock:
+            self.by_type[obj_type]["successes" if success else "failures"] += 1
+
+    def snapshot(self) -> Dict[str, Dict[str, int]]:
+        with self.lock:
+            return {obj_type: dict(stats) for obj_type, stats in self.by_type.items()}
+
+
+crunch_stats = CrunchStats()
+
+
 class JSONCruncher:
     def __init__(self, name="json_cruncher"):
         self.name = name
         self.system_prompt = GAME_CONFIG["agents"][self.name]["system_prompt"]
         self.llm_config = llm_config_for(self.name)
-        self.client = client(self.llm_config)
+        self.client = client(self.llm_config, self.name)
+        self.structured_output = GAME_CONFIG["agents"][self.name].get(
+            "structured_output", False
+        )
+        self.cascade = cascade_for(self.name)
+        # Clients for cascade models that aren't on the same backend as `model`
+        self.tier_clients = {}
+        # Attempts per model in the cascade: the first, then repairs
+        self.max_attempts = GAME_CONFIG["agents"][self.name].get("max_attempts", 3)
 
-    @yaspin(text="Updating state...", color="red")
     def json_from_text(self, text: str, obj_type: str) -> dict:
-        with open(SCHEMAS_DIR / f"{obj_type}_schema.json", "r") as f:
-            schema = f.read()
+        with spinner("Updating state...", color="red"):
+            return self.prompt(*self.build_prompt(text, obj_type))
 
-        logger.info(f"Prompting JSONCruncher for type {obj_type} with text: {text}")
+    def build_prompt(self, text: str, obj_type: str) -> Tuple[str, str]:
+        "Returns the prompt text and the object type to validate the response against."
+        logger.info("Prompting JSONCruncher for type %s with text: %s", obj_type, text)
 
-        examples = GAME_CONFIG["agents"][self.name]["object_prompts"][obj_type][
-            "examples"
-        ]
+        # The instructions and examples are fixed per object type, so they go
+        # before the text to convert
+        user_prompt, examples = object_prompt_parts(self.name, obj_type)
+        instructions = f"{user_prompt}\n\nExample {obj_type} object(s):"
+        prompt_text = assemble(
+            examples=f"{instructions}\n\n{examples.rstrip()}",
+            action=f"Here is the text to convert:\n\n{text}",
+        )
 
-        prompt_text = GAME_CONFIG["agents"][self.name]["object_prompts"][obj_type][
-            "user_prompt"
-        ]
-        prompt_text = prompt_text + f"\n\n{text}\n\nExample {obj_type} object(s):\n\n"
-        for example in examples:
-            prompt_text += f"```json\n{json.dumps(example, indent=2)}\n```\n\n"
+        return prompt_text, obj_type
 
-        return self.prompt(prompt_text, schema)
+    def new_client(self, llm_config: dict):
+        return client(llm_config, self.name)
 
-    def prompt(self, prompt_text, schema: str) -> dict:
+    def client_for(self, model: str):
+        "The client for one model in the cascade, on whichever backend serves it."
+        if uses_openai({"model": model}) == uses_openai(self.llm_config):
+            return self.client
+        if model not in self.tier_clients:
+            self.tier_clients[model] = self.new_client(
+                {**self.llm_config, "model": model}
+            )
+        return self.tier_clients[model]
 
-        response = client(self.llm_config).chat.completions.create(
-            messages=[
-                {"role": "system", "content": self.system_prompt},
-                {"role": "user", "content": prompt_text},
-            ],
-            **self.llm_config,
-        )
-        if response.choices[0].message.content:
-            return self.handle_llm_response(response, schema, prompt_text)
-        else:
-            raise Exception("No response from LLM.")
+    def request_options(
+        self, obj_type: str, model: str | None = None
+    ) -> Dict[str, Any]:
+        """The LLM config, plus the object schema as the response format in structured output mode.
+
+        LM Studio and llama.cpp servers turn a JSON schema response format into
+        a grammar, so the model can only produce JSON of the right shape.
+        """
+        llm_config = {**self.llm_config, "model": model or self.llm_config["model"]}
+        if not self.structured_output:
+            return llm_config
+        return {
+            **llm_config,
+            "response_format": {
+                "type": "json_schema",
+                "json_schema": {"name": obj_type, "schema": schemas.schema(obj_type)},
+            },
+        }
+
+    def prompt(self, prompt_text, obj_type: str) -> dict:
+        """Asks each model in the cascade in turn for a valid object.
+
+        Each model gets the whole prompt, then up to `max_attempts - 1` repair
+        prompts, before the next model is asked.
+        """
+        original = chat_messages(self.system_prompt, prompt_text)
+        attempt = 0
+
+        for tier, model in enumerate(self.cascade, 1):
+            messages = original
+            llm_client = self.client_for(model)
+            with span("cascade", agent=self.name, tier=tier, model=model) as tiered:
+                for retry in range(self.max_attempts):
+                    attempt += 1
+                    with span(
+                        "json_attempt", obj_type=obj_type, attempt=attempt
+                    ) as tried:
+                        with cached_if(self.valid(obj_type)):
+                            response = llm_client.chat.completions.create(
+                                messages=messages,
+                                **self.request_options(obj_type, model),
+                            )
+                        content_dict, messages = self.handle_llm_response(
+                            response, obj_type, messages, repair=retry > 0
+                        )
+                        tried.set("valid", messages is None)
+                    if messages is None:
+                        break
+                tiered.set("accepted", messages is None)
+            if messages is None:
+                return content_dict
+
+        return self.give_up(obj_type)
+
+    def valid(self, obj_type: str):
+        "Whether a response is a valid `obj_type` object, without logging or repair."
+        validator = schemas.validator(obj_type)
+        return lambda content: validator.is_valid(extract_fenced_json(content))
 
     def handle_llm_response(
-        self, response, schema: str, prompt_text: str
-    ) -> Dict[str, Any]:
+        self,
+        response,
+        obj_type: str,
+        messages: List[Dict[str, str]],
+        repair: bool = False,
+    ) -> Tuple[Dict[str, Any], List[Dict[str, str]] | None]:
+        """Returns the parsed JSON, plus the messages for a repair attempt if it isn't valid.
+
+        The repair prompt only carries the validation error and the JSON the
+        model sent back, not the whole original prompt again. An empty
+        response has nothing to repair, so the next attempt sends `messages`,
+        the ones that got it, again.
+        """
+        crunch_stats.record_attempt(obj_type, response, repair)
+
         content = response.choices[0].message.content
+        if not content:
+            logger.info("Empty response for %s JSON", obj_type)
+            return {}, messages
 
         content_dict = extract_fenced_json(content)
 
         try:
-            jsonschema.validate(content_dict, json.loads(schema))
-            return content_dict
+            schemas.validator(obj_type).validate(content_dict)
         except jsonschema.ValidationError as e:
-            error_response = f"""
-            (There was a JSON validation error. Please correct your JSON object and resubmit it. Error message: "{e.message}")
+            logger.info("Invalid %s JSON at %s: %s", obj_type, e.json_path, e.message)
+            repair_prompt = f"""This {obj_type} JSON object is not valid. At {e.json_path}: {e.message}
+
+Correct the JSON object and resubmit all of it.
+
+```json
+{json.dumps(content_dict, indent=2) if content_dict else content}
+```"""
+            return content_dict, chat_messages(self.system_prompt, repair_prompt)
+
+        crunch_stats.record_result(obj_type, success=True)
+        return content_dict, None
+
+    def give_up(self, obj_type: str):
+        crunch_stats.record_result(obj_type, success=False)
+        raise InvalidJSONError(
+            f"JSONCruncher: no valid {obj_type} object after "
+            f"{self.max_attempts * len(self.cascade)} attempts."
+        )
+
+
+class AsyncJSONCruncher(JSONCruncher):
+    def __init__(self, name="json_cruncher"):
+        super().__init__(name)
+        self.client = async_client(self.llm_config, self.name)
+
+    def new_client(self, llm_config: dict):
+        return async_client(llm_config, self.name)
+
+    async def json_from_text(self, text: str, obj_type: str) -> dict:
+        return await self.prompt(*self.build_prompt(text, obj_type))
+
+    async def prompt(self, prompt_text, obj_type: str) -> dict:
+        original = chat_messages(self.system_prompt, prompt_text)
+        attempt = 0
+
+        for tier, model in enumerate(self.cascade, 1):
+            messages = original
+            llm_client = self.client_for(model)
+            with span("cascade", agent=self.name, tier=tier, model=model) as tiered:
+                for retry in range(self.max_attempts):
+                    attempt += 1
+                    with span(
+                        "json_attempt", obj_type=obj_type, attempt=attempt
+                    ) as tried:
+                        with cached_if(self.valid(obj_type)):
+                            response = await llm_client.chat.completions.create(
+                                messages=messages,
+                                **self.request_options(obj_type, model),
+                            )
+                        content_dict, messages = self.handle_llm_response(
+                            response, obj_type, messages, repair=retry > 0
+                        )
+                        tried.set("valid", messages is None)
+                    if messages is None:
+                        break
+                tiered.set("accepted", messages is None)
+            if messages is None:
+                return content_dict
 
-            {prompt_text}
-            """
-            return self.prompt(error_response, schema)
+        return self.give_up(obj_type)
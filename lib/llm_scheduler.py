@@ -0,0 +1,416 @@
+import asyncio
+import itertools
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import contextmanager
+from contextvars import ContextVar
+from enum import IntEnum
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, List, Tuple
+
+from lib.completion_cache import CompletionCache
+from lib.prompt_assembly import prompt_cache_stats
+from lib.tracing import Span, start_span
+
+
+class Priority(IntEnum):
+    "Lower goes first."
+
+    INTERACTIVE = 0
+    SCENE = 1
+    JSON = 2
+    BACKGROUND = 3
+
+
+AGENT_PRIORITIES = {
+    "narrator": Priority.INTERACTIVE,
+    "scene_generator": Priority.SCENE,
+    "json_cruncher": Priority.JSON,
+    "plotter": Priority.BACKGROUND,
+}
+
+
+class Escalation:
+    """A priority that can be raised while the work under it is still going.
+
+    Requests already waiting in a queue move up with it, so a player who
+    ends up waiting on background work isn't also stuck behind everything
+    queued ahead of it.
+    """
+
+    def __init__(self, priority: Priority):
+        self.priority = priority
+
+    def escalate(self, priority: Priority = Priority.INTERACTIVE):
+        self.priority = min(self.priority, priority)
+
+
+def current(priority: "Priority | Escalation") -> Priority:
+    return priority.priority if isinstance(priority, Escalation) else priority
+
+
+# Set these around work that should be queued differently from the agent's
+# usual class (e.g. speculative generation), or to tell sessions apart.
+llm_priority: ContextVar["Priority | Escalation | None"] = ContextVar(
+    "llm_priority", default=None
+)
+llm_session: ContextVar[str] = ContextVar("llm_session", default="local")
+
+
+@contextmanager
+def prioritised(priority: "Priority | Escalation"):
+    token = llm_priority.set(priority)
+    try:
+        yield
+    finally:
+        llm_priority.reset(token)
+
+
+def priority_for(agent: str | None) -> "Priority | Escalation":
+    # Not `or`: INTERACTIVE is 0, so it would fall through to the agent's default
+    priority = llm_priority.get()
+    if priority is None:
+        return AGENT_PRIORITIES.get(agent, Priority.SCENE)
+    return priority
+
+
+class _Waiter:
+    def __init__(self, grant: Callable[[], None]):
+        self.grant = grant
+        self.granted = False
+        self.cancelled = False
+
+
+class Scheduler:
+    """Decides which LLM request goes to a backend next.
+
+    At most `limit` requests run at once. When a slot frees up it goes to the
+    waiting request with the best priority class; within a class, to the
+    session that has had the fewest requests served, so one busy player
+    can't crowd out the rest. Identical requests already in flight are
+    coalesced: the later ones wait for the first one's response.
+    """
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.running = 0
+        self.lock = threading.Lock()
+        self.queue: List[Tuple[Priority | Escalation, int, str, _Waiter]] = []
+        self.sequence = itertools.count()
+        self.served: Dict[str, int] = {}
+        self.in_flight: Dict[str, Future] = {}
+        self.coalesced = 0
+        self.waits: Dict[str, Dict[str, float]] = {
+            priority.name.lower(): {"count": 0, "total": 0.0, "max": 0.0}
+            for priority in Priority
+        }
+
+    def acquire(self, priority: Priority | Escalation, session: str) -> float:
+        "Blocks until the request may run. Returns how long it waited, in seconds."
+        started = time.monotonic()
+        granted = threading.Event()
+        self._enqueue(priority, session, _Waiter(granted.set))
+        granted.wait()
+        return self._record_wait(priority, started)
+
+    async def acquire_async(
+        self, priority: Priority | Escalation, session: str
+    ) -> float:
+        started = time.monotonic()
+        loop = asyncio.get_running_loop()
+        granted = loop.create_future()
+
+        def grant():
+            loop.call_soon_threadsafe(
+                lambda: granted.done() or granted.set_result(None)
+            )
+
+        waiter = _Waiter(grant)
+        self._enqueue(priority, session, waiter)
+        try:
+            await granted
+        except asyncio.CancelledError:
+            with self.lock:
+                waiter.cancelled = True
+                # If the slot was already handed over, give it back
+                if waiter.granted:
+                    self._release()
+            raise
+        return self._record_wait(priority, started)
+
+    def release(self):
+        with self.lock:
+            self._release()
+
+    def join(self, key: str) -> Tuple[Future, bool]:
+        "The future for an identical request in flight, and whether this caller sends it."
+        with self.lock:
+            if key in self.in_flight:
+                self.coalesced += 1
+                return self.in_flight[key], False
+            future = self.in_flight[key] = Future()
+            return future, True
+
+    def finish(self, key: str):
+        with self.lock:
+            self.in_flight.pop(key, None)
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            return {
+                "limit": self.limit,
+                "running": self.running,
+                "queued": len(self.queue),
+                "coalesced": self.coalesced,
+                "queue_wait_seconds": {
+                    name: dict(wait) for name, wait in self.waits.items()
+                },
+            }
+
+    def _enqueue(self, priority: Priority | Escalation, session: str, waiter: _Waiter):
+        with self.lock:
+            # New sessions join at the back of the line, not ahead of everyone
+            self.served.setdefault(session, min(self.served.values(), default=0))
+            self.queue.append((priority, next(self.sequence), session, waiter))
+            self._grant_waiting()
+
+    def _release(self):
+        self.running -= 1
+        self._grant_waiting()
+
+    def _grant_waiting(self):
+        while self.queue and self.running < self.limit:
+            # The queue is only ever as long as the number of requests waiting
+            # on the LLM, so a scan is cheaper than keeping a heap up to date
+            # as the served counts and escalated priorities change.
+            best = min(
+                self.queue,
+                key=lambda queued: (
+                    current(queued[0]),
+                    self.served[queued[2]],
+                    queued[1],
+                ),
+            )
+            self.queue.remove(best)
+            _, _, session, waiter = best
+            if waiter.cancelled:
+                continue
+            self.running += 1
+            self.served[session] += 1
+            waiter.granted = True
+            waiter.grant()
+
+    def _record_wait(self, priority: Priority | Escalation, started: float) -> float:
+        waited = time.monotonic() - started
+        with self.lock:
+            wait = self.waits[current(priority).name.lower()]
+            wait["count"] += 1
+            wait["total"] += waited
+            wait["max"] = max(wait["max"], waited)
+        return waited
+
+
+class GuardedStream:
+    """A streamed response that calls `on_done` with its last chunk exactly once.
+
+    That happens when the stream runs out, when it's closed (directly or as a
+    context manager), or when it's garbage collected, so whatever it holds is
+    given back even if nobody ever reads it.
+    """
+
+    def __init__(self, stream, on_done: Callable[[Any], None]):
+        self.stream = stream
+        self.on_done = on_done
+        self.last = None
+        self.done = False
+        self.lock = threading.Lock()
+
+    def __iter__(self):
+        try:
+            for chunk in self.stream:
+                self.last = chunk
+                yield chunk
+        finally:
+            self.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __del__(self):
+        self.finish()
+
+    def close(self):
+        if self.finish():
+            close = getattr(self.stream, "close", None)
+            if close is not None:
+                close()
+
+    def finish(self) -> bool:
+        "Calls `on_done` if it hasn't been yet, and says whether it did."
+        with self.lock:
+            if self.done:
+                return False
+            self.done = True
+        self.on_done(self.last)
+        return True
+
+
+class AsyncGuardedStream(GuardedStream):
+    async def __aiter__(self):
+        try:
+            async for chunk in self.stream:
+                self.last = chunk
+                yield chunk
+        finally:
+            await self.aclose()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+    def close(self):
+        self.finish()
+
+    async def aclose(self):
+        if self.finish():
+            close = getattr(self.stream, "close", None)
+            if close is not None:
+                await close()
+
+
+class ScheduledClient:
+    """Wraps an OpenAI client so every request goes through a Scheduler first.
+
+    Streamed responses hold their slot until the stream is finished or
+    closed, or is dropped unread. Each request gets an "llm" span, with the
+    time it spent queued.
+    """
+
+    def __init__(self, llm_client, scheduler: Scheduler, agent: str | None = None):
+        self.llm_client = llm_client
+        self.scheduler = scheduler
+        self.agent = agent
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def start_span(self, request: Dict[str, Any]) -> Span:
+        return start_span(
+            "llm", agent=self.agent, model=request.get("model"), cache_hit=False
+        )
+
+    def create(self, **request):
+        llm_span = self.start_span(request)
+        try:
+            return self._create(llm_span, request)
+        except BaseException as e:
+            llm_span.end(error=e)
+            raise
+
+    def _acquire(self, llm_span: Span):
+        queued = time.perf_counter()
+        self.scheduler.acquire(priority_for(self.agent), llm_session.get())
+        llm_span.set("queue_ms", round((time.perf_counter() - queued) * 1000, 3))
+
+    def _create(self, llm_span: Span, request: Dict[str, Any]):
+        if request.get("stream"):
+            self._acquire(llm_span)
+            try:
+                response = self.llm_client.chat.completions.create(**request)
+            except BaseException:
+                self.scheduler.release()
+                raise
+            return GuardedStream(response, self._release_after(llm_span))
+
+        key = CompletionCache.key(request)
+        future, leader = self.scheduler.join(key)
+        if not leader:
+            llm_span.set("coalesced", True)
+            response = future.result()
+            llm_span.end()
+            return response
+
+        try:
+            self._acquire(llm_span)
+            try:
+                response = self.llm_client.chat.completions.create(**request)
+            finally:
+                self.scheduler.release()
+            self._record(llm_span, response)
+            future.set_result(response)
+            return response
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            self.scheduler.finish(key)
+
+    def _record(self, llm_span: Span, response):
+        prompt_cache_stats.record(self.agent, response)
+        llm_span.record_usage(response)
+        llm_span.end()
+
+    def _release_after(self, llm_span: Span) -> Callable[[Any], None]:
+        def release(last_chunk):
+            self.scheduler.release()
+            self._record_stream(llm_span, last_chunk)
+
+        return release
+
+    def _record_stream(self, llm_span: Span, last_chunk):
+        "Usage and timings, if the backend sends them, come with the last chunk."
+        if getattr(last_chunk, "usage", None) or getattr(last_chunk, "timings", None):
+            self._record(llm_span, last_chunk)
+        llm_span.end()
+
+
+class AsyncScheduledClient(ScheduledClient):
+    async def create(self, **request):
+        llm_span = self.start_span(request)
+        try:
+            return await self._create_async(llm_span, request)
+        except BaseException as e:
+            llm_span.end(error=e)
+            raise
+
+    async def _acquire_async(self, llm_span: Span):
+        queued = time.perf_counter()
+        await self.scheduler.acquire_async(priority_for(self.agent), llm_session.get())
+        llm_span.set("queue_ms", round((time.perf_counter() - queued) * 1000, 3))
+
+    async def _create_async(self, llm_span: Span, request: Dict[str, Any]):
+        if request.get("stream"):
+            await self._acquire_async(llm_span)
+            try:
+                response = await self.llm_client.chat.completions.create(**request)
+            except BaseException:
+                self.scheduler.release()
+                raise
+            return AsyncGuardedStream(response, self._release_after(llm_span))
+
+        key = CompletionCache.key(request)
+        future, leader = self.scheduler.join(key)
+        if not leader:
+            llm_span.set("coalesced", True)
+            response = await asyncio.wrap_future(future)
+            llm_span.end()
+            return response
+
+        try:
+            await self._acquire_async(llm_span)
+            try:
+                response = await self.llm_client.chat.completions.create(**request)
+            finally:
+                self.scheduler.release()
+            self._record(llm_span, response)
+            future.set_result(response)
+            return response
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            self.scheduler.finish(key)
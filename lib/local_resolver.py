@@ -0,0 +1,90 @@
+from collections import OrderedDict
+from typing import Tuple
+
+from lib.dispatcher import known_scene, remember_scene
+from lib.game_state import GameState
+from utils import DIRECTION_ALIASES, find_exit
+
+DIRECTIONS = set(DIRECTION_ALIASES.values())
+REMEMBERED_LOOKS = 1024
+
+
+class LocalResolver:
+    """Settles the actions that have only one sensible outcome, without the LLM.
+
+    Going through an exit whose destination is known (visited or
+    pre-generated), trying a locked exit, trying a direction the scene has no
+    exit in, looking at an exit, and looking at something already looked at in
+    the same scene are all answered from the scene and the world graph.
+    Everything else goes to the narrator.
+    """
+
+    def __init__(self, remembered_looks: int = REMEMBERED_LOOKS):
+        self.remembered_looks = remembered_looks
+        # (scene id, scene description, target) -> the narrator's feedback
+        self.looks: OrderedDict[Tuple[str, str, str], str] = OrderedDict()
+
+    def resolve(self, user_action: str, state: GameState) -> GameState | None:
+        "The state after the action, or None if the narrator is needed."
+        match user_action.lower().split(" ", 1):
+            case ["go", target]:
+                return self.go(target.strip(), state)
+            case ["look", target]:
+                return self.look_at(target.strip(), state)
+        return None
+
+    def go(self, target: str, state: GameState) -> GameState | None:
+        scene = state.current_scene
+        exit_data = find_exit(scene, f"go {target}")
+        if exit_data is None:
+            direction = DIRECTION_ALIASES.get(target, target)
+            if direction in DIRECTIONS:
+                return state.evolve(feedback=f"You can't go {direction} from here.")
+            return None
+
+        if exit_data.get("locked"):
+            return state.evolve(feedback=f"The way {exit_data['direction']} is locked.")
+
+        command_dict = {"last_scene": scene, "exit": exit_data}
+        destination = known_scene(command_dict)
+        if destination is None:
+            return None
+        state = state.evolve(
+            current_scene=destination, feedback=f"You go {exit_data['direction']}."
+        )
+        return remember_scene(command_dict, state)
+
+    def look_at(self, target: str, state: GameState) -> GameState | None:
+        feedback = self.looks.get(self.look_key(target, state))
+        if feedback is not None:
+            self.looks.move_to_end(self.look_key(target, state))
+            return state.evolve(feedback=feedback)
+
+        exit_data = find_exit(state.current_scene, target)
+        if exit_data is not None:
+            feedback = f"{exit_data['description'].capitalize()}."
+            if exit_data.get("locked"):
+                feedback += " It's locked."
+            return state.evolve(feedback=feedback)
+        return None
+
+    def look_key(self, target: str, state: GameState) -> Tuple[str, str, str]:
+        scene = state.current_scene
+        return (scene.get("id", ""), scene.get("description", ""), target.lower())
+
+    def remember_look(
+        self, target: str, before: GameState, after: GameState
+    ) -> GameState:
+        """Keeps the narrator's answer to a look that didn't change the scene.
+
+        Returns `after`, so it can be chained onto the narrator's result.
+        """
+        if after.current_scene is before.current_scene and after.feedback:
+            self.looks[self.look_key(target, before)] = after.feedback
+            self.looks.move_to_end(self.look_key(target, before))
+            while len(self.looks) > self.remembered_looks:
+                self.looks.popitem(last=False)
+        return after
+
+
+local_resolver = LocalResolver()
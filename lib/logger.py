@@ -1,7 +1,120 @@
+import atexit
+import json
 import logging
+import logging.handlers
+import os
+import queue
+import random
 
-logging.basicConfig(
-    format="\n===============\n%(levelname)s: %(message)s\n===============\n",
-    level=logging.INFO,
-)
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")  # or "json"
+LOG_FILE = os.getenv("LOG_FILE")
+# Longest a text argument to a log call gets; anything over is cut, with its
+# length noted. Whole messages are cut at four times this.
+LOG_MAX_CHARS = int(os.getenv("LOG_MAX_CHARS", "4000"))
+MAX_MESSAGE_CHARS = 4 * LOG_MAX_CHARS
+# Fraction of records with an over-long text argument that are kept
+LOG_LARGE_SAMPLE = float(os.getenv("LOG_LARGE_SAMPLE", "1.0"))
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+
+TEXT_FORMAT = "\n===============\n%(levelname)s: %(message)s\n===============\n"
+
+# Attributes every LogRecord has, so anything else came from `extra`
+_RECORD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+
+def truncate(text: str, limit: int = LOG_MAX_CHARS) -> str:
+    if len(text) <= limit:
+        return text
+    return f"{text[:limit]}… [{len(text)} chars]"
+
+
+class JSONFormatter(logging.Formatter):
+    "One JSON object per record, including any `extra` fields."
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": record.created,
+            "level": record.levelname,
+            "logger": record.name,
+            "thread": record.threadName,
+            "message": truncate(record.getMessage(), MAX_MESSAGE_CHARS),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class TruncatingFormatter(logging.Formatter):
+    def formatMessage(self, record: logging.LogRecord) -> str:
+        record.message = truncate(record.message, MAX_MESSAGE_CHARS)
+        return super().formatMessage(record)
+
+
+class BackgroundHandler(logging.handlers.QueueHandler):
+    """Hands records to a background thread, which formats and writes them.
+
+    The message isn't formatted on the caller's thread, so logging a whole
+    LLM response costs the turn next to nothing. When the queue is full,
+    records are dropped and counted rather than making the caller wait.
+    """
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord | None:
+        """Cuts over-long text arguments down, and samples the records that had them.
+
+        Everything else is left for the background thread to format, so
+        mutable arguments are formatted as they are when it gets to them.
+        """
+        args = record.args if isinstance(record.args, tuple) else ()
+        texts = [value for value in (record.msg, *args) if isinstance(value, str)]
+        if any(len(text) > LOG_MAX_CHARS for text in texts):
+            if random.random() >= LOG_LARGE_SAMPLE:
+                return None
+            # Cheap to cut now, and stops the queue holding on to huge strings
+            if isinstance(record.msg, str):
+                record.msg = truncate(record.msg)
+            if args:
+                record.args = tuple(
+                    truncate(arg) if isinstance(arg, str) else arg for arg in args
+                )
+        return record
+
+    def emit(self, record: logging.LogRecord):
+        try:
+            record = self.prepare(record)
+            if record is not None:
+                self.enqueue(record)
+        except queue.Full:
+            self.dropped += 1
+        except Exception:
+            self.handleError(record)
+
+
+def configure_logging() -> BackgroundHandler:
+    if LOG_FILE:
+        target = logging.FileHandler(LOG_FILE, encoding="utf-8")
+    else:
+        target = logging.StreamHandler()
+    target.setFormatter(
+        JSONFormatter() if LOG_FORMAT == "json" else TruncatingFormatter(TEXT_FORMAT)
+    )
+
+    log_queue = queue.Queue(LOG_QUEUE_SIZE)
+    handler = BackgroundHandler(log_queue)
+    listener = logging.handlers.QueueListener(log_queue, target)
+    listener.start()
+    atexit.register(listener.stop)
+
+    logging.basicConfig(level=LOG_LEVEL, handlers=[handler])
+    return handler
+
+
+handler = configure_logging()
 logger = logging.getLogger(__name__)
@@ -0,0 +1,108 @@
+import asyncio
+import inspect
+from contextlib import nullcontext
+
+from lib.background_plotter import BackgroundPlotter
+from lib.game import (
+    PlayerQuit,
+    dispatch_user_action,
+    end_turn,
+    format_readable_scene,
+    start_turn,
+)
+from lib.game_state import GameState, new_game_state
+from lib.llm_scheduler import llm_session
+from lib.logger import logger
+from lib.narrator_agent import AsyncNarrator
+from lib.retrieval import MemoryIndex
+
+
+class Session:
+    """One player connected over a telnet-style line protocol.
+
+    Each session has its own GameState and runs the same turn as the console
+    game loop, with async agents, so one player waiting on the LLM never
+    holds up anyone else. The world graph is shared, so players who find
+    the same room find the same room, but what the narrator recalls is not.
+    """
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+        self.state: GameState = new_game_state()
+        self.peer = writer.get_extra_info("peername")
+        # One narrator for the whole connection, streaming feedback to this player
+        self.narrator = AsyncNarrator()
+        self.narrator.on_feedback = self.write
+        self.memory = MemoryIndex()
+        self.narrator.memory = self.memory
+        self.plotter = BackgroundPlotter()
+
+    def say(self, text: str):
+        self.write(text + "\n")
+
+    def write(self, text: str):
+        self.writer.write(text.replace("\n", "\r\n").encode("utf-8"))
+
+    async def run(self):
+        logger.info("Session started: %s", self.peer)
+        # Each connection is its own task, so this only applies to this session
+        llm_session.set(str(self.peer))
+        try:
+            while True:
+                if self.state.engine["describe_current_scene"]:
+                    self.say(
+                        format_readable_scene(self.state.current_scene, self.state)
+                    )
+
+                self.state = self.plotter.merge(start_turn(self.state))
+
+                self.write("> ")
+                await self.writer.drain()
+                line = await self.reader.readline()
+                if not line:
+                    break
+                user_action = line.decode("utf-8", errors="replace").strip()
+
+                try:
+                    state = dispatch_user_action(
+                        user_action,
+                        self.state,
+                        self.narrator,
+                        say=self.say,
+                        busy=lambda narrator, text: self.busy(text),
+                        memory=self.memory,
+                    )
+                    if inspect.isawaitable(state):
+                        state = await state
+                except PlayerQuit:
+                    break
+                except Exception:
+                    logger.exception("Turn failed for %s", self.peer)
+                    self.say("I'm sorry, something went wrong. Try that again?")
+                    continue
+
+                self.state = end_turn(state, user_action)
+                self.plotter.after_turn(self.state)
+        except ConnectionError:
+            pass
+        finally:
+            logger.info("Session ended: %s", self.peer)
+            self.writer.close()
+
+    def busy(self, text: str):
+        "No spinners over the wire, just say what's happening."
+        self.say(text)
+        return nullcontext()
+
+
+async def handle_connection(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    await Session(reader, writer).run()
+
+
+async def serve_forever(host: str, port: int):
+    server = await asyncio.start_server(handle_connection, host, port)
+    logger.info("MUD server listening on %s:%s", host, port)
+    print(f"Listening on {host}:{port}. Connect with `telnet {host} {port}`.")
+    async with server:
+        await server.serve_forever()
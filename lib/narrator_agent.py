@@ -1,43 +1,281 @@
 from typing import Tuple
 
-from lib.config import client, llm_config_for, GAME_CONFIG
-from lib.dispatcher import dispatch
+from lib.completion_cache import cached_if
+from lib.config import (
+    async_client,
+    cascade_for,
+    client,
+    llm_config_for,
+    memory_tokens_for,
+    prompt_budget_for,
+    uses_openai,
+    GAME_CONFIG,
+    MEMORY_TOP_K,
+)
+from lib.dispatcher import (
+    dispatch,
+    dispatch_async,
+    dispatch_stream,
+    dispatch_stream_async,
+    has_command,
+    print_feedback,
+)
 from lib.game_state import GameState
-from utils import scene_to_text
+from lib.logger import logger
+from lib.prompt_assembly import assemble, chat_messages
+from lib.retrieval import MemoryIndex
+from lib.token_budget import count_tokens, scene_to_prompt_text
+from lib.tracing import span
+from lib.world_graph import world
+from utils import find_exit
+
+# The same for every turn, so it goes in the system message with the rest of
+# the stable prefix rather than after the scene.
+ACTION_INSTRUCTIONS = """When the player wants to examine something specific: if that makes sense and is possible, say <FEEDBACK> and give them a more detailed description of whatever they are hoping to examine. If it doesn't make sense or isn't possible, say <FEEDBACK> followed by a brief explanation of why it isn't possible or doesn't make sense. If the examination reveals something new about the scene, say <UPDATE SCENE> followed by a brief updated description of the new scene, being sure to specify what changed in the description.
+
+When the player wants to go somewhere: if that makes sense and is possible, say <FEEDBACK> followed by a brief narration (e.g., 'You go through the north door') then <GENERATE SCENE> followed by a brief description of the new scene that they encounter. If it doesn't make sense, say <FEEDBACK> followed by a brief explanation of why it isn't possible or doesn't make sense.
+
+When the player wants to use something: if that makes sense and is possible, say <FEEDBACK> and describe the outcome of their action. If it doesn't make sense, say <FEEDBACK> followed by a brief explanation of why it isn't possible or doesn't make sense. If the action changes the scene, say <UPDATE SCENE> followed by a brief description of the new scene, being sure to specify what changed in the description."""
 
 
 class Narrator:
     def __init__(self, name="narrator"):
         self.name = name
-        self.system_prompt = GAME_CONFIG["agents"][self.name]["system_prompt"]
+        self.system_prompt = assemble(
+            system=GAME_CONFIG["agents"][self.name]["system_prompt"],
+            examples=ACTION_INSTRUCTIONS,
+        )
         self.llm_config = llm_config_for(self.name)
+        self.client = client(self.llm_config, self.name)
+        self.cascade = cascade_for(self.name)
+        # Clients for cascade models that aren't on the same backend as `model`
+        self.tier_clients = {}
+        self.prompt_budget = prompt_budget_for(self.name)
+        self.memory_tokens = memory_tokens_for(self.name)
+        # What this narrator's game has come across; the game can hand in its own
+        self.memory = MemoryIndex()
+        self.stream = GAME_CONFIG["agents"][self.name].get("stream", False)
+        # Where streamed <FEEDBACK> text goes as it arrives
+        self.on_feedback = print_feedback
 
     def look_at(self, user_action: str, state: GameState) -> GameState:
-        prompt_text = f"The player is in this scene:\n\n{scene_to_text(state.current_scene)}\n\n They want to examine something specific: {user_action}. If that makes sense and is possible, say <FEEDBACK> and give them a more detailed description of whatever they are hoping to examine. If it doesn't make sense or isn't possible, say <FEEDBACK> followed by a brief explanation of why it isn't possible or doesn't make sense. If the examination reveals something new about the scene, say <UPDATE SCENE> followed by a brief updated description of the new scene, being sure to specify what changed in the description."
+        prompt_text = self.user_prompt(
+            state,
+            f"They want to examine something specific: {user_action}",
+            user_action,
+        )
 
         return self.prompt(prompt_text, state)
 
     def go(self, user_action: str, state: GameState) -> GameState:
-        prompt_text = f"The player is in this scene:\n\n{scene_to_text(state.current_scene)}\n\n They want to go somewhere: {user_action}. If that is makes sense and is possible, say <FEEDBACK> followed by a brief narration (e.g., 'You go through the north door') then <GENERATE SCENE> followed by a brief description of the new scene that they encounter. If it doesn't make sense, say <FEEDBACK> followed by a brief explanation of why it isn't possible or doesn't make sense."
+        exit_data = find_exit(state.current_scene, user_action)
+
+        # Been through this exit before? Then we already know what's on the other side
+        known_scene = world.destination(state.current_scene, exit_data)
+        if known_scene and not exit_data.get("locked"):
+            return self.done(
+                state.evolve(
+                    current_scene=known_scene,
+                    feedback=f"You go {exit_data['direction']}.",
+                )
+            )
+
+        # Remember which exit this is, so a known or pre-generated scene can be used
+        state = state.with_engine(exit=exit_data)
+        prompt_text = self.user_prompt(
+            state, f"They want to go somewhere: {user_action}", user_action
+        )
 
         return self.prompt(prompt_text, state)
 
     def use(self, user_action: str, state: GameState) -> GameState:
-        prompt_text = f"The player is in this scene:\n\n{scene_to_text(state.current_scene)}\n\n They want to use something: {user_action}. If that is makes sense and is possible, say <FEEDBACK> and describe the outcome of their action. If it doesn't make sense, say <FEEDBACK> followed by a brief explanation of why it isn't possible or doesn't make sense. If the action changes the scene, say <UPDATE SCENE> followed by a brief description of the new scene, being sure to specify what changed in the description."
+        prompt_text = self.user_prompt(
+            state, f"They want to use something: {user_action}", user_action
+        )
 
         return self.prompt(prompt_text, state)
 
+    def user_prompt(self, state: GameState, action: str, query: str = "") -> str:
+        """The scene, then anything relevant from earlier, then the action.
+
+        That way turns in the same scene share a prefix. What's recalled for
+        `query` only gets what's left of the budget after the scene, up to
+        `memory_tokens`.
+        """
+        scene_budget = (
+            self.prompt_budget - count_tokens(self.system_prompt) - count_tokens(action)
+        )
+        scene_text = scene_to_prompt_text(state.current_scene, scene_budget)
+        scene = f"The player is in this scene:\n\n{scene_text}"
+
+        memory_budget = min(self.memory_tokens, scene_budget - count_tokens(scene))
+        recalled = ""
+        if query and memory_budget > 0:
+            recalled = self.memory.recall(
+                f"{query} {state.current_scene.get('title', '')}",
+                MEMORY_TOP_K,
+                memory_budget,
+                exclude=f"scene:{state.current_scene.get('id', '')}",
+            )
+        if recalled:
+            recalled = f"Earlier in the game, which may be relevant:\n{recalled}"
+        return assemble(scene=scene, memory=recalled, action=action)
+
+    def done(self, state: GameState) -> GameState:
+        "For turns that are settled without calling the LLM."
+        return state
+
+    def new_client(self, llm_config: dict):
+        return client(llm_config, self.name)
+
+    def client_for(self, model: str):
+        "The client for one model in the cascade, on whichever backend serves it."
+        if uses_openai({"model": model}) == uses_openai(self.llm_config):
+            return self.client
+        if model not in self.tier_clients:
+            self.tier_clients[model] = self.new_client(
+                {**self.llm_config, "model": model}
+            )
+        return self.tier_clients[model]
+
+    def tiers(self):
+        "Each tier (from 1) of the cascade, its model, client and request options."
+        for tier, model in enumerate(self.cascade, 1):
+            options = {**self.llm_config, "model": model}
+            yield tier, model, self.client_for(model), options
+
+    def log_escalation(self, tier: int, model: str):
+        if tier < len(self.cascade):
+            logger.info("No command from %s, asking the next model", model)
+
     def prompt(self, prompt_text, state: GameState) -> GameState:
-        response = client(self.llm_config).chat.completions.create(
-            messages=[
-                {"role": "system", "content": self.system_prompt},
-                {"role": "user", "content": prompt_text},
-            ],
-            **self.llm_config,
-        )
-        if response.choices[0].message.content:
-            return dispatch(response.choices[0].message.content, state)
+        """Asks each model in the cascade in turn until one answers with a command.
+
+        If none does, the last answer is dispatched anyway.
+        """
+        messages = chat_messages(self.system_prompt, prompt_text)
+        if self.stream:
+            return self.prompt_streaming(messages, state)
+
+        for tier, model, llm_client, options in self.tiers():
+            with span("cascade", agent=self.name, tier=tier, model=model) as tiered:
+                with cached_if(has_command):
+                    response = llm_client.chat.completions.create(
+                        messages=messages,
+                        **options,
+                    )
+                content = response.choices[0].message.content
+                tiered.set("accepted", has_command(content or ""))
+            if has_command(content or ""):
+                break
+            self.log_escalation(tier, model)
+
+        if content:
+            return dispatch(content, state)
+        return dispatch(
+            "<FEEDBACK> I'm sorry, something went wrong with the narrator agent.",
+            state,
+        )
+
+    def prompt_streaming(self, messages, state: GameState) -> GameState:
+        """Like `prompt`, but dispatches each <TAG> as soon as it has fully arrived.
+
+        A response with no command the dispatcher knows has had nothing
+        dispatched or shown, so the next model can still be asked. If the
+        last one has none either, the player is told something went wrong.
+        """
+        for tier, model, llm_client, options in self.tiers():
+            with span("cascade", agent=self.name, tier=tier, model=model) as tiered:
+                response = llm_client.chat.completions.create(
+                    messages=messages,
+                    stream=True,
+                    **options,
+                )
+                received = []
+
+                def chunks():
+                    for chunk in response:
+                        if chunk.choices and chunk.choices[0].delta.content:
+                            received.append(chunk.choices[0].delta.content)
+                            yield chunk.choices[0].delta.content
+
+                new_state = dispatch_stream(chunks(), state, self.on_feedback)
+                accepted = has_command("".join(received))
+                tiered.set("accepted", accepted)
+            if accepted:
+                return new_state
+            self.log_escalation(tier, model)
+
         return dispatch(
+            "<FEEDBACK> I'm sorry, something went wrong with the narrator agent.",
+            new_state,
+        )
+
+
+class AsyncNarrator(Narrator):
+    "A Narrator whose `look_at`, `go` and `use` return coroutines."
+
+    def __init__(self, name="narrator"):
+        super().__init__(name)
+        self.client = async_client(self.llm_config, self.name)
+
+    def new_client(self, llm_config: dict):
+        return async_client(llm_config, self.name)
+
+    async def done(self, state: GameState) -> GameState:
+        return state
+
+    async def prompt(self, prompt_text, state: GameState) -> GameState:
+        messages = chat_messages(self.system_prompt, prompt_text)
+        if self.stream:
+            return await self.prompt_streaming(messages, state)
+
+        for tier, model, llm_client, options in self.tiers():
+            with span("cascade", agent=self.name, tier=tier, model=model) as tiered:
+                with cached_if(has_command):
+                    response = await llm_client.chat.completions.create(
+                        messages=messages,
+                        **options,
+                    )
+                content = response.choices[0].message.content
+                tiered.set("accepted", has_command(content or ""))
+            if has_command(content or ""):
+                break
+            self.log_escalation(tier, model)
+
+        if content:
+            return await dispatch_async(content, state)
+        return await dispatch_async(
             "<FEEDBACK> I'm sorry, something went wrong with the narrator agent.",
             state,
         )
+
+    async def prompt_streaming(self, messages, state: GameState) -> GameState:
+        for tier, model, llm_client, options in self.tiers():
+            with span("cascade", agent=self.name, tier=tier, model=model) as tiered:
+                response = await llm_client.chat.completions.create(
+                    messages=messages,
+                    stream=True,
+                    **options,
+                )
+                received = []
+
+                async def chunks():
+                    async for chunk in response:
+                        if chunk.choices and chunk.choices[0].delta.content:
+                            received.append(chunk.choices[0].delta.content)
+                            yield chunk.choices[0].delta.content
+
+                new_state = await dispatch_stream_async(
+                    chunks(), state, self.on_feedback
+                )
+                accepted = has_command("".join(received))
+                tiered.set("accepted", accepted)
+            if accepted:
+                return new_state
+            self.log_escalation(tier, model)
+
+        return await dispatch_async(
+            "<FEEDBACK> I'm sorry, something went wrong with the narrator agent.",
+            new_state,
+        )
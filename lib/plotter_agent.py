@@ -1,4 +1,12 @@
-from lib.config import GAME_CONFIG, llm_config_for, client
+import json
+from typing import List
+
+from lib.agent_runtime import shared
+from lib.config import GAME_CONFIG, llm_config_for, async_client, client
+from lib.game_state import GameState
+from lib.json_cruncher_agent import AsyncJSONCruncher, JSONCruncher
+from lib.logger import logger
+from lib.prompt_assembly import assemble
 
 
 class Plotter:
@@ -6,9 +14,22 @@ class Plotter:
         self.name = name
         self.system_prompt = GAME_CONFIG["agents"][self.name]["system_prompt"]
         self.llm_config = llm_config_for(self.name)
+        self.client = client(self.llm_config, self.name)
+
+    def user_prompt(self, state: GameState, events: List[str]) -> str:
+        "The story so far, where the player is, and what they've done lately."
+        story = f"The story so far:\n\n{json.dumps(state.story, indent=2)}"
+        scene = f"The player is in: {state.current_scene.get('title', '')}"
+        happened = "\n".join(f"- {event}" for event in events) or "- Nothing yet."
+        action = (
+            f"What the player has done since the story was last updated:\n{happened}"
+            "\n\nUpdate the story to follow what the player has done: keep the main"
+            " quest, and mark off, change or add goals and obstacles as needed."
+        )
+        return assemble(story=story, scene=scene, action=action)
 
     def prompt(self, prompt_text, state: GameState) -> GameState:
-        response = client(self.llm_config).chat.completions.create(
+        response = self.client.chat.completions.create(
             messages=[
                 {"role": "system", "content": self.system_prompt},
                 {"role": "user", "content": prompt_text},
@@ -21,14 +42,37 @@ class Plotter:
         return state
 
     def handle_llm_response(self, content: str, state: GameState) -> GameState:
-        logger.info(f"Plotter response: {content}")
+        logger.info("Plotter response: %s", content)
+
+        new_story = shared(JSONCruncher).json_from_text(content, "story")
+
+        return self.with_story(new_story, state)
 
-        new_story = JSONCruncher().json_from_text(content, "story")
+    def with_story(self, new_story: dict, state: GameState) -> GameState:
+        return state.evolve(story=new_story, feedback="")
 
-        return GameState(
-            current_scene=state.current_scene,
-            inventory=state.inventory,
-            engine=state.engine,
-            story=new_story,
-            feedback="",
+
+class AsyncPlotter(Plotter):
+    def __init__(self, name="plotter"):
+        super().__init__(name)
+        self.client = async_client(self.llm_config, self.name)
+
+    async def prompt(self, prompt_text, state: GameState) -> GameState:
+        response = await self.client.chat.completions.create(
+            messages=[
+                {"role": "system", "content": self.system_prompt},
+                {"role": "user", "content": prompt_text},
+            ],
+            **self.llm_config,
         )
+        if response.choices[0].message.content:
+            content = response.choices[0].message.content
+            return await self.handle_llm_response(content, state)
+        return state
+
+    async def handle_llm_response(self, content: str, state: GameState) -> GameState:
+        logger.info("Plotter response: %s", content)
+
+        new_story = await shared(AsyncJSONCruncher).json_from_text(content, "story")
+
+        return self.with_story(new_story, state)
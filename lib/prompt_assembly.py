@@ -0,0 +1,82 @@
+import threading
+from collections import defaultdict
+from typing import Any, Dict, List
+
+# Most stable first. llama.cpp and LM Studio reuse the KV cache for the
+# longest prefix a prompt shares with the last one, so everything after the
+# first segment that changed has to be evaluated again.
+SEGMENT_ORDER = ("system", "examples", "story", "scene", "memory", "action")
+
+
+def assemble(**segments: str) -> str:
+    """Joins prompt segments in SEGMENT_ORDER, whatever order they're passed in.
+
+    Empty segments are left out. The same inputs always give byte-identical
+    output, so a stable prefix stays cacheable from one turn to the next.
+    """
+    unknown = set(segments) - set(SEGMENT_ORDER)
+    if unknown:
+        raise ValueError(f"Unknown prompt segment(s): {', '.join(sorted(unknown))}")
+
+    return "\n\n".join(segments[name] for name in SEGMENT_ORDER if segments.get(name))
+
+
+def chat_messages(system: str, user: str) -> List[Dict[str, str]]:
+    return [
+        {"role": "system", "content": system},
+        {"role": "user", "content": user},
+    ]
+
+
+class PromptCacheStats:
+    """How much of each agent's prompts the backend served from its prefix cache.
+
+    OpenAI and recent LM Studio builds report
+    `usage.prompt_tokens_details.cached_tokens`; the llama.cpp server reports
+    `timings` with `cache_n`, `prompt_n` and `prompt_ms`. Whichever the
+    backend sends is recorded.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.by_agent: Dict[str, Dict[str, float]] = defaultdict(
+            lambda: {
+                "requests": 0,
+                "prompt_tokens": 0,
+                "cached_tokens": 0,
+                "prompt_ms": 0.0,
+            }
+        )
+
+    def record(self, agent: str | None, response: Any):
+        usage = getattr(response, "usage", None)
+        timings = getattr(response, "timings", None) or {}
+        details = getattr(usage, "prompt_tokens_details", None)
+
+        prompt_tokens = getattr(usage, "prompt_tokens", None) or 0
+        cached_tokens = getattr(details, "cached_tokens", None) or 0
+        if not cached_tokens and timings:
+            cached_tokens = timings.get("cache_n") or 0
+            evaluated = timings.get("prompt_n") or 0
+            prompt_tokens = prompt_tokens or cached_tokens + evaluated
+
+        with self.lock:
+            stats = self.by_agent[agent or "unknown"]
+            stats["requests"] += 1
+            stats["prompt_tokens"] += prompt_tokens
+            stats["cached_tokens"] += cached_tokens
+            stats["prompt_ms"] += timings.get("prompt_ms") or 0.0
+
+    def snapshot(self) -> Dict[str, Dict[str, float]]:
+        with self.lock:
+            snapshot = {agent: dict(stats) for agent, stats in self.by_agent.items()}
+        for stats in snapshot.values():
+            stats["cached_fraction"] = (
+                stats["cached_tokens"] / stats["prompt_tokens"]
+                if stats["prompt_tokens"]
+                else 0.0
+            )
+        return snapshot
+
+
+prompt_cache_stats = PromptCacheStats()
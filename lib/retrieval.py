@@ -0,0 +1,196 @@
+import heapq
+import itertools
+import math
+import re
+import threading
+from collections import Counter, defaultdict, deque
+from typing import Dict, Iterable, List, Tuple
+
+from lib.game_state import GameState
+from lib.token_budget import count_tokens, trim_to_tokens
+
+# BM25's usual parameters: how fast repeats of a term stop counting, and how
+# much long documents are penalised
+K1 = 1.2
+B = 0.75
+# No one snippet gets more than this, so a long scene can't take the whole cap
+SNIPPET_TOKENS = 80
+# Past turns' feedback kept in the index; the oldest goes first
+FEEDBACK_KEPT = 5000
+
+WORD = re.compile(r"[a-z0-9']+")
+STOPWORDS = frozenset(
+    """a an and are as at be but by for from has have he her his i in into is it
+    its of on or she that the their them then there they this to was were will
+    with you your""".split()
+)
+
+
+def terms(text: str) -> List[str]:
+    return [
+        word
+        for word in WORD.findall(text.lower())
+        if len(word) > 1 and word not in STOPWORDS
+    ]
+
+
+class MemoryIndex:
+    """A BM25 index over what the player has come across, for the narrator's prompt.
+
+    Documents are visited scenes, the feedback from past turns and the
+    story's goals and obstacles, each under an id so it can be replaced. A
+    query only scores the documents that share a term with it, and `recall`
+    returns the best few under a token cap, so prompts stay the same size
+    however much the world grows.
+
+    Each game has its own index, so one player's narrator never recalls what
+    another player saw.
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self._clear()
+
+    def _clear(self):
+        self.texts: Dict[str, str] = {}
+        self.lengths: Dict[str, int] = {}
+        self.postings: Dict[str, Dict[str, int]] = defaultdict(dict)
+        self.total_length = 0
+        self.feedback_ids = itertools.count(1)
+        # (turn, doc id) of each turn's feedback, oldest first
+        self.feedback: deque[Tuple[int, str]] = deque()
+        # The last scene and story object indexed, so unchanged ones are skipped
+        self.indexed: Dict[str, object] = {}
+
+    def add(self, doc_id: str, text: str):
+        "Indexes `text` under `doc_id`, replacing whatever was there."
+        counts = Counter(terms(text))
+        with self.lock:
+            self._remove(doc_id)
+            if not counts:
+                return
+            self.texts[doc_id] = text
+            self.lengths[doc_id] = sum(counts.values())
+            self.total_length += self.lengths[doc_id]
+            for term, count in counts.items():
+                self.postings[term][doc_id] = count
+
+    def remove(self, doc_id: str):
+        with self.lock:
+            self._remove(doc_id)
+
+    def _remove(self, doc_id: str):
+        if doc_id not in self.texts:
+            return
+        for term in set(terms(self.texts.pop(doc_id))):
+            self.postings[term].pop(doc_id, None)
+            if not self.postings[term]:
+                del self.postings[term]
+        self.total_length -= self.lengths.pop(doc_id)
+
+    def search(
+        self, query: str, k: int, exclude: str | None = None
+    ) -> List[Tuple[float, str]]:
+        "The `k` best (score, doc id) pairs for `query`, best first."
+        with self.lock:
+            documents = len(self.texts)
+            if not documents:
+                return []
+            average_length = self.total_length / documents
+            scores: Dict[str, float] = defaultdict(float)
+            for term in set(terms(query)):
+                postings = self.postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(
+                    1 + (documents - len(postings) + 0.5) / (len(postings) + 0.5)
+                )
+                for doc_id, count in postings.items():
+                    length_norm = 1 - B + B * self.lengths[doc_id] / average_length
+                    scores[doc_id] += (
+                        idf * count * (K1 + 1) / (count + K1 * length_norm)
+                    )
+        scores.pop(exclude, None)
+        return heapq.nlargest(k, ((score, doc_id) for doc_id, score in scores.items()))
+
+    def recall(
+        self, query: str, k: int, max_tokens: int, exclude: str | None = None
+    ) -> str:
+        "The best snippets for `query`, one per line, in about `max_tokens`."
+        lines = []
+        spare = max_tokens
+        for _, doc_id in self.search(query, k, exclude):
+            snippet = "- " + trim_to_tokens(
+                self.texts[doc_id], min(SNIPPET_TOKENS, spare)
+            )
+            tokens = count_tokens(snippet)
+            if tokens > spare:
+                break
+            lines.append(snippet)
+            spare -= tokens
+        return "\n".join(lines)
+
+    def remember(
+        self, state: GameState, user_action: str, turn: int | None = None
+    ) -> GameState:
+        """Indexes the scene, feedback and story at the end of a turn.
+
+        `turn` defaults to the one in progress in `state`. Scenes and stories
+        that haven't changed since they were last indexed are skipped. Returns
+        `state`, so it can be chained onto a turn.
+        """
+        if turn is None:
+            turn = state.engine.get("turn_count", 0) + 1
+        with self.lock:
+            self._index_scene_and_story(state)
+
+            if state.feedback:
+                scene = state.current_scene
+                where = scene.get("title") or scene.get("id", "")
+                doc_id = f"feedback:{next(self.feedback_ids)}"
+                self.add(doc_id, f"In {where}, after '{user_action}': {state.feedback}")
+                self.feedback.append((turn, doc_id))
+                if len(self.feedback) > FEEDBACK_KEPT:
+                    self.remove(self.feedback.popleft()[1])
+        return state
+
+    def rewind(self, state: GameState):
+        "Forgets the feedback from turns after `state`, e.g. after an undo."
+        turn = state.engine.get("turn_count", 0)
+        with self.lock:
+            while self.feedback and self.feedback[-1][0] > turn:
+                self.remove(self.feedback.pop()[1])
+            self._index_scene_and_story(state)
+
+    def rebuild(self, turns: Iterable[Tuple[str, GameState]]):
+        """Indexes a saved game from scratch, from (action, state after it) pairs.
+
+        A pair with no action is a starting point, e.g. a snapshot, and an
+        `undo` rewinds, as it did when it was played.
+        """
+        with self.lock:
+            self._clear()
+            for action, state in turns:
+                if action == "undo" or not action:
+                    self.rewind(state)
+                else:
+                    self.remember(state, action, state.engine.get("turn_count", 0))
+
+    def _index_scene_and_story(self, state: GameState):
+        scene = state.current_scene
+        scene_id = f"scene:{scene.get('id', '')}"
+        if self.indexed.get(scene_id) is not scene:
+            self.indexed[scene_id] = scene
+            self.add(
+                scene_id,
+                f"{scene.get('title', '')}: "
+                f"{scene.get('summary') or scene.get('description', '')}",
+            )
+
+        if self.indexed.get("story") is not state.story:
+            self.indexed["story"] = state.story
+            for doc_id in [doc for doc in self.texts if doc.startswith("story:")]:
+                self.remove(doc_id)
+            for kind in ("goals", "obstacles"):
+                for n, text in enumerate(state.story.get(kind, [])):
+                    self.add(f"story:{kind}:{n}", text)
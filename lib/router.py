@@ -0,0 +1,204 @@
+import threading
+import time
+from collections import deque
+from functools import cache
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, Iterator, List, Tuple
+
+from lib.llm_scheduler import AsyncGuardedStream, GuardedStream
+from lib.logger import logger
+
+# Requests per endpoint that its latency and error rate are worked out over
+ROLLING_WINDOW = 20
+# How long an endpoint that just failed is passed over, unless nothing else is up
+COOLDOWN_SECONDS = 30.0
+
+
+@cache
+def failover_errors() -> Tuple[type, ...]:
+    "Errors another endpoint might not have: it's down, overloaded or broken."
+    import openai
+
+    return (
+        openai.APIConnectionError,
+        openai.InternalServerError,
+        openai.RateLimitError,
+    )
+
+
+class Endpoint:
+    """One OpenAI-compatible server, and how it has been doing lately.
+
+    `in_flight` counts the requests it's answering now, streams included,
+    against the `concurrency` its connection pool is sized for.
+    """
+
+    def __init__(self, base_url: str, api_key: str, concurrency: int):
+        self.base_url = base_url
+        self.api_key = api_key
+        self.concurrency = concurrency
+        self.latencies: deque[float] = deque(maxlen=ROLLING_WINDOW)
+        self.outcomes: deque[bool] = deque(maxlen=ROLLING_WINDOW)
+        self.down_until = 0.0
+        self.in_flight = 0
+        self.lock = threading.Lock()
+
+    def latency(self) -> float:
+        "Mean seconds per successful request lately; 0 if untried, so it gets tried."
+        with self.lock:
+            if not self.latencies:
+                return 0.0
+            return sum(self.latencies) / len(self.latencies)
+
+    def error_rate(self) -> float:
+        with self.lock:
+            if not self.outcomes:
+                return 0.0
+            return self.outcomes.count(False) / len(self.outcomes)
+
+    def cost(self) -> float:
+        "Expected seconds per useful answer: slow or flaky endpoints cost more."
+        return self.latency() / max(0.05, 1 - self.error_rate())
+
+    def saturated(self) -> bool:
+        return self.in_flight >= self.concurrency
+
+    def start(self):
+        with self.lock:
+            self.in_flight += 1
+
+    def finish(self, *_):
+        with self.lock:
+            self.in_flight -= 1
+
+    def succeeded(self, seconds: float):
+        with self.lock:
+            self.latencies.append(seconds)
+            self.outcomes.append(True)
+            self.down_until = 0.0
+
+    def failed(self):
+        with self.lock:
+            self.outcomes.append(False)
+            self.down_until = time.monotonic() + COOLDOWN_SECONDS
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "latency": round(self.latency(), 4),
+            "error_rate": round(self.error_rate(), 3),
+            "up": time.monotonic() >= self.down_until,
+            "in_flight": self.in_flight,
+        }
+
+
+class Router:
+    """Sends each request to the fastest healthy endpoint, or the next if it fails.
+
+    Endpoints already answering as many requests as their `concurrency` are
+    passed over while another has room, so load spreads out instead of
+    queueing in the fastest endpoint's connection pool. An endpoint that
+    fails is passed over for COOLDOWN_SECONDS, then tried again; if every
+    endpoint is cooling down, they're tried anyway, the one that will be
+    back soonest first. Client errors (a bad request, a bad
+    key) aren't retried, since every endpoint would give the same answer.
+    `client_for(endpoint, is_async)` builds an endpoint's OpenAI client.
+    """
+
+    def __init__(
+        self, endpoints: List[Endpoint], client_for: Callable[[Endpoint, bool], Any]
+    ):
+        self.endpoints = endpoints
+        self.client_for = client_for
+        self.lock = threading.Lock()
+
+    def ranked(self) -> List[Endpoint]:
+        now = time.monotonic()
+        up = [endpoint for endpoint in self.endpoints if endpoint.down_until <= now]
+        down = [endpoint for endpoint in self.endpoints if endpoint.down_until > now]
+        up.sort(key=lambda endpoint: (endpoint.saturated(), endpoint.cost()))
+        down.sort(key=lambda endpoint: endpoint.down_until)
+        return up + down
+
+    def attempts(self) -> Iterator[Endpoint]:
+        """Each endpoint in turn, best first, counted as in flight as it's handed out.
+
+        Ranked again for every attempt, and under a lock, so two requests
+        don't both take the last free place on one endpoint.
+        """
+        tried: List[Endpoint] = []
+        while len(tried) < len(self.endpoints):
+            with self.lock:
+                endpoint = next(
+                    endpoint for endpoint in self.ranked() if endpoint not in tried
+                )
+                endpoint.start()
+            tried.append(endpoint)
+            yield endpoint
+
+    def create(self, **request):
+        error = None
+        for endpoint in self.attempts():
+            started = time.perf_counter()
+            try:
+                response = self.client_for(endpoint, False).chat.completions.create(
+                    **request
+                )
+            except failover_errors() as e:
+                endpoint.finish()
+                error = self._failed(endpoint, e)
+                continue
+            except BaseException:
+                endpoint.finish()
+                raise
+            endpoint.succeeded(time.perf_counter() - started)
+            if request.get("stream"):
+                return GuardedStream(response, endpoint.finish)
+            endpoint.finish()
+            return response
+        raise error
+
+    async def acreate(self, **request):
+        error = None
+        for endpoint in self.attempts():
+            started = time.perf_counter()
+            try:
+                response = await self.client_for(
+                    endpoint, True
+                ).chat.completions.create(**request)
+            except failover_errors() as e:
+                endpoint.finish()
+                error = self._failed(endpoint, e)
+                continue
+            except BaseException:
+                endpoint.finish()
+                raise
+            endpoint.succeeded(time.perf_counter() - started)
+            if request.get("stream"):
+                return AsyncGuardedStream(response, endpoint.finish)
+            endpoint.finish()
+            return response
+        raise error
+
+    def _failed(self, endpoint: Endpoint, error: Exception) -> Exception:
+        endpoint.failed()
+        logger.warning(
+            "LLM endpoint %s failed, trying the next: %s", endpoint.base_url, error
+        )
+        return error
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        return {endpoint.base_url: endpoint.snapshot() for endpoint in self.endpoints}
+
+
+class RoutedClient:
+    "Looks like an OpenAI client to the scheduler, but routes across endpoints."
+
+    def __init__(self, router: Router):
+        self.router = router
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=router.create))
+
+
+class AsyncRoutedClient:
+    def __init__(self, router: Router):
+        self.router = router
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=router.acreate))
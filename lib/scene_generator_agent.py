@@ -1,55 +1,155 @@
-from lib.config import GAME_CONFIG, llm_config_for, client
+import json
+from functools import cached_property
+from typing import Any, Dict
+
+import jsonschema
+
+from lib.agent_runtime import shared
+from lib.config import (
+    GAME_CONFIG,
+    llm_config_for,
+    async_client,
+    client,
+    prompt_budget_for,
+)
 from lib.game_state import GameState
 from lib.logger import logger
-from lib.json_cruncher_agent import JSONCruncher
-from utils import scene_to_text
+from lib.prompt_assembly import assemble, chat_messages
+from lib.json_cruncher_agent import (
+    AsyncJSONCruncher,
+    JSONCruncher,
+    object_prompt_parts,
+)
+from lib.schema_registry import schemas
+from lib.token_budget import count_tokens, scene_to_prompt_text
+from utils import extract_fenced_json
 
 
 class SceneGenerator:
     def __init__(self, name="scene_generator"):
         self.name = name
         self.llm_config = llm_config_for(self.name)
+        self.client = client(self.llm_config, self.name)
+        self.prompt_budget = prompt_budget_for(self.name)
+        self.direct_json = GAME_CONFIG["agents"][self.name].get("direct_json", False)
+        self.structured_output = GAME_CONFIG["agents"][self.name].get(
+            "structured_output", False
+        )
 
-    @property
+    @cached_property
     def system_prompt(self) -> str:
-        system_prompt = GAME_CONFIG["agents"][self.name]["system_prompt"]
-        examples = GAME_CONFIG["agents"][self.name]["examples"]
-        for example in examples:
-            system_prompt += f"\n\n{example}"
-        return system_prompt
+        """Built once, so it's byte-identical on every request.
+
+        In direct_json mode the JSON instructions go here too, ahead of the
+        scenes, since they never change.
+        """
+        agent_config = GAME_CONFIG["agents"][self.name]
+        examples = "\n\n".join(agent_config["examples"])
+        if self.direct_json:
+            examples = f"{examples}\n\n{self.json_instructions}"
+        return assemble(system=agent_config["system_prompt"], examples=examples)
 
     def new_scene(self, description: str, state: GameState) -> GameState:
-        user_prompt = f"Here is the general description of the new scene to generate:\n\n{description}/n/nHere is the last scene: {scene_to_text(state.current_scene)}\n\nPlease provide a full description of the new scene."
+        action = f"Here is the general description of the new scene to generate:\n\n{description}\n\nPlease provide a full description of the new scene."
+        scene = self.scene_text(state.current_scene, action)
+        user_prompt = assemble(scene=f"Here is the last scene: {scene}", action=action)
 
         return self.prompt(user_prompt, state)
 
     def update_scene(self, description: str, state: GameState) -> GameState:
-        user_prompt = f"This is the current scene:\n\n{scene_to_text(state.current_scene)}\n\nHere is the general idea of the updates to make to the scene:\n\n{description} Please provide a full description of the updated scene."
+        action = f"Here is the general idea of the updates to make to the scene:\n\n{description} Please provide a full description of the updated scene."
+        scene = self.scene_text(state.current_scene, action)
+        user_prompt = assemble(
+            scene=f"This is the current scene:\n\n{scene}", action=action
+        )
 
         return self.prompt(user_prompt, state)
 
-    def prompt(self, prompt_text, state: GameState) -> GameState:
-        response = client(self.llm_config).chat.completions.create(
-            messages=[
-                {"role": "system", "content": self.system_prompt},
-                {"role": "user", "content": prompt_text},
-            ],
+    def scene_text(self, scene: dict, action: str) -> str:
+        "The scene, trimmed so the whole prompt fits in the agent's budget."
+        budget = (
+            self.prompt_budget - count_tokens(self.system_prompt) - count_tokens(action)
+        )
+        return scene_to_prompt_text(scene, budget)
+
+    @cached_property
+    def json_instructions(self) -> str:
+        "Asks for the scene as a JSON object, for direct_json mode."
+        _, examples = object_prompt_parts("json_cruncher", "scene")
+        schema = json.dumps(schemas.schema("scene"), indent=2)
+        return f"Respond with only the scene, as a single JSON object that follows this JSON schema:\n\n```json\n{schema}\n```\n\nExample scene object(s):\n\n{examples}"
+
+    def request_options(self) -> Dict[str, Any]:
+        if not (self.direct_json and self.structured_output):
+            return self.llm_config
+        return {
             **self.llm_config,
+            "response_format": {
+                "type": "json_schema",
+                "json_schema": {"name": "scene", "schema": schemas.schema("scene")},
+            },
+        }
+
+    def messages(self, prompt_text: str):
+        return chat_messages(self.system_prompt, prompt_text)
+
+    def prompt(self, prompt_text, state: GameState) -> GameState:
+        response = self.client.chat.completions.create(
+            messages=self.messages(prompt_text),
+            **self.request_options(),
         )
         if response.choices[0].message.content:
             content = response.choices[0].message.content
             return self.handle_llm_response(content, state)
         return state
 
+    def scene_from_json(self, content: str) -> dict | None:
+        "In direct_json mode, the scene from the response if it's valid. None otherwise."
+        if not self.direct_json:
+            return None
+
+        new_scene = extract_fenced_json(content)
+        try:
+            schemas.validator("scene").validate(new_scene)
+        except jsonschema.ValidationError as e:
+            logger.info("Scene JSON invalid, converting it instead: %s", e.message)
+            return None
+        return new_scene
+
     def handle_llm_response(self, content: str, state: GameState) -> GameState:
         logger.info("SceneGenerator response: %s", content)
-        new_scene = JSONCruncher().json_from_text(content, "scene")
+        new_scene = self.scene_from_json(content)
+        if new_scene is None:
+            new_scene = shared(JSONCruncher).json_from_text(content, "scene")
         logger.info("New scene: %s", new_scene)
 
-        return GameState(
-            current_scene=new_scene,
-            inventory=state.inventory,
-            engine=state.engine,
-            story=state.story,
-            feedback="",
+        return self.with_scene(new_scene, state)
+
+    def with_scene(self, new_scene: dict, state: GameState) -> GameState:
+        return state.evolve(current_scene=new_scene, feedback="")
+
+
+class AsyncSceneGenerator(SceneGenerator):
+    def __init__(self, name="scene_generator"):
+        super().__init__(name)
+        self.client = async_client(self.llm_config, self.name)
+
+    async def prompt(self, prompt_text, state: GameState) -> GameState:
+        response = await self.client.chat.completions.create(
+            messages=self.messages(prompt_text),
+            **self.request_options(),
         )
+        if response.choices[0].message.content:
+            content = response.choices[0].message.content
+            return await self.handle_llm_response(content, state)
+        return state
+
+    async def handle_llm_response(self, content: str, state: GameState) -> GameState:
+        logger.info("SceneGenerator response: %s", content)
+        new_scene = self.scene_from_json(content)
+        if new_scene is None:
+            cruncher = shared(AsyncJSONCruncher)
+            new_scene = await cruncher.json_from_text(content, "scene")
+        logger.info("New scene: %s", new_scene)
+
+        return self.with_scene(new_scene, state)
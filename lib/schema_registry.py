@@ -0,0 +1,60 @@
+import json
+from functools import cached_property
+from pathlib import Path
+from typing import Any, Dict
+
+import jsonschema
+from referencing import Registry, Resource
+from referencing.jsonschema import DRAFT202012
+
+from lib.config import SCHEMAS_DIR, registry
+
+
+class SchemaRegistry:
+    """Every `<type>_schema.json` in the content module, loaded and compiled once.
+
+    The schemas are registered under their file names on top of the shared
+    `referencing.Registry` from lib/config, so one schema can `$ref` another.
+    Each object type gets a validator built once and reused for every
+    response.
+    """
+
+    def __init__(self, schemas_dir: Path = SCHEMAS_DIR, base: Registry = registry):
+        self.schemas_dir = schemas_dir
+        self.base = base
+
+    @cached_property
+    def schemas(self) -> Dict[str, Dict[str, Any]]:
+        schemas = {}
+        for path in sorted(self.schemas_dir.glob("*_schema.json")):
+            with open(path, "r", encoding="utf-8") as f:
+                schemas[path.name.removesuffix("_schema.json")] = json.load(f)
+        return schemas
+
+    @cached_property
+    def registry(self) -> Registry:
+        return self.base.with_resources(
+            (
+                f"{obj_type}_schema.json",
+                Resource.from_contents(schema, default_specification=DRAFT202012),
+            )
+            for obj_type, schema in self.schemas.items()
+        )
+
+    @cached_property
+    def validators(self) -> Dict[str, jsonschema.protocols.Validator]:
+        validators = {}
+        for obj_type, schema in self.schemas.items():
+            validator_class = jsonschema.validators.validator_for(schema)
+            validator_class.check_schema(schema)
+            validators[obj_type] = validator_class(schema, registry=self.registry)
+        return validators
+
+    def schema(self, obj_type: str) -> Dict[str, Any]:
+        return self.schemas[obj_type]
+
+    def validator(self, obj_type: str) -> jsonschema.protocols.Validator:
+        return self.validators[obj_type]
+
+
+schemas = SchemaRegistry()
@@ -0,0 +1,121 @@
+import contextvars
+import threading
+from concurrent.futures import CancelledError, Future, ThreadPoolExecutor
+from typing import Dict, Tuple
+
+from lib.agent_runtime import shared
+from lib.config import SPECULATIVE_SCENES, SPECULATIVE_WORKERS
+from lib.game_state import GameState
+from lib.llm_scheduler import Escalation, Priority, prioritised
+from lib.logger import logger
+from lib.scene_generator_agent import SceneGenerator
+from utils import exit_key
+
+
+class SpeculativeGenerator:
+    """Pre-generates the scene behind each visible exit while the player reads.
+
+    `prefetch` queues one job per exit of the scene on screen, locked exits
+    last. Anything queued for a scene the player has left is cancelled, and
+    jobs that were already running are left to finish but thrown away.
+    `take` hands the `go` path the scene for the exit the player picked.
+    Jobs run at background priority until a player is waiting on one.
+    """
+
+    def __init__(
+        self, enabled: bool = SPECULATIVE_SCENES, workers: int = SPECULATIVE_WORKERS
+    ):
+        self.enabled = enabled
+        self.workers = workers
+        self.executor: ThreadPoolExecutor | None = None
+        self.jobs: Dict[Tuple[str, str], Future] = {}
+        self.escalations: Dict[Tuple[str, str], Escalation] = {}
+        self.scene_id: str | None = None
+        self.lock = threading.Lock()
+
+    def prefetch(self, state: GameState):
+        if not self.enabled:
+            return
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(
+                max_workers=self.workers, thread_name_prefix="speculative"
+            )
+
+        scene = state.current_scene
+        exits = [
+            exit_data
+            for exit_data in scene.get("exits", [])
+            if "hidden" not in exit_data
+        ]
+        exits.sort(key=lambda exit_data: bool(exit_data.get("locked")))
+
+        with self.lock:
+            self.scene_id = scene.get("id")
+            self._cancel_stale()
+            for exit_data in exits:
+                key = exit_key(scene, exit_data)
+                if key not in self.jobs:
+                    escalation = self.escalations[key] = Escalation(Priority.BACKGROUND)
+                    # In the player's context, so it's queued as their session
+                    context = contextvars.copy_context()
+                    self.jobs[key] = self.executor.submit(
+                        context.run, self._generate, key, exit_data, state, escalation
+                    )
+
+    def take(self, scene: dict | None, exit_data: dict | None) -> dict | None:
+        """The pre-generated scene behind the exit, if there is one.
+
+        Waits for a job that is already running, since that's still quicker
+        than starting over, and raises its requests to the narrator's
+        priority. A job that hasn't started is cancelled rather than waited
+        on, like everything else queued for the scene, so the caller
+        generates the scene itself straight away.
+        """
+        if not scene or not exit_data:
+            return None
+
+        key = exit_key(scene, exit_data)
+        with self.lock:
+            future = self.jobs.pop(key, None)
+            escalation = self.escalations.pop(key, None)
+            self.scene_id = None
+            self._cancel_stale()
+
+        if future is None or future.cancel() or future.cancelled():
+            return None
+        escalation.escalate()
+        try:
+            return future.result()
+        except CancelledError:
+            return None
+        except Exception:
+            logger.exception("Speculative scene generation failed")
+            return None
+
+    def _cancel_stale(self):
+        for key, future in list(self.jobs.items()):
+            if key[0] != self.scene_id:
+                future.cancel()
+                del self.jobs[key]
+                del self.escalations[key]
+
+    def _generate(
+        self,
+        key: Tuple[str, str],
+        exit_data: dict,
+        state: GameState,
+        escalation: Escalation,
+    ) -> dict | None:
+        if key[0] != self.scene_id:
+            return None
+
+        description = f"The player goes {exit_data['direction']}, through this exit: {exit_data['description']}"
+        logger.info("Speculatively generating the scene behind %s", key)
+        with prioritised(escalation):
+            new_state = shared(SceneGenerator).new_scene(description, state)
+        if new_state is state:
+            return None
+        return new_state.current_scene
+
+
+speculator = SpeculativeGenerator()
@@ -0,0 +1,188 @@
+import hashlib
+import queue
+import re
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, List, Protocol
+
+from lib.config import (
+    TTS_BACKEND,
+    TTS_CACHE_DIR,
+    TTS_MODEL,
+    TTS_VOICE,
+    TTS_WORKERS,
+    backend_client,
+)
+from lib.logger import logger
+
+# The end of a sentence: after . ! or ? (and any closing quote), or a line break
+SENTENCE_END = re.compile(r"(?<=[.!?])\s+|(?<=[.!?][\"')\]])\s+|\n+")
+ANSI_ESCAPE = re.compile(r"\x1b\[[0-9;]*m")
+# Command-line players that can play a WAV file, in order of preference
+PLAYERS = (["afplay"], ["aplay", "-q"], ["paplay"], ["ffplay", "-nodisp", "-autoexit"])
+
+
+class Synthesizer(Protocol):
+    "Turns a sentence into audio. `name` goes in the cache key."
+
+    name: str
+
+    def synthesize(self, text: str) -> bytes: ...
+
+
+class OpenAISynthesizer:
+    def __init__(self, model: str = TTS_MODEL, voice: str = TTS_VOICE):
+        self.model = model
+        self.voice = voice
+        self.name = f"openai:{model}:{voice}"
+
+    def synthesize(self, text: str) -> bytes:
+        response = backend_client("openai").audio.speech.create(
+            model=self.model, voice=self.voice, input=text, response_format="wav"
+        )
+        return response.content
+
+
+class StubSynthesizer:
+    """Stands in for a real backend: the "audio" is the sentence itself.
+
+    `delay` seconds per sentence, to act like a slow backend.
+    """
+
+    name = "stub"
+
+    def __init__(self, delay: float = 0.0):
+        self.delay = delay
+        self.calls: List[str] = []
+
+    def synthesize(self, text: str) -> bytes:
+        self.calls.append(text)
+        time.sleep(self.delay)
+        return text.encode("utf-8")
+
+
+SYNTHESIZERS = {"openai": OpenAISynthesizer, "stub": StubSynthesizer}
+
+
+class AudioCache:
+    "Synthesised sentences on disk, keyed by a hash of the backend and the text."
+
+    def __init__(self, directory: Path | None = TTS_CACHE_DIR):
+        self.directory = Path(directory) if directory else None
+
+    def path(self, synthesizer: Synthesizer, text: str) -> Path | None:
+        if self.directory is None:
+            return None
+        digest = hashlib.sha256(f"{synthesizer.name}\0{text}".encode("utf-8"))
+        return self.directory / f"{digest.hexdigest()}.wav"
+
+    def get(self, synthesizer: Synthesizer, text: str) -> bytes | None:
+        path = self.path(synthesizer, text)
+        try:
+            return path.read_bytes() if path else None
+        except OSError:
+            return None
+
+    def put(self, synthesizer: Synthesizer, text: str, audio: bytes):
+        path = self.path(synthesizer, text)
+        if path is None:
+            return
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            temporary = path.with_name(path.name + ".tmp")
+            temporary.write_bytes(audio)
+            temporary.replace(path)
+        except OSError:
+            logger.warning("Couldn't cache speech in %s", self.directory)
+
+
+def play_with_system_player(audio: bytes):
+    "Plays WAV audio with whichever command-line player is installed."
+    player = next((command for command in PLAYERS if shutil.which(command[0])), None)
+    if player is None:
+        logger.warning("No audio player found; install one of %s", PLAYERS)
+        return
+    with tempfile.NamedTemporaryFile(suffix=".wav") as f:
+        f.write(audio)
+        f.flush()
+        subprocess.run([*player, f.name], check=False)
+
+
+class Speaker:
+    """Reads text aloud a sentence at a time, starting as soon as it can.
+
+    Text can arrive in pieces, e.g. streamed feedback: each sentence is sent
+    to be synthesised by a pool of workers as soon as it's complete, and a
+    playback thread plays them in order, so the first sentence is heard while
+    the rest are still being written or synthesised. Sentences already in
+    the audio cache aren't synthesised again.
+    """
+
+    def __init__(
+        self,
+        synthesizer: Synthesizer | None = None,
+        cache: AudioCache | None = None,
+        play: Callable[[bytes], None] = play_with_system_player,
+        workers: int = TTS_WORKERS,
+    ):
+        self.synthesizer = synthesizer or SYNTHESIZERS[TTS_BACKEND]()
+        self.cache = cache or AudioCache()
+        self.play = play
+        self.executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="speech"
+        )
+        self.buffer = ""
+        self.lock = threading.Lock()
+        self.playlist: queue.Queue[Future] = queue.Queue()
+        threading.Thread(
+            target=self._play_in_order, name="speech-player", daemon=True
+        ).start()
+
+    def feed(self, text: str):
+        "Adds text; any sentences it completes are sent off to be spoken."
+        with self.lock:
+            self.buffer += ANSI_ESCAPE.sub("", text)
+            *sentences, self.buffer = SENTENCE_END.split(self.buffer)
+            for sentence in sentences:
+                self._queue(sentence)
+
+    def flush(self):
+        "Speaks whatever's left, even if it isn't a whole sentence."
+        with self.lock:
+            sentence, self.buffer = self.buffer, ""
+            self._queue(sentence)
+
+    def say(self, text: str):
+        self.feed(text)
+        self.flush()
+
+    def wait(self):
+        "Blocks until everything queued has been played."
+        self.playlist.join()
+
+    def _queue(self, sentence: str):
+        sentence = sentence.strip()
+        if sentence:
+            self.playlist.put(self.executor.submit(self._audio, sentence))
+
+    def _audio(self, sentence: str) -> bytes:
+        audio = self.cache.get(self.synthesizer, sentence)
+        if audio is None:
+            audio = self.synthesizer.synthesize(sentence)
+            self.cache.put(self.synthesizer, sentence, audio)
+        return audio
+
+    def _play_in_order(self):
+        while True:
+            future = self.playlist.get()
+            try:
+                self.play(future.result())
+            except Exception:
+                logger.exception("Couldn't speak a sentence")
+            finally:
+                self.playlist.task_done()
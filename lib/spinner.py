@@ -0,0 +1,16 @@
+import threading
+from contextlib import nullcontext
+
+from yaspin import yaspin
+
+
+def spinner(text: str, color: str = "cyan"):
+    """A yaspin spinner for the main thread, or a no-op context anywhere else.
+
+    Agents can end up running on worker threads (e.g. scene generation started
+    while the narrator is still streaming). Two spinners fighting over the same
+    terminal line garbles the output, so only the main thread gets one.
+    """
+    if threading.current_thread() is not threading.main_thread():
+        return nullcontext()
+    return yaspin(text=text, color=color)
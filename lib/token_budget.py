@@ -0,0 +1,83 @@
+from functools import cache
+
+from lib.logger import logger
+from utils import scene_to_compact_text
+
+CHARS_PER_TOKEN = 4
+# Never trim a description shorter than this, however tight the budget
+MIN_DESCRIPTION_TOKENS = 60
+
+
+@cache
+def _encoding():
+    "tiktoken's cl100k_base encoding if tiktoken is installed, None otherwise."
+    try:
+        import tiktoken
+
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception:
+        # Not installed, or it couldn't fetch the encoding
+        return None
+
+
+def count_tokens(text: str) -> int:
+    """An estimate of the tokens in `text`.
+
+    Counted with tiktoken when it's installed. Local models use their own
+    tokenizers, so it's only ever an estimate; without tiktoken it's one
+    token per four characters.
+    """
+    encoding = _encoding()
+    if encoding is None:
+        return -(-len(text) // CHARS_PER_TOKEN)
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def trim_to_tokens(text: str, max_tokens: int) -> str:
+    "Cuts `text` down to about `max_tokens`, at the end of a sentence if there is one."
+    if max_tokens <= 0:
+        return ""
+    if count_tokens(text) <= max_tokens:
+        return text
+
+    encoding = _encoding()
+    if encoding is None:
+        trimmed = text[: max_tokens * CHARS_PER_TOKEN]
+    else:
+        tokens = encoding.encode(text, disallowed_special=())
+        trimmed = encoding.decode(tokens[:max_tokens])
+
+    sentence_end = trimmed.rfind(". ")
+    if sentence_end > len(trimmed) // 2:
+        return trimmed[: sentence_end + 1]
+    return trimmed.rstrip() + "…"
+
+
+def scene_to_prompt_text(scene: dict, max_tokens: int | None = None) -> str:
+    """The compact encoding of a scene, trimmed to fit in `max_tokens`.
+
+    Internal notes go first, then the description is cut down, so that
+    scenes which keep getting updated don't keep making prompts longer.
+    Title and exits are always kept.
+    """
+    text = scene_to_compact_text(scene)
+    if max_tokens is None or count_tokens(text) <= max_tokens:
+        return text
+
+    notes = scene.get("internal_notes", "")
+    without_notes = scene_to_compact_text(scene, notes="")
+    spare = max_tokens - count_tokens(without_notes)
+    if notes and spare > 0:
+        text = scene_to_compact_text(scene, notes=trim_to_tokens(str(notes), spare))
+        if count_tokens(text) <= max_tokens:
+            return text
+
+    description = scene["description"]
+    skeleton = scene_to_compact_text(scene, description="", notes="")
+    description_budget = max(
+        max_tokens - count_tokens(skeleton), MIN_DESCRIPTION_TOKENS
+    )
+    logger.info("Trimming scene %s to about %s tokens", scene.get("id"), max_tokens)
+    return scene_to_compact_text(
+        scene, description=trim_to_tokens(description, description_budget), notes=""
+    )
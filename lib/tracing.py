@@ -0,0 +1,352 @@
+import functools
+import inspect
+import itertools
+import json
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Deque, Dict, Iterator, Tuple
+
+# The attribute each kind of span is broken down by in the metrics
+METRIC_LABELS = {
+    "turn": "command",
+    "dispatch_command": "command",
+    "llm": "agent",
+    "json_attempt": "obj_type",
+    "cascade": "model",
+}
+QUANTILES = (0.5, 0.95, 0.99)
+# Durations kept per span kind and label, for the quantiles
+SAMPLES = 2048
+
+
+def nearest_rank(ordered: list, quantile: float) -> float:
+    return ordered[min(len(ordered) - 1, int(quantile * len(ordered)))]
+
+
+class Span:
+    """One timed piece of work, e.g. a turn, a command or an LLM request.
+
+    `attributes` can be added to with `set` until the span ends.
+    """
+
+    _ids = itertools.count(1)
+
+    def __init__(
+        self, tracer: "Tracer", name: str, parent: "Span | None", **attributes
+    ):
+        self.tracer = tracer
+        self.name = name
+        self.id = next(self._ids)
+        self.trace_id = parent.trace_id if parent else f"{os.getpid()}-{self.id}"
+        self.parent_id = parent.id if parent else None
+        self.attributes: Dict[str, Any] = attributes
+        self.start = time.time()
+        self.started = time.perf_counter()
+        self.duration: float | None = None
+
+    def set(self, key: str, value: Any):
+        self.attributes[key] = value
+
+    def record_usage(self, response: Any):
+        "Tokens and model from a chat completion, if it reports them."
+        usage = getattr(response, "usage", None)
+        if usage is not None:
+            self.set("prompt_tokens", getattr(usage, "prompt_tokens", None) or 0)
+            completion_tokens = getattr(usage, "completion_tokens", None) or 0
+            self.set("completion_tokens", completion_tokens)
+            details = getattr(usage, "prompt_tokens_details", None)
+            if getattr(details, "cached_tokens", None):
+                self.set("cached_tokens", details.cached_tokens)
+        if getattr(response, "model", None):
+            self.set("model", response.model)
+
+    def end(self, error: BaseException | None = None):
+        if self.duration is not None:
+            return
+        self.duration = time.perf_counter() - self.started
+        if error is not None:
+            self.set("error", type(error).__name__)
+        self.tracer.finish(self)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "trace": self.trace_id,
+            "span": self.id,
+            "parent": self.parent_id,
+            "name": self.name,
+            "start": self.start,
+            "duration_ms": round(self.duration * 1000, 3),
+            **self.attributes,
+        }
+
+
+class Tracer:
+    """Collects finished spans: appends them to a JSONL file and keeps the metrics.
+
+    With `metrics_path`, the Prometheus text metrics are rewritten there after
+    every turn.
+    """
+
+    def __init__(self, trace_path: str | None = None, metrics_path: str | None = None):
+        self.trace_path = trace_path
+        self.metrics_path = metrics_path
+        self.lock = threading.Lock()
+        self.trace_file = (
+            open(trace_path, "a", encoding="utf-8") if trace_path else None
+        )
+        self.durations: Dict[Tuple[str, str], Deque[float]] = defaultdict(
+            lambda: deque(maxlen=SAMPLES)
+        )
+        self.counts: Dict[Tuple[str, str], int] = defaultdict(int)
+        self.sums: Dict[Tuple[str, str], float] = defaultdict(float)
+        self.queue_seconds: Dict[str, float] = defaultdict(float)
+        self.tokens: Dict[Tuple[str, str, str], int] = defaultdict(int)
+        self.requests: Dict[Tuple[str, str, bool], int] = defaultdict(int)
+        self.turns: Dict[str, int] = defaultdict(int)
+        # Per agent, tier and model: [attempts, accepted, seconds]
+        self.tiers: Dict[Tuple[str, int, str], list] = defaultdict(lambda: [0, 0, 0.0])
+
+    def finish(self, span: Span):
+        label = str(span.attributes.get(METRIC_LABELS.get(span.name, ""), ""))
+        with self.lock:
+            key = (span.name, label)
+            self.durations[key].append(span.duration)
+            self.counts[key] += 1
+            self.sums[key] += span.duration
+
+            if span.name == "llm":
+                self._record_llm(span)
+            elif span.name == "turn":
+                self.turns[str(span.attributes.get("served"))] += 1
+            elif span.name == "cascade":
+                self._record_tier(span)
+
+            if self.trace_file is not None:
+                self.trace_file.write(json.dumps(span.to_dict(), default=str) + "\n")
+                self.trace_file.flush()
+
+        if span.name == "turn" and self.metrics_path:
+            self.write_metrics(self.metrics_path)
+
+    def _record_llm(self, span: Span):
+        agent = str(span.attributes.get("agent"))
+        model = str(span.attributes.get("model"))
+        self.requests[(agent, model, bool(span.attributes.get("cache_hit")))] += 1
+        self.queue_seconds[agent] += span.attributes.get("queue_ms", 0) / 1000
+        for kind in ("prompt", "completion", "cached"):
+            tokens = span.attributes.get(f"{kind}_tokens", 0)
+            self.tokens[(agent, model, kind)] += tokens
+
+    def _record_tier(self, span: Span):
+        attributes = span.attributes
+        key = (
+            str(attributes.get("agent")),
+            attributes.get("tier", 1),
+            str(attributes.get("model")),
+        )
+        tier = self.tiers[key]
+        tier[0] += 1
+        tier[1] += 1 if attributes.get("accepted") else 0
+        tier[2] += span.duration
+
+    def tier_stats(self) -> Dict[Tuple[str, int, str], Dict[str, float]]:
+        """How each model in each agent's cascade has done, by (agent, tier, model).
+
+        The success rate is the fraction of its attempts that were accepted,
+        and `mean_seconds` the average time an attempt took.
+        """
+        with self.lock:
+            return {
+                key: {
+                    "attempts": attempts,
+                    "accepted": accepted,
+                    "success_rate": accepted / attempts,
+                    "mean_seconds": seconds / attempts,
+                }
+                for key, (attempts, accepted, seconds) in sorted(self.tiers.items())
+            }
+
+    def local_fraction(self) -> float | None:
+        """Of the turns that needed a narrator, the fraction served locally instead.
+
+        None before any such turn. Built-in commands and input that wasn't
+        understood don't count either way.
+        """
+        with self.lock:
+            local = self.turns.get("local", 0)
+            total = local + self.turns.get("narrator", 0)
+            return local / total if total else None
+
+    def percentiles(self, name: str) -> Dict[str, Dict[float, float]]:
+        "Duration quantiles in seconds for each label of one kind of span."
+        with self.lock:
+            samples = {
+                label: sorted(durations)
+                for (span_name, label), durations in self.durations.items()
+                if span_name == name
+            }
+        return {
+            label: {
+                quantile: nearest_rank(durations, quantile) for quantile in QUANTILES
+            }
+            for label, durations in samples.items()
+        }
+
+    def prometheus_text(self) -> str:
+        lines = ["# TYPE dungeonmaster_span_seconds summary"]
+        with self.lock:
+            names = sorted({name for name, _ in self.counts})
+        for name in names:
+            label_key = METRIC_LABELS.get(name)
+            for label, quantiles in sorted(self.percentiles(name).items()):
+                labels = f'span="{name}"'
+                if label_key:
+                    labels += f',{label_key}="{label}"'
+                for quantile, value in quantiles.items():
+                    lines.append(
+                        f"dungeonmaster_span_seconds"
+                        f'{{{labels},quantile="{quantile}"}} {value:.6f}'
+                    )
+                with self.lock:
+                    count = self.counts[(name, label)]
+                    total = self.sums[(name, label)]
+                lines.append(f"dungeonmaster_span_seconds_count{{{labels}}} {count}")
+                lines.append(f"dungeonmaster_span_seconds_sum{{{labels}}} {total:.6f}")
+
+        with self.lock:
+            lines.append("# TYPE dungeonmaster_turns_total counter")
+            for served, count in sorted(self.turns.items()):
+                lines.append(f'dungeonmaster_turns_total{{served="{served}"}} {count}')
+            lines.append("# TYPE dungeonmaster_llm_requests_total counter")
+            for (agent, model, cache_hit), count in sorted(self.requests.items()):
+                lines.append(
+                    f"dungeonmaster_llm_requests_total"
+                    f'{{agent="{agent}",model="{model}",'
+                    f'cache_hit="{str(cache_hit).lower()}"}} {count}'
+                )
+            lines.append("# TYPE dungeonmaster_llm_tokens_total counter")
+            for (agent, model, kind), count in sorted(self.tokens.items()):
+                lines.append(
+                    f'dungeonmaster_llm_tokens_total{{agent="{agent}",model="{model}",'
+                    f'kind="{kind}"}} {count}'
+                )
+            lines.append("# TYPE dungeonmaster_cascade_attempts_total counter")
+            for (agent, tier, model), (attempts, accepted, _) in sorted(
+                self.tiers.items()
+            ):
+                labels = f'agent="{agent}",tier="{tier}",model="{model}"'
+                lines.append(
+                    f'dungeonmaster_cascade_attempts_total{{{labels},accepted="true"}}'
+                    f" {accepted}"
+                )
+                lines.append(
+                    f'dungeonmaster_cascade_attempts_total{{{labels},accepted="false"}}'
+                    f" {attempts - accepted}"
+                )
+            lines.append("# TYPE dungeonmaster_llm_queue_seconds_total counter")
+            for agent, seconds in sorted(self.queue_seconds.items()):
+                lines.append(
+                    f"dungeonmaster_llm_queue_seconds_total"
+                    f'{{agent="{agent}"}} {seconds:.6f}'
+                )
+        return "\n".join(lines) + "\n"
+
+    def write_metrics(self, path: str):
+        "Writes to a temporary file first, so a scraper never sees half the metrics."
+        temporary = f"{path}.tmp"
+        with open(temporary, "w", encoding="utf-8") as f:
+            f.write(self.prometheus_text())
+        os.replace(temporary, path)
+
+
+tracer = Tracer(os.getenv("TRACE_FILE"), os.getenv("METRICS_FILE"))
+current_span: ContextVar[Span | None] = ContextVar("current_span", default=None)
+
+
+def start_span(name: str, **attributes) -> Span:
+    """A span under the current one, which isn't made current itself.
+
+    For leaves that end somewhere else, e.g. a streamed response; call `end`.
+    """
+    return Span(tracer, name, current_span.get(), **attributes)
+
+
+@contextmanager
+def span(name: str, **attributes) -> Iterator[Span]:
+    "Times the block, with any spans started inside it as children."
+    new_span = start_span(name, **attributes)
+    token = current_span.set(new_span)
+    try:
+        yield new_span
+    except BaseException as e:
+        new_span.end(error=e)
+        raise
+    finally:
+        current_span.reset(token)
+        new_span.end()
+
+
+def in_span(name: str, call: Callable[[], Any], **attributes) -> Any:
+    """Runs `call` in a span.
+
+    If it returns an awaitable, the span stays open until that's been awaited.
+    """
+    new_span = start_span(name, **attributes)
+    token = current_span.set(new_span)
+    try:
+        result = call()
+    except BaseException as e:
+        new_span.end(error=e)
+        raise
+    finally:
+        current_span.reset(token)
+
+    if not inspect.isawaitable(result):
+        new_span.end()
+        return result
+
+    async def awaited():
+        token = current_span.set(new_span)
+        try:
+            return await result
+        except BaseException as e:
+            new_span.end(error=e)
+            raise
+        finally:
+            current_span.reset(token)
+            new_span.end()
+
+    return awaited()
+
+
+def traced(name: str, attributes: Callable[..., Dict[str, Any]] | None = None):
+    """Decorator that runs a function, sync or async, in a span.
+
+    `attributes` is called with the function's arguments and returns the
+    span's attributes.
+    """
+
+    def decorator(function):
+        if inspect.iscoroutinefunction(function):
+
+            @functools.wraps(function)
+            async def async_wrapper(*args, **kwargs):
+                extra = attributes(*args, **kwargs) if attributes else {}
+                with span(name, **extra):
+                    return await function(*args, **kwargs)
+
+            return async_wrapper
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            extra = attributes(*args, **kwargs) if attributes else {}
+            with span(name, **extra):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
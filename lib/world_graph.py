@@ -0,0 +1,129 @@
+import json
+import sqlite3
+import threading
+from collections import OrderedDict
+
+from lib.config import WORLD_CACHE_SIZE, WORLD_DB
+from lib.logger import logger
+from utils import OPPOSITE_DIRECTIONS, exit_key
+
+
+class WorldGraph:
+    """Every scene the player has seen, and where each exit they took leads.
+
+    Scenes are keyed by their `id`, exits by the scene id plus the exit id (or
+    direction). Lookups go through an in-memory LRU of scenes first and then
+    SQLite, which is on disk if `WORLD_DB` is set and in memory otherwise.
+    """
+
+    def __init__(self, path: str = WORLD_DB, cache_size: int = WORLD_CACHE_SIZE):
+        self.cache_size = cache_size
+        self.cache: OrderedDict[str, dict] = OrderedDict()
+        self.lock = threading.RLock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS scenes (id TEXT PRIMARY KEY, scene TEXT NOT NULL);
+            CREATE TABLE IF NOT EXISTS exits (
+                scene_id TEXT NOT NULL,
+                exit TEXT NOT NULL,
+                destination_id TEXT NOT NULL,
+                PRIMARY KEY (scene_id, exit)
+            );
+            """
+        )
+
+    def scene(self, scene_id: str) -> dict | None:
+        with self.lock:
+            if scene_id in self.cache:
+                self.cache.move_to_end(scene_id)
+                return self.cache[scene_id]
+
+            row = self.db.execute(
+                "SELECT scene FROM scenes WHERE id = ?", (scene_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            scene = json.loads(row[0])
+            self._cache(scene)
+            return scene
+
+    def destination(self, scene: dict | None, exit_data: dict | None) -> dict | None:
+        "The scene on the other side of an exit, if the player has been through it."
+        if not scene or not exit_data:
+            return None
+
+        with self.lock:
+            row = self.db.execute(
+                "SELECT destination_id FROM exits WHERE scene_id = ? AND exit = ?",
+                exit_key(scene, exit_data),
+            ).fetchone()
+            if row is None:
+                return None
+            return self.scene(row[0])
+
+    def put_scene(self, scene: dict):
+        "Store a scene, replacing whatever was stored under its id."
+        if "id" not in scene:
+            return
+        with self.lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO scenes (id, scene) VALUES (?, ?)",
+                (scene["id"], json.dumps(scene)),
+            )
+            self.db.commit()
+            self._cache(scene)
+
+    def add_scene(self, scene: dict) -> dict:
+        """Store a newly generated scene and return it.
+
+        The model reuses ids ("library", "hallway") for rooms that have
+        nothing to do with each other, so a clashing id gets a suffix rather
+        than overwriting the room that was there first.
+        """
+        if "id" not in scene:
+            return scene
+        with self.lock:
+            stored = self.scene(scene["id"])
+            if stored is not None and stored != scene:
+                suffix = 2
+                while self.scene(f"{scene['id']}_{suffix}") is not None:
+                    suffix += 1
+                scene = {**scene, "id": f"{scene['id']}_{suffix}"}
+            self.put_scene(scene)
+            return scene
+
+    def connect(self, scene: dict, exit_data: dict, destination: dict):
+        """Record that `exit_data` leads from `scene` to `destination`.
+
+        Also records the way back, if the destination has an exit in the
+        opposite direction that doesn't lead anywhere yet.
+        """
+        with self.lock:
+            self.put_scene(scene)
+            self.db.execute(
+                "INSERT OR REPLACE INTO exits (scene_id, exit, destination_id) VALUES (?, ?, ?)",
+                (*exit_key(scene, exit_data), destination["id"]),
+            )
+
+            opposite = OPPOSITE_DIRECTIONS.get(exit_data.get("direction", "").lower())
+            for way_back in destination.get("exits", []):
+                if way_back.get("direction", "").lower() == opposite:
+                    self.db.execute(
+                        "INSERT OR IGNORE INTO exits (scene_id, exit, destination_id) VALUES (?, ?, ?)",
+                        (*exit_key(destination, way_back), scene["id"]),
+                    )
+                    break
+            self.db.commit()
+        logger.info(
+            "World graph: %s leads to %s", exit_key(scene, exit_data), destination["id"]
+        )
+
+    def _cache(self, scene: dict):
+        self.cache[scene["id"]] = scene
+        self.cache.move_to_end(scene["id"])
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+
+world = WorldGraph()
@@ -1,4 +1,9 @@
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, Iterator, List
+
+from lib import tracing
 from lib.game_state import GameState
+from lib.tracing import Tracer
 
 valid_scene = {
     "id": "starting_room",
@@ -40,10 +45,76 @@ valid_story = story = {
     ],
 }
 
-valid_game_state = GameState(
+valid_game_state = GameState.of(
     current_scene=valid_scene,
-    inventory=[],
+    inventory=(),
     engine={"describe_current_scene": True, "last_action": None, "turn_count": 0},
     story=valid_story,
     feedback="",
 )
+
+
+def completion(content: str) -> SimpleNamespace:
+    "A chat completion with one choice, shaped like the OpenAI client's."
+    return SimpleNamespace(
+        choices=[SimpleNamespace(message=SimpleNamespace(content=content))],
+        usage=SimpleNamespace(prompt_tokens=100, completion_tokens=20),
+    )
+
+
+def chunks(content: str) -> Iterator[SimpleNamespace]:
+    "A streamed chat completion, a word at a time."
+    for word in content.split(" "):
+        yield SimpleNamespace(
+            choices=[SimpleNamespace(delta=SimpleNamespace(content=word + " "))]
+        )
+
+
+class FakeClient:
+    """Answers chat completions like an OpenAI client, without a backend.
+
+    `replies` is either a list, answered in order, or a dict of the reply
+    for each model. Every request is kept in `requests`, and the model it
+    asked for in `models`. `make_response` builds each non-streamed response.
+    """
+
+    def __init__(
+        self,
+        replies: List[str] | Dict[str, str],
+        make_response: Callable[[str], Any] = completion,
+    ):
+        self.replies = replies if isinstance(replies, dict) else list(replies)
+        self.make_response = make_response
+        self.requests: List[Dict[str, Any]] = []
+        self.models: List[str] = []
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def __call__(self, llm_config: dict = {}, agent: str | None = None):
+        "Stands in for `lib.config.client`, e.g. with `patch(..., fake)`."
+        return self
+
+    def create(self, **request):
+        self.requests.append(request)
+        self.models.append(request.get("model"))
+        if isinstance(self.replies, dict):
+            reply = self.replies[request["model"]]
+        else:
+            reply = self.replies.pop(0)
+        return chunks(reply) if request.get("stream") else self.make_response(reply)
+
+
+class AsyncFakeClient(FakeClient):
+    async def create(self, **request):
+        return super().create(**request)
+
+
+def use_tracer(monkeypatch, tmp_path=None) -> Tracer:
+    "A fresh tracer for one test, writing spans and metrics under `tmp_path` if given."
+    if tmp_path is None:
+        test_tracer = Tracer()
+    else:
+        test_tracer = Tracer(
+            str(tmp_path / "trace.jsonl"), str(tmp_path / "metrics.prom")
+        )
+    monkeypatch.setattr(tracing, "tracer", test_tracer)
+    return test_tracer
@@ -0,0 +1,35 @@
+import os
+import sys
+from types import SimpleNamespace
+from unittest.mock import patch
+
+script_dir = os.path.dirname(__file__)
+root_dir = os.path.abspath(os.path.join(script_dir, ".."))
+sys.path.append(root_dir)
+
+from lib import agent_runtime
+from lib.agent_runtime import check_backends, shared
+from lib.json_cruncher_agent import AsyncJSONCruncher, JSONCruncher
+
+
+def test_shared_returns_one_instance_per_agent_class():
+    assert shared(JSONCruncher) is shared(JSONCruncher)
+    assert shared(AsyncJSONCruncher) is not shared(JSONCruncher)
+
+
+def test_check_backends_reports_a_backend_that_does_not_answer():
+    def models_list():
+        raise ConnectionError("nobody home")
+
+    down = SimpleNamespace(
+        base_url="http://localhost:1234/v1",
+        with_options=lambda **options: SimpleNamespace(
+            models=SimpleNamespace(list=models_list)
+        ),
+    )
+
+    with (
+        patch.object(agent_runtime, "backend_client", lambda name: down),
+        patch.object(agent_runtime, "uses_openai", lambda llm_config: False),
+    ):
+        assert check_backends() == {"local": False}
@@ -0,0 +1,116 @@
+import os
+import sys
+import threading
+from unittest.mock import patch
+
+script_dir = os.path.dirname(__file__)
+root_dir = os.path.abspath(os.path.join(script_dir, ".."))
+sys.path.append(root_dir)
+
+from lib.background_plotter import BackgroundPlotter
+from lib.game import end_turn, start_turn
+from lib.llm_scheduler import llm_session
+from lib.plotter_agent import Plotter
+from tests.fixtures.fixtures import valid_game_state
+
+new_story = {**valid_game_state.story, "goals": ["Cross the moat."]}
+
+
+def play(plotter: BackgroundPlotter, turns: int, state=valid_game_state):
+    for turn in range(turns):
+        state = plotter.merge(start_turn(state))
+        state = end_turn(state.evolve(feedback=f"Turn {turn}."), f"look {turn}")
+        plotter.after_turn(state)
+    return state
+
+
+def test_end_turn_counts_turns():
+    state = end_turn(start_turn(end_turn(valid_game_state, "look")), "look")
+
+    assert state.engine["turn_count"] == 2
+
+
+def test_the_story_is_merged_at_the_start_of_the_turn_after_it_is_ready():
+    prompts = []
+    release = threading.Event()
+
+    def fake_prompt(self, prompt_text, state):
+        prompts.append(prompt_text)
+        release.wait(5)
+        return state.evolve(story=new_story)
+
+    with patch.object(Plotter, "prompt", fake_prompt):
+        plotter = BackgroundPlotter(every=3)
+        state = play(plotter, 3)
+        assert plotter.job is not None
+
+        # Still plotting, so the turn goes ahead with the old story
+        state = play(plotter, 1, state)
+        assert state.story is valid_game_state.story
+
+        release.set()
+        plotter.job.result(5)
+        state = play(plotter, 1, state)
+
+    assert state.story == new_story
+    assert "'look 0': Turn 0." in prompts[0]
+    assert "'look 2': Turn 2." in prompts[0]
+
+
+def test_a_failed_update_leaves_the_story_alone():
+    def failing_prompt(self, prompt_text, state):
+        raise ValueError("The LLM couldn't produce a valid story")
+
+    with patch.object(Plotter, "prompt", failing_prompt):
+        plotter = BackgroundPlotter(every=1)
+        state = play(plotter, 1)
+        plotter.job.exception(5)
+
+        state = play(plotter, 1, state)
+
+    assert state.story is valid_game_state.story
+
+
+def test_a_slow_update_is_followed_by_one_as_soon_as_it_finishes():
+    prompts = []
+    release = threading.Event()
+
+    def slow_prompt(self, prompt_text, state):
+        prompts.append(prompt_text)
+        release.wait(5)
+        return state.evolve(story=new_story)
+
+    with patch.object(Plotter, "prompt", slow_prompt):
+        plotter = BackgroundPlotter(every=2)
+        state = play(plotter, 2)
+
+        # Still running at turn 4, so that update is put off rather than skipped
+        state = play(plotter, 3, state)
+        assert plotter.last_plotted_turn == 2
+
+        release.set()
+        plotter.job.result(5)
+        play(plotter, 1, state)
+        plotter.job.result(5)
+
+    assert len(prompts) == 2
+    assert plotter.last_plotted_turn == 6
+
+
+def test_the_update_is_queued_as_the_players_session():
+    sessions = []
+
+    def fake_prompt(self, prompt_text, state):
+        sessions.append(llm_session.get())
+        return state.evolve(story=new_story)
+
+    with patch.object(Plotter, "prompt", fake_prompt):
+        plotter = BackgroundPlotter(every=1)
+        token = llm_session.set("alice")
+        try:
+            play(plotter, 1)
+        finally:
+            llm_session.reset(token)
+        plotter.job.result(5)
+
+    assert sessions == ["alice"]
@@ -0,0 +1,162 @@
+import asyncio
+import os
+import sys
+from unittest.mock import patch
+
+script_dir = os.path.dirname(__file__)
+root_dir = os.path.abspath(os.path.join(script_dir, ".."))
+sys.path.append(root_dir)
+
+from lib.dispatcher import has_command
+from lib.json_cruncher_agent import JSONCruncher
+from lib.narrator_agent import AsyncNarrator, Narrator
+from tests.fixtures.fixtures import (
+    AsyncFakeClient,
+    FakeClient,
+    use_tracer,
+    valid_game_state,
+)
+
+
+def test_has_command_only_counts_tags_the_dispatcher_knows():
+    assert has_command("<FEEDBACK> It's dark. <UPDATE SCENE> Darker.")
+    assert not has_command("It's dark.")
+    assert not has_command("<THINKING> It's dark.")
+
+
+def test_an_invalid_object_goes_to_the_next_model(monkeypatch):
+    test_tracer = use_tracer(monkeypatch)
+    fake = FakeClient(
+        {
+            "small": '{"title": "No id or description"}',
+            "big": '{"id": "a", "description": "b"}',
+        }
+    )
+
+    with patch("lib.json_cruncher_agent.client", fake):
+        cruncher = JSONCruncher()
+        cruncher.cascade = ["small", "big"]
+        cruncher.max_attempts = 2
+        result = cruncher.json_from_text("A room.", "scene")
+
+    assert result == {"id": "a", "description": "b"}
+    # A repair on the same model, then the whole prompt again for the next one
+    assert fake.models == ["small", "small", "big"]
+    prompts = [request["messages"][-1]["content"] for request in fake.requests]
+    assert "A room." in prompts[0]
+    assert "A room." not in prompts[1]
+    assert "A room." in prompts[2]
+    stats = test_tracer.tier_stats()
+    assert stats[("json_cruncher", 1, "small")]["success_rate"] == 0
+    assert stats[("json_cruncher", 2, "big")]["success_rate"] == 1
+
+
+def test_the_narrator_asks_the_next_model_when_there_is_no_command(monkeypatch):
+    test_tracer = use_tracer(monkeypatch)
+    fake = FakeClient({"small": "Hmm, a door.", "big": "<FEEDBACK> You see a door."})
+
+    with patch("lib.narrator_agent.client", fake):
+        narrator = Narrator()
+        narrator.cascade = ["small", "big"]
+        state = narrator.prompt("look at the door", valid_game_state)
+
+    assert state.feedback == "You see a door."
+    assert fake.models == ["small", "big"]
+    text = test_tracer.prometheus_text()
+    assert (
+        'dungeonmaster_cascade_attempts_total{agent="narrator",tier="1",'
+        'model="small",accepted="false"} 1'
+    ) in text
+
+
+def test_the_first_model_with_a_command_is_used(monkeypatch):
+    use_tracer(monkeypatch)
+    fake = FakeClient({"small": "<FEEDBACK> A door.", "big": "<FEEDBACK> A big door."})
+
+    with patch("lib.narrator_agent.client", fake):
+        narrator = Narrator()
+        narrator.cascade = ["small", "big"]
+        state = narrator.prompt("look at the door", valid_game_state)
+
+    assert state.feedback == "A door."
+    assert fake.models == ["small"]
+
+
+def test_streamed_responses_escalate_too(monkeypatch):
+    use_tracer(monkeypatch)
+    fake = FakeClient({"small": "Hmm, a door.", "big": "<FEEDBACK> You see a door."})
+    shown = []
+
+    with patch("lib.narrator_agent.client", fake):
+        narrator = Narrator()
+        narrator.cascade = ["small", "big"]
+        narrator.stream = True
+        narrator.on_feedback = shown.append
+        state = narrator.prompt("look at the door", valid_game_state)
+
+    assert state.feedback == "You see a door."
+    assert "Hmm" not in "".join(shown)
+
+
+def test_streamed_responses_with_only_unknown_tags_escalate(monkeypatch):
+    use_tracer(monkeypatch)
+    fake = FakeClient(
+        {"small": "<THINKING> It's dark.", "big": "<FEEDBACK> You see a door."}
+    )
+
+    with patch("lib.narrator_agent.client", fake):
+        narrator = Narrator()
+        narrator.cascade = ["small", "big"]
+        narrator.stream = True
+        narrator.on_feedback = lambda text: None
+        state = narrator.prompt("look at the door", valid_game_state)
+
+    assert state.feedback == "You see a door."
+    assert fake.models == ["small", "big"]
+
+
+def test_only_unknown_tags_from_every_model_is_reported(monkeypatch):
+    use_tracer(monkeypatch)
+    fake = FakeClient({"small": "<THINKING> Hmm.", "big": "<THINKING> Dark."})
+
+    with patch("lib.narrator_agent.client", fake):
+        narrator = Narrator()
+        narrator.cascade = ["small", "big"]
+        narrator.stream = True
+        narrator.on_feedback = lambda text: None
+        state = narrator.prompt("look at the door", valid_game_state)
+
+    assert "something went wrong" in state.feedback
+    assert fake.models == ["small", "big"]
+
+
+def test_async_narrators_escalate_too(monkeypatch):
+    use_tracer(monkeypatch)
+    fake = AsyncFakeClient({"small": "", "big": "<FEEDBACK> You see a door."})
+
+    with patch("lib.narrator_agent.async_client", fake):
+        narrator = AsyncNarrator()
+        narrator.cascade = ["small", "big"]
+        state = asyncio.run(narrator.prompt("look at the door", valid_game_state))
+
+    assert state.feedback == "You see a door."
+    assert fake.models == ["small", "big"]
+
+
+def test_each_model_goes_to_the_backend_that_serves_it(monkeypatch):
+    use_tracer(monkeypatch)
+    local = FakeClient({"small": "Hmm."})
+    openai = FakeClient({"gpt-4o": "<FEEDBACK> You see a door."})
+
+    def fake_client(llm_config, agent=None):
+        return openai if llm_config["model"] == "gpt-4o" else local
+
+    with patch("lib.narrator_agent.client", fake_client):
+        narrator = Narrator()
+        narrator.llm_config = {**narrator.llm_config, "model": "small"}
+        narrator.cascade = ["small", "gpt-4o"]
+        state = narrator.prompt("look at the door", valid_game_state)
+
+    assert state.feedback == "You see a door."
+    assert local.models == ["small"]
+    assert openai.models == ["gpt-4o"]
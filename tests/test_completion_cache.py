@@ -0,0 +1,102 @@
+import os
+import sys
+import time
+
+script_dir = os.path.dirname(__file__)
+root_dir = os.path.abspath(os.path.join(script_dir, ".."))
+sys.path.append(root_dir)
+
+from openai.types.chat import ChatCompletion
+
+from lib.completion_cache import CachingClient, CompletionCache, cached_if
+from tests.fixtures.fixtures import FakeClient
+
+
+def chat_completion(content: str) -> ChatCompletion:
+    return ChatCompletion.model_validate(
+        {
+            "id": "chatcmpl-1",
+            "object": "chat.completion",
+            "created": 0,
+            "model": "test-model",
+            "choices": [
+                {
+                    "index": 0,
+                    "finish_reason": "stop",
+                    "message": {"role": "assistant", "content": content},
+                }
+            ],
+        }
+    )
+
+
+def request(content: str) -> dict:
+    return {
+        "model": "test-model",
+        "temperature": 0.1,
+        "messages": [{"role": "user", "content": content}],
+    }
+
+
+def test_identical_requests_are_only_sent_once(tmp_path):
+    cache = CompletionCache(tmp_path, max_bytes=1_000_000, max_age=60)
+    fake = FakeClient(["Response 1", "Response 2"], chat_completion)
+    cached = CachingClient(fake, cache)
+
+    first = cached.chat.completions.create(**request("Look at the rug."))
+    second = cached.chat.completions.create(**request("Look at the rug."))
+    other = cached.chat.completions.create(**request("Look at the door."))
+
+    assert len(fake.requests) == 2
+    assert second.choices[0].message.content == first.choices[0].message.content
+    assert other.choices[0].message.content == "Response 2"
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 2
+
+    # A fresh cache over the same directory picks up where this one left off
+    reopened = CachingClient(fake, CompletionCache(tmp_path, 1_000_000, 60))
+    reopened.chat.completions.create(**request("Look at the door."))
+    assert len(fake.requests) == 2
+
+
+def test_streamed_requests_skip_the_cache(tmp_path):
+    fake = FakeClient(["Going north.", "Going north."])
+    cached = CachingClient(fake, CompletionCache(tmp_path, 1_000_000, 60))
+
+    cached.chat.completions.create(stream=True, **request("Go north."))
+    cached.chat.completions.create(stream=True, **request("Go north."))
+
+    assert len(fake.requests) == 2
+
+
+def test_empty_and_rejected_responses_are_not_kept(tmp_path):
+    fake = FakeClient(["", ""], chat_completion)
+    cached = CachingClient(fake, CompletionCache(tmp_path, 1_000_000, 60))
+
+    cached.chat.completions.create(**request("Describe the rug."))
+    cached.chat.completions.create(**request("Describe the rug."))
+    assert len(fake.requests) == 2
+
+    fake = FakeClient(["It's dark.", "It's dark."], chat_completion)
+    cached = CachingClient(fake, CompletionCache(tmp_path, 1_000_000, 60))
+    with cached_if(lambda content: content.startswith("<FEEDBACK>")):
+        cached.chat.completions.create(**request("Look at the door."))
+        cached.chat.completions.create(**request("Look at the door."))
+    assert cached.cache.stats()["entries"] == 0
+    assert cached.cache.stats()["hits"] == 0
+
+
+def test_eviction_by_size_and_age(tmp_path):
+    cache = CompletionCache(tmp_path, max_bytes=1, max_age=60)
+
+    cache.put("a", chat_completion("A"))
+    cache.put("b", chat_completion("B"))
+
+    # Over the size limit, so only the most recent entry is kept
+    assert cache.get("a") is None
+    assert cache.get("b").choices[0].message.content == "B"
+
+    old = time.time() - 120
+    os.utime(tmp_path / "b.json", (old, old))
+    assert cache.get("b") is None
+    assert cache.stats()["entries"] == 0
@@ -0,0 +1,31 @@
+import os
+import sys
+from unittest.mock import patch
+
+script_dir = os.path.dirname(__file__)
+root_dir = os.path.abspath(os.path.join(script_dir, ".."))
+sys.path.append(root_dir)
+
+import yaml
+
+from lib import config
+from lib.config import load_yaml
+
+
+def test_load_yaml_reuses_the_cache_until_the_file_changes(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "CONFIG_CACHE_DIR", tmp_path / "cache")
+    path = tmp_path / "config.yml"
+    path.write_text("agents:\n  narrator:\n    stream: true\n")
+
+    assert load_yaml(path) == {"agents": {"narrator": {"stream": True}}}
+
+    with patch.object(yaml, "safe_load", side_effect=AssertionError("parsed again")):
+        assert load_yaml(path) == {"agents": {"narrator": {"stream": True}}}
+
+    path.write_text("agents:\n  narrator:\n    stream: false\n")
+    assert load_yaml(path) == {"agents": {"narrator": {"stream": False}}}
+
+
+def test_backend_clients_are_built_on_first_use():
+    assert config.local_client is config.backend_client("local")
+    assert config.async_local_client is config.backend_client("local", is_async=True)
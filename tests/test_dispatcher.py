@@ -1,6 +1,7 @@
+import asyncio
 import os
 import sys
-from unittest.mock import call, patch
+from unittest.mock import AsyncMock, call, patch
 
 import pytest
 
@@ -12,12 +13,21 @@ sys.path.append(root_dir)
 from unittest.mock import patch
 
 
-from lib.dispatcher import extract_commands, dispatch_command, dispatch
+from lib.dispatcher import (
+    CommandStream,
+    extract_commands,
+    dispatch_command,
+    dispatch,
+    dispatch_stream,
+    dispatch_async,
+)
 from lib.game_state import GameState
+from lib.journal import recording_commands
 from lib.config import GAME_CONFIG
-from lib.scene_generator_agent import SceneGenerator
+from lib.scene_generator_agent import AsyncSceneGenerator, SceneGenerator
 from lib.json_cruncher_agent import JSONCruncher
-from tests.fixtures.fixtures import valid_game_state
+from lib.world_graph import WorldGraph
+from tests.fixtures.fixtures import use_tracer, valid_game_state
 
 
 @patch.object(SceneGenerator, "new_scene")
@@ -305,3 +315,144 @@ def test_dispatch_with_multiple_commands(mock_dispatch_command, mock_extract_com
     ]
 
     assert new_state == valid_game_state
+
+
+def test_extract_commands_skips_stray_brackets():
+    text = "<" * 5000 + " <FEEDBACK> The tag after them still counts."
+
+    result = extract_commands(text, valid_game_state)
+
+    assert [command["command"] for command in result] == ["feedback"]
+    assert result[0]["parameters"] == "The tag after them still counts."
+
+
+def test_command_stream_matches_extract_commands():
+    state = valid_game_state
+
+    texts = [
+        "You can enter the room, sure. <GENERATE SCENE> A library with a giant window, a spiral staircase, two other exits, and a secret map.",
+        "<FEEDBACK> You move the rug and discover a trapdoor!\n <UPDATE SCENE> Make the trapdoor exit unhidden.",
+        "This is a plain text without any commands.",
+        "<FEEDBACK> 3 < 4, but <NOOP> ",
+        "<<< <FEEDBACK> Stray brackets before a tag.",
+    ]
+
+    for text in texts:
+        # Feed it one character at a time, the worst case for a streamed response
+        stream = CommandStream(state)
+        result = []
+        for character in text:
+            result += stream.feed(character)
+        result += stream.close()
+
+        assert result == extract_commands(text, state)
+
+
+def test_command_stream_emits_commands_when_the_next_tag_starts():
+    state = valid_game_state
+    feedback = []
+    stream = CommandStream(state, on_feedback=feedback.append)
+
+    assert stream.feed("<FEEDBACK> You go through") == []
+    assert "".join(feedback) == "You go through"
+
+    commands = stream.feed(" the north door. <GENERATE SCENE> A dusty hallway.")
+    assert commands == [
+        {"command": "feedback", "parameters": "You go through the north door."}
+    ]
+    assert "".join(feedback) == "You go through the north door.\n"
+
+    commands = stream.close()
+    assert commands[0]["command"] == "generate_scene"
+    assert commands[0]["parameters"] == "A dusty hallway."
+
+
+@patch("lib.dispatcher.dispatch_command")
+def test_dispatch_stream_dispatches_in_order(mock_dispatch_command):
+    state = valid_game_state
+
+    mock_dispatch_command.side_effect = lambda command, state: state._replace(
+        feedback=state.feedback + command["command"] + ";"
+    )
+
+    new_state = dispatch_stream(
+        ["<FEEDBACK> Hi. <UPD", "ATE SCENE> Unhide the trapdoor. <NOOP> "],
+        state,
+        on_feedback=None,
+    )
+
+    assert new_state.feedback == "feedback;update_scene;noop;"
+
+
+@patch.object(AsyncSceneGenerator, "new_scene", new_callable=AsyncMock)
+def test_dispatch_async(mock_new_scene):
+    state = valid_game_state
+
+    mock_new_scene.return_value = state._replace(
+        current_scene={
+            "id": "mocked_async_scene_name",
+            "description": "AsyncSceneGenerator.new_scene() was called.",
+        },
+        feedback="",
+    )
+
+    new_state = asyncio.run(
+        dispatch_async(
+            "<FEEDBACK> You go through the door. <GENERATE SCENE> A dusty hallway.",
+            state,
+        )
+    )
+
+    mock_new_scene.assert_awaited_once()
+    assert mock_new_scene.await_args.args[0] == "A dusty hallway."
+    assert mock_new_scene.await_args.args[1].feedback == "You go through the door."
+    assert new_state.current_scene["id"] == "mocked_async_scene_name"
+
+
+@patch.object(SceneGenerator, "new_scene")
+def test_dispatch_command_generate_scene_reuses_visited_scenes(mock_new_scene):
+    state = valid_game_state
+    exit_data = state.current_scene["exits"][1]
+    hallway = {"id": "hallway", "description": "A long, dusty hallway."}
+
+    mock_new_scene.return_value = state._replace(current_scene=hallway, feedback="")
+
+    dispatcher_dict = {
+        "command": "generate_scene",
+        "parameters": "A hallway.",
+        "last_scene": state.current_scene,
+        "exit": exit_data,
+    }
+
+    with patch("lib.dispatcher.world", WorldGraph(":memory:")):
+        first_visit = dispatch_command(dispatcher_dict, state)
+        second_visit = dispatch_command(dispatcher_dict, state)
+
+    mock_new_scene.assert_called_once()
+    assert first_visit.current_scene == hallway
+    assert second_visit.current_scene == hallway
+
+
+def test_async_feedback_is_dispatched_and_noted_once(monkeypatch):
+    test_tracer = use_tracer(monkeypatch)
+
+    with recording_commands() as commands:
+        new_state = asyncio.run(
+            dispatch_async("<FEEDBACK> It's dark. <NOOP> ", valid_game_state)
+        )
+
+    assert new_state.feedback == "It's dark."
+    assert [command["command"] for command in commands] == ["feedback", "noop"]
+    assert test_tracer.counts[("dispatch_command", "feedback")] == 1
+    assert test_tracer.counts[("dispatch_command", "noop")] == 1
+
+
+def test_unknown_tags_are_skipped():
+    text = "<THINKING> Hmm. <FEEDBACK> It's dark."
+
+    commands = extract_commands(text, valid_game_state)
+    stream = CommandStream(valid_game_state)
+    streamed = stream.feed(text) + stream.close()
+
+    assert [command["command"] for command in commands] == ["feedback"]
+    assert streamed == commands
@@ -0,0 +1,63 @@
+import os
+import pickle
+import sys
+
+import pytest
+
+script_dir = os.path.dirname(__file__)
+root_dir = os.path.abspath(os.path.join(script_dir, ".."))
+sys.path.append(root_dir)
+
+from lib.game_state import FrozenDict, GameState, History, new_game_state
+from tests.fixtures.fixtures import valid_game_state, valid_scene
+
+
+def test_evolve_shares_the_fields_it_does_not_replace():
+    state = new_game_state()
+
+    new_state = state.evolve(feedback="You pick up the key.")
+
+    assert new_state.feedback == "You pick up the key."
+    for field in ("current_scene", "inventory", "engine", "story"):
+        assert getattr(new_state, field) is getattr(state, field)
+
+
+def test_inventory_and_engine_cannot_be_changed_in_place():
+    state = GameState.of(
+        current_scene=valid_scene,
+        inventory=["key"],
+        engine={"last_action": None},
+        story={},
+        feedback="",
+    )
+
+    assert state.inventory == ("key",)
+    with pytest.raises(TypeError):
+        state.engine["last_action"] = "look"
+    with pytest.raises(TypeError):
+        state.engine.update(last_action="look")
+
+
+def test_with_engine_leaves_the_old_engine_alone():
+    new_state = valid_game_state.with_engine(last_action="look")
+
+    assert new_state.engine["last_action"] == "look"
+    assert valid_game_state.engine["last_action"] is None
+    assert new_state.engine["describe_current_scene"] is True
+
+
+def test_frozen_dicts_survive_pickling():
+    engine = FrozenDict(last_action="look")
+
+    assert pickle.loads(pickle.dumps(engine)) == engine
+
+
+def test_history_undoes_in_reverse_order_up_to_its_depth():
+    history = History(depth=2)
+    states = [valid_game_state.evolve(feedback=str(turn)) for turn in range(3)]
+    for state in states:
+        history.push(state)
+
+    assert history.undo() is states[2]
+    assert history.undo() is states[1]
+    assert history.undo() is None
@@ -0,0 +1,125 @@
+import os
+import sys
+
+script_dir = os.path.dirname(__file__)
+root_dir = os.path.abspath(os.path.join(script_dir, ".."))
+sys.path.append(root_dir)
+
+from lib.journal import Journal, note_command, recording_commands
+from tests.fixtures.fixtures import valid_game_state, valid_scene
+
+
+def play(journal: Journal, turns: int, state=valid_game_state):
+    "Picks up one item a turn, so every turn changes the inventory."
+    previous = None
+    for turn in range(turns):
+        new_state = state.evolve(inventory=(*state.inventory, f"coin {turn}"))
+        journal.record(f"use coin {turn}", previous, new_state)
+        previous = state = new_state
+    return state
+
+
+def test_resume_replays_the_journal(tmp_path):
+    journal = Journal(tmp_path, snapshot_every=100)
+    state = play(journal, 5)
+    journal.close()
+
+    resumed = Journal(tmp_path)
+    assert resumed.resume() == state
+    assert resumed.turn == 5
+
+
+def test_resume_starts_from_the_latest_snapshot(tmp_path):
+    journal = Journal(tmp_path, snapshot_every=4)
+    state = play(journal, 10)
+    journal.close()
+
+    assert [turn for turn, _ in journal.snapshots()] == [4, 8]
+    assert Journal(tmp_path).resume() == state
+
+
+def test_entries_only_hold_what_changed(tmp_path):
+    journal = Journal(tmp_path)
+    play(journal, 2)
+    journal.close()
+
+    first, second = journal.read_entries()
+    assert set(first["changes"]) == set(valid_game_state._fields)
+    assert set(second["changes"]) == {"inventory"}
+
+
+def test_a_cut_off_last_entry_is_skipped(tmp_path):
+    journal = Journal(tmp_path)
+    state = play(journal, 3)
+    journal.close()
+    with open(journal.path, "a", encoding="utf-8") as f:
+        f.write('{"turn": 4, "chan')
+
+    assert Journal(tmp_path).resume() == state
+
+
+def test_compact_keeps_only_the_latest_snapshot(tmp_path):
+    journal = Journal(tmp_path, snapshot_every=4)
+    state = play(journal, 10)
+
+    journal.compact()
+
+    assert [turn for turn, _ in journal.snapshots()] == [10]
+    assert list(journal.read_entries()) == []
+    assert Journal(tmp_path).resume() == state
+
+
+def test_journal_compacts_itself_when_it_grows(tmp_path):
+    journal = Journal(tmp_path, snapshot_every=5, max_entries=8)
+    state = play(journal, 12)
+    journal.close()
+
+    assert len(list(journal.read_entries())) == 2
+    assert Journal(tmp_path).resume() == state
+
+
+def test_replay_gives_every_turn_left_after_compaction(tmp_path):
+    journal = Journal(tmp_path, snapshot_every=5, max_entries=8)
+    state = play(journal, 12)
+    journal.close()
+
+    replayed = list(Journal(tmp_path).replay())
+
+    assert [action for action, _ in replayed] == ["", "use coin 10", "use coin 11"]
+    assert replayed[0][1].inventory == state.inventory[:10]
+    assert replayed[-1][1] == state
+
+
+def test_recording_commands_notes_every_command_in_the_block():
+    command = {"command": "generate_scene", "parameters": "A cellar."}
+
+    note_command(command)
+    with recording_commands() as commands:
+        note_command(command)
+        note_command(command)
+        note_command({"command": "feedback", "parameters": "You go down."})
+
+    assert [c["command"] for c in commands] == [
+        "generate_scene",
+        "generate_scene",
+        "feedback",
+    ]
+
+
+def test_record_keeps_the_commands(tmp_path):
+    journal = Journal(tmp_path)
+    new_state = valid_game_state.evolve(current_scene={**valid_scene, "id": "cellar"})
+
+    journal.record(
+        "go down",
+        valid_game_state,
+        new_state,
+        [{"command": "generate_scene", "parameters": "A cellar.", "last_scene": {}}],
+    )
+    journal.close()
+
+    [entry] = journal.read_entries()
+    assert entry["commands"] == [
+        {"command": "generate_scene", "parameters": "A cellar."}
+    ]
+    assert entry["changes"] == {"current_scene": new_state.current_scene}
@@ -0,0 +1,77 @@
+import os
+import sys
+from unittest.mock import patch
+
+import pytest
+
+script_dir = os.path.dirname(__file__)
+root_dir = os.path.abspath(os.path.join(script_dir, ".."))
+sys.path.append(root_dir)
+
+from lib.json_cruncher_agent import InvalidJSONError, JSONCruncher, crunch_stats
+from tests.fixtures.fixtures import FakeClient, valid_scene
+
+
+def test_repair_prompts_only_carry_the_error_and_the_previous_json():
+    fake = FakeClient(
+        ['{"title": "No id or description"}', '{"id": "a", "description": "b"}']
+    )
+
+    with patch("lib.json_cruncher_agent.client", fake):
+        result = JSONCruncher().json_from_text("A room.", "scene")
+
+    assert result == {"id": "a", "description": "b"}
+    assert len(fake.requests) == 2
+
+    repair_prompt = fake.requests[1]["messages"][-1]["content"]
+    assert "No id or description" in repair_prompt
+    assert "A room." not in repair_prompt
+
+
+def test_gives_up_after_max_attempts():
+    before = crunch_stats.snapshot().get("scene", {}).get("failures", 0)
+    fake = FakeClient(["not json at all"] * 10)
+
+    with patch("lib.json_cruncher_agent.client", fake):
+        cruncher = JSONCruncher()
+        cruncher.max_attempts = 3
+        with pytest.raises(InvalidJSONError):
+            cruncher.json_from_text("A room.", "scene")
+
+    assert len(fake.requests) == 3
+    assert crunch_stats.snapshot()["scene"]["failures"] == before + 1
+
+
+def test_structured_output_sends_the_schema():
+    fake = FakeClient(['{"id": "a", "description": "b"}'])
+
+    with patch("lib.json_cruncher_agent.client", fake):
+        cruncher = JSONCruncher()
+        cruncher.structured_output = True
+        cruncher.json_from_text(valid_scene["description"], "scene")
+
+    response_format = fake.requests[0]["response_format"]
+    assert response_format["type"] == "json_schema"
+    assert response_format["json_schema"]["name"] == "scene"
+    assert "properties" in response_format["json_schema"]["schema"]
+
+
+def test_an_empty_response_is_a_failed_attempt():
+    fake = FakeClient(["", '{"id": "a", "description": "b"}'])
+
+    with patch("lib.json_cruncher_agent.client", fake):
+        result = JSONCruncher().json_from_text("A room.", "scene")
+
+    assert result == {"id": "a", "description": "b"}
+    # Nothing to repair, so the same prompt goes again
+    assert fake.requests[1]["messages"] == fake.requests[0]["messages"]
+
+
+def test_empty_responses_run_out_as_invalid_json():
+    fake = FakeClient([""] * 3)
+
+    with patch("lib.json_cruncher_agent.client", fake):
+        cruncher = JSONCruncher()
+        cruncher.max_attempts = 3
+        with pytest.raises(InvalidJSONError):
+            cruncher.json_from_text("A room.", "scene")
@@ -0,0 +1,163 @@
+import asyncio
+import os
+import sys
+import threading
+import time
+
+script_dir = os.path.dirname(__file__)
+root_dir = os.path.abspath(os.path.join(script_dir, ".."))
+sys.path.append(root_dir)
+
+from lib.llm_scheduler import (
+    Escalation,
+    Priority,
+    ScheduledClient,
+    Scheduler,
+    prioritised,
+    priority_for,
+)
+from tests.fixtures.fixtures import FakeClient
+
+
+def queue_up(scheduler, order, priority, session):
+    def run():
+        scheduler.acquire(priority, session)
+        order.append((priority, session))
+        scheduler.release()
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    # Wait until it's in the queue, so the arrival order is known
+    while len(scheduler.queue) < queue_up.expected:
+        time.sleep(0.001)
+    queue_up.expected += 1
+    return thread
+
+
+def test_slots_go_to_the_best_priority_then_the_least_served_session():
+    scheduler = Scheduler(limit=1)
+    scheduler.acquire(Priority.INTERACTIVE, "alice")
+
+    order = []
+    queue_up.expected = 1
+    threads = [
+        queue_up(scheduler, order, Priority.BACKGROUND, "alice"),
+        queue_up(scheduler, order, Priority.JSON, "alice"),
+        queue_up(scheduler, order, Priority.JSON, "alice"),
+        queue_up(scheduler, order, Priority.JSON, "bob"),
+        queue_up(scheduler, order, Priority.INTERACTIVE, "alice"),
+    ]
+    scheduler.release()
+    for thread in threads:
+        thread.join(5)
+
+    assert order == [
+        (Priority.INTERACTIVE, "alice"),
+        # Alice has already been served more, so Bob goes first despite queueing last
+        (Priority.JSON, "bob"),
+        (Priority.JSON, "alice"),
+        (Priority.JSON, "alice"),
+        (Priority.BACKGROUND, "alice"),
+    ]
+    assert scheduler.stats()["running"] == 0
+    assert scheduler.stats()["queue_wait_seconds"]["background"]["count"] == 1
+
+
+def test_an_escalated_request_moves_up_the_queue_while_it_waits():
+    scheduler = Scheduler(limit=1)
+    scheduler.acquire(Priority.INTERACTIVE, "alice")
+
+    order = []
+    escalation = Escalation(Priority.BACKGROUND)
+    queue_up.expected = 1
+    threads = [
+        queue_up(scheduler, order, Priority.JSON, "alice"),
+        queue_up(scheduler, order, escalation, "alice"),
+    ]
+    escalation.escalate()
+    scheduler.release()
+    for thread in threads:
+        thread.join(5)
+
+    assert order == [(escalation, "alice"), (Priority.JSON, "alice")]
+    assert scheduler.stats()["queue_wait_seconds"]["interactive"]["count"] == 2
+
+
+def test_streams_give_their_slot_back_even_if_never_read():
+    fake = FakeClient(["<FEEDBACK> Dark."] * 3)
+    scheduler = Scheduler(limit=1)
+    scheduled = ScheduledClient(fake, scheduler, "narrator")
+
+    with scheduled.chat.completions.create(model="m", messages=[], stream=True):
+        assert scheduler.stats()["running"] == 1
+    assert scheduler.stats()["running"] == 0
+
+    scheduled.chat.completions.create(model="m", messages=[], stream=True)
+    assert scheduler.stats()["running"] == 0
+
+    stream = scheduled.chat.completions.create(model="m", messages=[], stream=True)
+    assert [chunk.choices[0].delta.content for chunk in stream] == [
+        "<FEEDBACK> ",
+        "Dark. ",
+    ]
+    assert scheduler.stats()["running"] == 0
+
+
+def test_identical_requests_in_flight_are_coalesced():
+    release = threading.Event()
+
+    class SlowClient(FakeClient):
+        def create(self, **request):
+            release.wait(5)
+            return super().create(**request)
+
+    fake = SlowClient(["<FEEDBACK> Dark."])
+    scheduler = Scheduler(limit=4)
+    scheduled = ScheduledClient(fake, scheduler, "narrator")
+
+    results = []
+    threads = [
+        threading.Thread(
+            target=lambda: results.append(
+                scheduled.chat.completions.create(model="m", messages=[])
+            )
+        )
+        for _ in range(3)
+    ]
+    for thread in threads:
+        thread.start()
+    while scheduler.coalesced < 2:
+        time.sleep(0.001)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert len(fake.requests) == 1
+    assert len(results) == 3
+    assert all(result is results[0] for result in results)
+
+
+def test_cancelled_async_waiters_give_their_slot_back():
+    async def run():
+        scheduler = Scheduler(limit=1)
+        await scheduler.acquire_async(Priority.SCENE, "alice")
+
+        waiting = asyncio.create_task(scheduler.acquire_async(Priority.SCENE, "bob"))
+        await asyncio.sleep(0.01)
+        waiting.cancel()
+        scheduler.release()
+        await asyncio.sleep(0.01)
+
+        await asyncio.wait_for(scheduler.acquire_async(Priority.SCENE, "carol"), 1)
+        return scheduler.stats()
+
+    assert asyncio.run(run())["running"] == 1
+
+
+def test_an_explicit_priority_beats_the_agents_default():
+    assert priority_for("plotter") == Priority.BACKGROUND
+
+    with prioritised(Priority.INTERACTIVE):
+        assert priority_for("plotter") == Priority.INTERACTIVE
+    with prioritised(Priority.BACKGROUND):
+        assert priority_for("narrator") == Priority.BACKGROUND
@@ -0,0 +1,94 @@
+import os
+import sys
+from unittest.mock import patch
+
+script_dir = os.path.dirname(__file__)
+root_dir = os.path.abspath(os.path.join(script_dir, ".."))
+sys.path.append(root_dir)
+
+from lib.local_resolver import LocalResolver
+from lib.world_graph import WorldGraph
+from tests.fixtures.fixtures import valid_game_state, valid_scene
+from utils import find_exit
+
+hallway = {
+    "id": "hallway",
+    "title": "Hallway",
+    "description": "A long, dusty hallway.",
+    "exits": [{"id": "archway", "direction": "north", "description": "An archway"}],
+}
+
+
+def test_go_through_a_known_exit_needs_no_narrator():
+    world = WorldGraph(":memory:")
+    south = find_exit(valid_scene, "go south")
+    world.connect(valid_scene, south, world.add_scene(hallway))
+
+    with patch("lib.dispatcher.world", world):
+        state = LocalResolver().resolve("go south", valid_game_state)
+
+    assert state.current_scene == hallway
+    assert state.feedback == "You go south."
+
+
+def test_go_through_an_unknown_exit_goes_to_the_narrator():
+    with patch("lib.dispatcher.world", WorldGraph(":memory:")):
+        assert LocalResolver().resolve("go south", valid_game_state) is None
+
+
+def test_locked_exits_and_missing_directions_are_refused():
+    resolver = LocalResolver()
+
+    locked = resolver.resolve("go n", valid_game_state)
+    nowhere = resolver.resolve("go west", valid_game_state)
+    # The trapdoor is hidden, so it isn't there as far as the player knows
+    hidden = resolver.resolve("go down", valid_game_state)
+
+    assert locked.feedback == "The way north is locked."
+    assert locked.current_scene is valid_game_state.current_scene
+    assert nowhere.feedback == "You can't go west from here."
+    assert hidden.feedback == "You can't go down from here."
+
+
+def test_open_ended_actions_go_to_the_narrator():
+    resolver = LocalResolver()
+
+    assert resolver.resolve("go back to bed", valid_game_state) is None
+    assert resolver.resolve("look at the rug", valid_game_state) is None
+    assert resolver.resolve("use the key", valid_game_state) is None
+
+
+def test_looking_at_an_exit_describes_it():
+    state = LocalResolver().resolve("look north", valid_game_state)
+
+    assert state.feedback == "Door with metal bars. It's locked."
+
+
+def test_a_repeated_look_reuses_the_narrators_answer():
+    resolver = LocalResolver()
+    answered = valid_game_state.evolve(feedback="The rug is threadbare.")
+
+    resolver.remember_look("the rug", valid_game_state, answered)
+
+    assert resolver.resolve("look the rug", valid_game_state).feedback == (
+        "The rug is threadbare."
+    )
+    # Not once the scene has changed
+    changed = valid_game_state.evolve(
+        current_scene={**valid_scene, "description": "The rug is gone."}
+    )
+    assert resolver.resolve("look the rug", changed) is None
+
+
+def test_find_exit_copes_with_exits_without_an_id_and_hidden_false():
+    scene = {
+        "id": "cellar",
+        "exits": [
+            {"direction": "up", "description": "A ladder"},
+            {"id": "grate", "direction": "down", "hidden": False},
+        ],
+    }
+
+    assert find_exit(scene, "go up") == scene["exits"][0]
+    # Hidden as far as scene_to_text is concerned, so not found here either
+    assert find_exit(scene, "go down") is None
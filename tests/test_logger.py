@@ -0,0 +1,62 @@
+import json
+import logging
+import os
+import queue
+import sys
+import threading
+
+script_dir = os.path.dirname(__file__)
+root_dir = os.path.abspath(os.path.join(script_dir, ".."))
+sys.path.append(root_dir)
+
+from lib.logger import LOG_MAX_CHARS, BackgroundHandler, JSONFormatter
+
+
+def record(msg, *args, **extra) -> logging.LogRecord:
+    log_record = logging.makeLogRecord({"msg": msg, "args": args, "levelname": "INFO"})
+    log_record.__dict__.update(extra)
+    return log_record
+
+
+def test_messages_are_not_formatted_on_the_callers_thread():
+    formatted_on = []
+
+    class Scene:
+        def __str__(self):
+            formatted_on.append(threading.current_thread())
+            return "a scene"
+
+    log_queue = queue.Queue()
+    BackgroundHandler(log_queue).handle(record("New scene: %s", Scene()))
+
+    assert formatted_on == []
+    assert log_queue.get_nowait().getMessage() == "New scene: a scene"
+
+
+def test_long_text_arguments_are_cut_down():
+    log_queue = queue.Queue()
+    BackgroundHandler(log_queue).handle(
+        record("Response: %s", "x" * (LOG_MAX_CHARS * 3))
+    )
+
+    message = log_queue.get_nowait().getMessage()
+    assert len(message) < LOG_MAX_CHARS + 100
+    assert message.endswith(f"[{LOG_MAX_CHARS * 3} chars]")
+
+
+def test_records_are_dropped_rather_than_waiting_on_a_full_queue():
+    handler = BackgroundHandler(queue.Queue(1))
+
+    handler.handle(record("one"))
+    handler.handle(record("two"))
+
+    assert handler.dropped == 1
+
+
+def test_json_records_include_extra_fields():
+    line = JSONFormatter().format(record("Turn took %sms", 12, agent="narrator"))
+
+    entry = json.loads(line)
+    assert entry["message"] == "Turn took 12ms"
+    assert entry["agent"] == "narrator"
+    assert entry["level"] == "INFO"
@@ -0,0 +1,54 @@
+import asyncio
+import os
+import sys
+from unittest.mock import patch
+
+script_dir = os.path.dirname(__file__)
+root_dir = os.path.abspath(os.path.join(script_dir, ".."))
+sys.path.append(root_dir)
+
+from lib.mud_server import handle_connection
+from lib.narrator_agent import AsyncNarrator
+
+
+async def read_until_prompt(reader: asyncio.StreamReader) -> str:
+    return (await reader.readuntil(b"> ")).decode("utf-8")
+
+
+async def slow_look_at(self, user_action, state):
+    await asyncio.sleep(0.5)
+    return state._replace(feedback=f"You look at the {user_action}. Slowly.")
+
+
+async def play():
+    server = await asyncio.start_server(handle_connection, "127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+
+    async with server:
+        slow_reader, slow_writer = await asyncio.open_connection("127.0.0.1", port)
+        fast_reader, fast_writer = await asyncio.open_connection("127.0.0.1", port)
+        await read_until_prompt(slow_reader)
+        await read_until_prompt(fast_reader)
+
+        slow_writer.write(b"look rug\r\n")
+        fast_writer.write(b"inventory\r\n")
+        fast_reply = await asyncio.wait_for(read_until_prompt(fast_reader), 0.25)
+
+        slow_reply = await asyncio.wait_for(read_until_prompt(slow_reader), 5)
+
+        fast_writer.write(b"quit\r\n")
+        goodbye = await asyncio.wait_for(fast_reader.read(), 5)
+
+        for writer in (slow_writer, fast_writer):
+            writer.close()
+
+    return fast_reply, slow_reply, goodbye
+
+
+@patch.object(AsyncNarrator, "look_at", slow_look_at)
+def test_sessions_do_not_wait_on_each_other():
+    fast_reply, slow_reply, goodbye = asyncio.run(play())
+
+    assert "You have no items in your inventory." in fast_reply
+    assert "You look at the rug. Slowly." in slow_reply
+    assert goodbye == b"Goodbye!\r\n"
@@ -0,0 +1,67 @@
+import os
+import sys
+from types import SimpleNamespace
+
+import pytest
+
+script_dir = os.path.dirname(__file__)
+root_dir = os.path.abspath(os.path.join(script_dir, ".."))
+sys.path.append(root_dir)
+
+from lib.json_cruncher_agent import JSONCruncher
+from lib.narrator_agent import Narrator
+from lib.prompt_assembly import PromptCacheStats, assemble
+from tests.fixtures.fixtures import valid_game_state
+
+
+def test_assemble_orders_segments_from_most_to_least_stable():
+    prompt = assemble(action="Open the door.", scene="A room.", system="Narrate.")
+
+    assert prompt == "Narrate.\n\nA room.\n\nOpen the door."
+
+    with pytest.raises(ValueError):
+        assemble(footer="Nope.")
+
+
+def test_narrator_turns_in_the_same_scene_share_everything_but_the_action():
+    narrator = Narrator()
+    look = narrator.user_prompt(valid_game_state, "They want to examine the rug")
+    use = narrator.user_prompt(valid_game_state, "They want to use the door")
+
+    scene_part = look[: look.index("They want")]
+    assert use.startswith(scene_part)
+    assert "Door with metal bars" in scene_part
+
+
+def test_json_cruncher_puts_the_text_after_the_examples():
+    prompt_text, _ = JSONCruncher().build_prompt("A dusty attic.", "scene")
+
+    assert prompt_text.index("Example scene object(s)") < prompt_text.index(
+        "A dusty attic."
+    )
+
+
+def test_prompt_cache_stats_reads_openai_usage_and_llama_cpp_timings():
+    stats = PromptCacheStats()
+    stats.record(
+        "narrator",
+        SimpleNamespace(
+            usage=SimpleNamespace(
+                prompt_tokens=1000,
+                prompt_tokens_details=SimpleNamespace(cached_tokens=800),
+            )
+        ),
+    )
+    stats.record(
+        "narrator",
+        SimpleNamespace(
+            usage=None, timings={"cache_n": 900, "prompt_n": 100, "prompt_ms": 40.0}
+        ),
+    )
+
+    narrator = stats.snapshot()["narrator"]
+    assert narrator["requests"] == 2
+    assert narrator["prompt_tokens"] == 2000
+    assert narrator["cached_tokens"] == 1700
+    assert narrator["prompt_ms"] == 40.0
+    assert narrator["cached_fraction"] == 0.85
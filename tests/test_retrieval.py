@@ -0,0 +1,127 @@
+import os
+import sys
+
+script_dir = os.path.dirname(__file__)
+root_dir = os.path.abspath(os.path.join(script_dir, ".."))
+sys.path.append(root_dir)
+
+from lib.narrator_agent import Narrator
+from lib.journal import Journal
+from lib.retrieval import MemoryIndex
+from lib.token_budget import count_tokens
+from tests.fixtures.fixtures import valid_game_state
+
+library = {
+    "id": "library",
+    "title": "Library",
+    "description": "Shelves of mouldering books, and a brass telescope by the window.",
+    "exits": [],
+}
+
+
+def test_search_ranks_the_documents_that_match_best():
+    index = MemoryIndex()
+    index.add("scene:library", "Library: shelves of books and a brass telescope.")
+    index.add("scene:kitchen", "Kitchen: a cold hearth and a brass pot.")
+    index.add("scene:cellar", "Cellar: barrels of wine.")
+
+    results = [doc_id for _, doc_id in index.search("the brass telescope", k=2)]
+
+    assert results == ["scene:library", "scene:kitchen"]
+    assert index.search("dragon", k=2) == []
+
+
+def test_adding_under_the_same_id_replaces_the_document():
+    index = MemoryIndex()
+    index.add("scene:library", "Library: a brass telescope.")
+    index.add("scene:library", "Library: the telescope is gone.")
+
+    assert index.search("brass", k=3) == []
+    assert [doc_id for _, doc_id in index.search("telescope", k=3)] == ["scene:library"]
+
+
+def test_recall_stays_under_its_cap_however_big_the_index():
+    index = MemoryIndex()
+    for n in range(3000):
+        index.add(f"scene:{n}", f"Room {n}: a dusty room with a wooden door. " * 10)
+
+    recalled = index.recall("wooden door", k=4, max_tokens=100)
+
+    assert recalled.startswith("- Room")
+    assert count_tokens(recalled) <= 100
+
+
+def test_remember_indexes_the_scene_feedback_and_story():
+    index = MemoryIndex()
+    state = valid_game_state.evolve(
+        current_scene=library, feedback="You find a map of the forest."
+    )
+
+    index.remember(state, "look books")
+    index.remember(state.evolve(feedback=""), "look")
+
+    assert set(index.texts) == {
+        "scene:library",
+        "feedback:1",
+        *(f"story:goals:{n}" for n in range(4)),
+        *(f"story:obstacles:{n}" for n in range(4)),
+    }
+    assert "after 'look books'" in index.texts["feedback:1"]
+    assert index.search("map", k=1)[0][1] == "feedback:1"
+    assert index.search("werewolves", k=1)[0][1] == "story:obstacles:3"
+
+
+def test_narrator_prompts_recall_earlier_scenes_but_not_the_current_one():
+    index = MemoryIndex()
+    index.remember(valid_game_state.evolve(current_scene=library), "go north")
+    index.remember(valid_game_state, "go south")
+
+    narrator = Narrator()
+    narrator.memory = index
+    prompt = narrator.user_prompt(
+        valid_game_state,
+        "They want to use something: use the telescope",
+        "use the telescope",
+    )
+
+    recalled = prompt[prompt.index("Earlier in the game") : prompt.index("They want")]
+    assert "Library: Shelves of mouldering books" in recalled
+    assert "Starting Room" not in recalled
+
+
+def test_each_narrator_recalls_only_its_own_game():
+    player_one, player_two = Narrator(), Narrator()
+    player_one.memory.remember(valid_game_state.evolve(current_scene=library), "go")
+
+    assert player_one.memory.search("telescope", k=1)
+    assert player_two.memory.search("telescope", k=1) == []
+
+
+def test_rewind_forgets_the_feedback_from_undone_turns():
+    index = MemoryIndex()
+    state = valid_game_state.with_engine(turn_count=0)
+    index.remember(state.evolve(feedback="You find a map."), "look rug")
+    state = state.with_engine(turn_count=1)
+    index.remember(state.evolve(feedback="You find a sword."), "look chest")
+
+    index.rewind(state)
+
+    assert index.search("map", k=1)
+    assert index.search("sword", k=1) == []
+
+
+def test_rebuild_indexes_a_saved_game_from_its_journal(tmp_path):
+    journal = Journal(tmp_path)
+    before = valid_game_state.with_engine(turn_count=0)
+    first = before.evolve(feedback="You find a map.").with_engine(turn_count=1)
+    second = first.evolve(feedback="You find a sword.").with_engine(turn_count=2)
+    journal.record("look rug", None, first)
+    journal.record("look chest", first, second)
+    journal.record("undo", second, first.evolve(feedback=""))
+    journal.close()
+
+    index = MemoryIndex()
+    index.rebuild(journal.replay())
+
+    assert "after 'look rug'" in index.texts[index.search("map", k=1)[0][1]]
+    assert index.search("sword", k=1) == []
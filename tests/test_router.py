@@ -0,0 +1,158 @@
+import asyncio
+import os
+import sys
+import threading
+
+script_dir = os.path.dirname(__file__)
+root_dir = os.path.abspath(os.path.join(script_dir, ".."))
+sys.path.append(root_dir)
+
+import openai
+import pytest
+
+from lib import config
+from lib.config import endpoint_client
+from lib.fake_endpoint import FakeEndpoint
+from lib.router import AsyncRoutedClient, Endpoint, RoutedClient, Router
+
+request = {"model": "fake", "messages": [{"role": "user", "content": "look"}]}
+
+
+def router_for(*fakes: FakeEndpoint) -> Router:
+    return Router([Endpoint(fake.base_url, "x", 2) for fake in fakes], endpoint_client)
+
+
+def ask(router: Router, n: int = 1) -> str:
+    for _ in range(n):
+        response = RoutedClient(router).chat.completions.create(**request)
+    return response.choices[0].message.content
+
+
+def test_requests_go_to_the_fastest_endpoint():
+    with FakeEndpoint(delay=0.1) as slow, FakeEndpoint("<FEEDBACK> Quick.") as fast:
+        router = router_for(slow, fast)
+
+        assert ask(router, 6) == "<FEEDBACK> Quick."
+
+        # Each is tried once to learn its speed, then the fast one gets the rest
+        assert slow.requests == 1
+        assert fast.requests == 5
+        assert router.ranked()[0].base_url == fast.base_url
+
+
+def test_a_busy_endpoint_is_passed_over_while_another_has_room():
+    with FakeEndpoint(delay=0.2) as fast, FakeEndpoint(delay=0.2) as slow:
+        router = Router(
+            [Endpoint(fast.base_url, "x", 1), Endpoint(slow.base_url, "x", 1)],
+            endpoint_client,
+        )
+        router.endpoints[0].latencies.append(0.1)
+        router.endpoints[1].latencies.append(1.0)
+
+        threads = [threading.Thread(target=ask, args=(router,)) for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+
+        assert fast.requests == slow.requests == 1
+        assert all(endpoint.in_flight == 0 for endpoint in router.endpoints)
+
+
+def test_a_failing_endpoint_is_skipped_without_the_caller_noticing():
+    with (
+        FakeEndpoint("<FEEDBACK> First.") as first,
+        FakeEndpoint("<FEEDBACK> Second.", delay=0.05) as second,
+    ):
+        router = router_for(first, second)
+        ask(router, 3)
+
+        first.status = 500
+        assert ask(router) == "<FEEDBACK> Second."
+        assert ask(router) == "<FEEDBACK> Second."
+
+        # Passed over while it cools down, rather than tried on every request
+        assert first.requests == 3
+        stats = router.snapshot()[first.base_url]
+        assert stats["up"] is False
+        assert stats["error_rate"] > 0
+
+
+def test_an_endpoint_that_recovers_is_used_again():
+    with FakeEndpoint("<FEEDBACK> First.") as first, FakeEndpoint() as second:
+        router = router_for(first, second)
+        first.status = 429
+        ask(router, 2)
+
+        # Its cooldown is over
+        first.status = 200
+        router.endpoints[0].down_until = 0
+        assert ask(router) == "<FEEDBACK> First."
+
+
+def test_the_last_error_is_raised_when_every_endpoint_fails():
+    with FakeEndpoint(status=503) as first, FakeEndpoint(status=500) as second:
+        router = router_for(first, second)
+
+        with pytest.raises(openai.InternalServerError):
+            ask(router)
+
+        assert first.requests == second.requests == 1
+
+
+def test_client_errors_are_not_sent_to_another_endpoint():
+    with FakeEndpoint(status=400) as first, FakeEndpoint(status=400) as second:
+        router = router_for(first, second)
+
+        with pytest.raises(openai.BadRequestError):
+            ask(router)
+
+        assert first.requests + second.requests == 1
+
+
+def test_async_requests_fail_over_too():
+    with FakeEndpoint(status=500) as down, FakeEndpoint("<FEEDBACK> Up.") as up:
+        router = router_for(down, up)
+        router.endpoints[1].latencies.append(1.0)
+
+        routed = AsyncRoutedClient(router)
+        response = asyncio.run(routed.chat.completions.create(**request))
+
+        assert response.choices[0].message.content == "<FEEDBACK> Up."
+        assert down.requests == 1
+
+
+def test_streamed_responses_come_through_the_router():
+    with FakeEndpoint("<FEEDBACK> It is dark.") as fake:
+        router = router_for(fake)
+
+        stream = RoutedClient(router).chat.completions.create(**request, stream=True)
+        text = "".join(chunk.choices[0].delta.content or "" for chunk in stream)
+
+        assert text == "<FEEDBACK> It is dark."
+
+
+@pytest.fixture
+def fresh_routes():
+    "So a test's routers don't outlive it in `routed` and `schedulers`."
+    config.routed.cache_clear()
+    yield
+    config.routed.cache_clear()
+
+
+def test_agents_with_endpoints_in_the_config_are_routed(monkeypatch, fresh_routes):
+    with FakeEndpoint("<FEEDBACK> Routed.") as fake:
+        agents = {
+            **config.GAME_CONFIG["agents"],
+            "narrator": {"endpoints": [{"base_url": fake.base_url, "concurrency": 3}]},
+        }
+        monkeypatch.setitem(config.GAME_CONFIG, "agents", agents)
+
+        router, scheduler = config.routed(config.endpoints_for("narrator"))
+        response = config.client({}, "narrator").chat.completions.create(**request)
+
+        assert response.choices[0].message.content == "<FEEDBACK> Routed."
+        assert config.endpoints_for("plotter") == ()
+        assert router.endpoints[0].concurrency == 3
+        assert router.endpoints[0].latency() > 0
+        assert config.schedulers()[fake.base_url] is scheduler
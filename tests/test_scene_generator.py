@@ -0,0 +1,40 @@
+import os
+import sys
+from unittest.mock import patch
+
+script_dir = os.path.dirname(__file__)
+root_dir = os.path.abspath(os.path.join(script_dir, ".."))
+sys.path.append(root_dir)
+
+from lib.json_cruncher_agent import JSONCruncher
+from lib.scene_generator_agent import SceneGenerator
+from tests.fixtures.fixtures import FakeClient, valid_game_state
+
+
+@patch.object(JSONCruncher, "json_from_text")
+def test_direct_json_skips_the_json_cruncher(mock_json_from_text):
+    content = '```json\n{"id": "library", "description": "A library."}\n```'
+    fake = FakeClient([content])
+
+    with patch("lib.scene_generator_agent.client", fake):
+        generator = SceneGenerator()
+        generator.direct_json = True
+        new_state = generator.new_scene("A library.", valid_game_state)
+
+    mock_json_from_text.assert_not_called()
+    assert new_state.current_scene == {"id": "library", "description": "A library."}
+    assert "JSON schema" in fake.requests[0]["messages"][0]["content"]
+
+
+@patch.object(JSONCruncher, "json_from_text")
+def test_direct_json_falls_back_to_the_json_cruncher(mock_json_from_text):
+    content = '{"title": "A library with no id or description"}'
+    mock_json_from_text.return_value = {"id": "library", "description": "A library."}
+
+    with patch("lib.scene_generator_agent.client", FakeClient([content])):
+        generator = SceneGenerator()
+        generator.direct_json = True
+        new_state = generator.new_scene("A library.", valid_game_state)
+
+    mock_json_from_text.assert_called_once_with(content, "scene")
+    assert new_state.current_scene["id"] == "library"
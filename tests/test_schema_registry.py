@@ -0,0 +1,52 @@
+import json
+import os
+import sys
+
+import jsonschema
+import pytest
+
+script_dir = os.path.dirname(__file__)
+root_dir = os.path.abspath(os.path.join(script_dir, ".."))
+sys.path.append(root_dir)
+
+from lib.schema_registry import SchemaRegistry
+from tests.fixtures.fixtures import valid_scene
+
+
+@pytest.fixture
+def schemas_dir(tmp_path):
+    exit_schema = {
+        "type": "object",
+        "required": ["id", "direction", "description"],
+        "properties": {"locked": {"type": "boolean"}},
+    }
+    scene_schema = {
+        "type": "object",
+        "required": ["id", "description"],
+        "properties": {
+            "exits": {"type": "array", "items": {"$ref": "exit_schema.json"}}
+        },
+    }
+    (tmp_path / "exit_schema.json").write_text(json.dumps(exit_schema))
+    (tmp_path / "scene_schema.json").write_text(json.dumps(scene_schema))
+    return tmp_path
+
+
+def test_validators_resolve_refs_between_schemas(schemas_dir):
+    schemas = SchemaRegistry(schemas_dir)
+
+    schemas.validator("scene").validate(valid_scene)
+
+    broken_scene = {**valid_scene, "exits": [{"id": "door_1", "locked": "yes"}]}
+    with pytest.raises(jsonschema.ValidationError):
+        schemas.validator("scene").validate(broken_scene)
+
+
+def test_schemas_are_read_once(schemas_dir):
+    schemas = SchemaRegistry(schemas_dir)
+    validator = schemas.validator("scene")
+
+    (schemas_dir / "scene_schema.json").unlink()
+
+    assert schemas.validator("scene") is validator
+    assert sorted(schemas.schemas) == ["exit", "scene"]
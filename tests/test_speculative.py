@@ -0,0 +1,147 @@
+import os
+import sys
+import threading
+import time
+from concurrent.futures import wait
+from unittest.mock import patch
+
+script_dir = os.path.dirname(__file__)
+root_dir = os.path.abspath(os.path.join(script_dir, ".."))
+sys.path.append(root_dir)
+
+from lib.llm_scheduler import Priority, current, llm_session, priority_for
+from lib.scene_generator_agent import SceneGenerator
+from lib.speculative import SpeculativeGenerator
+from tests.fixtures.fixtures import valid_game_state, valid_scene
+from utils import exit_key, find_exit
+
+
+def fake_new_scene(self, description, state):
+    return state._replace(
+        current_scene={"id": "generated", "description": description}, feedback=""
+    )
+
+
+@patch.object(SceneGenerator, "new_scene", fake_new_scene)
+def test_prefetch_generates_a_scene_for_each_visible_exit():
+    speculator = SpeculativeGenerator(enabled=True, workers=1)
+
+    speculator.prefetch(valid_game_state)
+
+    # The trapdoor is hidden, so it doesn't get a scene
+    assert sorted(key[1] for key in speculator.jobs) == ["door_1", "door_2"]
+    wait(speculator.jobs.values(), 5)
+
+    scene = speculator.take(valid_scene, find_exit(valid_scene, "go south"))
+    assert scene["id"] == "generated"
+    assert "Wooden door" in scene["description"]
+
+    # Taking an exit means the player is leaving, so the rest is dropped
+    assert speculator.jobs == {}
+
+
+def test_prefetch_cancels_work_for_scenes_the_player_left():
+    started = threading.Event()
+    release = threading.Event()
+
+    def slow_new_scene(self, description, state):
+        started.set()
+        release.wait(5)
+        return fake_new_scene(self, description, state)
+
+    with patch.object(SceneGenerator, "new_scene", slow_new_scene):
+        speculator = SpeculativeGenerator(enabled=True, workers=1)
+        speculator.prefetch(valid_game_state)
+        started.wait(5)
+        queued = dict(speculator.jobs)
+
+        next_scene = {"id": "hallway", "description": "A hallway.", "exits": []}
+        speculator.prefetch(valid_game_state._replace(current_scene=next_scene))
+        release.set()
+
+        assert speculator.jobs == {}
+        # Whichever job hadn't started yet never will
+        assert any(future.cancelled() for future in queued.values())
+
+
+def test_take_without_a_known_exit():
+    speculator = SpeculativeGenerator(enabled=True, workers=1)
+
+    assert speculator.take(valid_scene, find_exit(valid_scene, "go dance")) is None
+    assert speculator.take(valid_scene, find_exit(valid_scene, "go down")) is None
+
+
+def test_a_running_job_the_player_waits_on_is_raised_to_interactive():
+    started = threading.Event()
+    priorities = []
+
+    def slow_new_scene(self, description, state):
+        started.set()
+        deadline = time.monotonic() + 5
+        while (
+            current(priority_for("scene_generator")) != Priority.INTERACTIVE
+            and time.monotonic() < deadline
+        ):
+            time.sleep(0.001)
+        priorities.append(current(priority_for("scene_generator")))
+        return fake_new_scene(self, description, state)
+
+    with patch.object(SceneGenerator, "new_scene", slow_new_scene):
+        speculator = SpeculativeGenerator(enabled=True, workers=1)
+        speculator.prefetch(valid_game_state)
+        started.wait(5)
+        running = next(key for key, job in speculator.jobs.items() if job.running())
+        waiting = next(key for key in speculator.jobs if key != running)
+        exit_data = next(
+            exit_data
+            for exit_data in valid_scene["exits"]
+            if exit_key(valid_scene, exit_data) == running
+        )
+
+        assert speculator.take(valid_scene, exit_data)["id"] == "generated"
+
+    assert priorities == [Priority.INTERACTIVE]
+    assert waiting not in speculator.jobs
+
+
+def test_a_job_that_has_not_started_is_not_waited_on():
+    started = threading.Event()
+    release = threading.Event()
+
+    def slow_new_scene(self, description, state):
+        started.set()
+        release.wait(5)
+        return fake_new_scene(self, description, state)
+
+    with patch.object(SceneGenerator, "new_scene", slow_new_scene):
+        speculator = SpeculativeGenerator(enabled=True, workers=1)
+        speculator.prefetch(valid_game_state)
+        started.wait(5)
+        pending = next(
+            exit_data
+            for exit_data in valid_scene["exits"]
+            if exit_key(valid_scene, exit_data) in speculator.jobs
+            and not speculator.jobs[exit_key(valid_scene, exit_data)].running()
+        )
+
+        assert speculator.take(valid_scene, pending) is None
+        release.set()
+
+
+def test_scenes_are_generated_as_the_players_session():
+    sessions = []
+
+    def recording_new_scene(self, description, state):
+        sessions.append(llm_session.get())
+        return fake_new_scene(self, description, state)
+
+    with patch.object(SceneGenerator, "new_scene", recording_new_scene):
+        speculator = SpeculativeGenerator(enabled=True, workers=1)
+        token = llm_session.set("alice")
+        try:
+            speculator.prefetch(valid_game_state)
+        finally:
+            llm_session.reset(token)
+        wait(speculator.jobs.values(), 5)
+
+    assert sessions == ["alice", "alice"]
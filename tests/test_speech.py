@@ -0,0 +1,74 @@
+import os
+import sys
+import threading
+import time
+
+script_dir = os.path.dirname(__file__)
+root_dir = os.path.abspath(os.path.join(script_dir, ".."))
+sys.path.append(root_dir)
+
+from lib.speech import AudioCache, Speaker, StubSynthesizer
+
+
+class Recorder:
+    "Plays audio by noting it down, and says when the first sentence has played."
+
+    def __init__(self):
+        self.played = []
+        self.first = threading.Event()
+
+    def __call__(self, audio: bytes):
+        self.played.append(audio.decode("utf-8"))
+        self.first.set()
+
+
+def test_the_first_sentence_plays_before_the_rest_has_arrived(tmp_path):
+    recorder = Recorder()
+    speaker = Speaker(StubSynthesizer(), AudioCache(tmp_path), recorder)
+
+    speaker.feed("The door creaks open. Beyond it")
+    assert recorder.first.wait(5)
+    assert recorder.played == ["The door creaks open."]
+
+    speaker.feed(" is a stair.\n")
+    speaker.say("\x1b[1mExits:\x1b[0m north")
+    speaker.wait()
+
+    assert recorder.played == [
+        "The door creaks open.",
+        "Beyond it is a stair.",
+        "Exits: north",
+    ]
+
+
+def test_sentences_play_in_order_however_long_they_take(tmp_path):
+    class SlowFirst(StubSynthesizer):
+        def synthesize(self, text: str) -> bytes:
+            if text.startswith("One"):
+                time.sleep(0.2)
+            return super().synthesize(text)
+
+    recorder = Recorder()
+    speaker = Speaker(SlowFirst(), AudioCache(tmp_path), recorder, workers=3)
+
+    speaker.say('One. Two! "Three?" Four.')
+    speaker.wait()
+
+    assert recorder.played == ["One.", "Two!", '"Three?"', "Four."]
+
+
+def test_cached_sentences_are_not_synthesised_again(tmp_path):
+    first = StubSynthesizer()
+    speaker = Speaker(first, AudioCache(tmp_path), Recorder())
+    speaker.say("A torch-lit room. A locked door.")
+    speaker.wait()
+
+    second = StubSynthesizer()
+    recorder = Recorder()
+    speaker = Speaker(second, AudioCache(tmp_path), recorder)
+    speaker.say("A torch-lit room. A locked door.")
+    speaker.wait()
+
+    assert sorted(first.calls) == ["A locked door.", "A torch-lit room."]
+    assert second.calls == []
+    assert recorder.played == ["A torch-lit room.", "A locked door."]
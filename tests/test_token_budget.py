@@ -0,0 +1,50 @@
+import os
+import sys
+from unittest.mock import patch
+
+script_dir = os.path.dirname(__file__)
+root_dir = os.path.abspath(os.path.join(script_dir, ".."))
+sys.path.append(root_dir)
+
+from lib import token_budget
+from lib.token_budget import count_tokens, scene_to_prompt_text, trim_to_tokens
+from tests.fixtures.fixtures import valid_scene
+from utils import scene_to_compact_text
+
+
+def test_count_tokens_falls_back_to_four_characters_a_token():
+    with patch.object(token_budget, "_encoding", lambda: None):
+        assert count_tokens("") == 0
+        assert count_tokens("abcd") == 1
+        assert count_tokens("abcde") == 2
+
+
+def test_trim_to_tokens_cuts_at_a_sentence_end():
+    text = "The room is dark. " * 50
+
+    trimmed = trim_to_tokens(text, 40)
+
+    assert count_tokens(trimmed) <= 40
+    assert trimmed.endswith("dark.")
+
+
+def test_compact_scene_text_leaves_out_hidden_exits():
+    text = scene_to_compact_text(valid_scene)
+
+    assert "Exits: north (Door with metal bars); south (Wooden door)" in text
+    assert "trapdoor" not in text.lower()
+
+
+def test_scene_prompt_text_stays_flat_as_a_scene_grows():
+    sizes = []
+    for updates in range(1, 30):
+        scene = {
+            **valid_scene,
+            "description": valid_scene["description"] + " It got messier." * updates,
+            "internal_notes": "The sorcerer watches. " * updates,
+        }
+        sizes.append(count_tokens(scene_to_prompt_text(scene, 150)))
+
+    assert max(sizes) <= 150
+    assert count_tokens(scene_to_compact_text(scene)) > 300
+    assert "Exits:" in scene_to_prompt_text(scene, 150)
@@ -0,0 +1,107 @@
+import asyncio
+import json
+import os
+import sys
+
+script_dir = os.path.dirname(__file__)
+root_dir = os.path.abspath(os.path.join(script_dir, ".."))
+sys.path.append(root_dir)
+
+from lib.game import dispatch_user_action
+from lib.narrator_agent import Narrator
+from lib.tracing import in_span, span, traced
+from tests.fixtures.fixtures import use_tracer, valid_game_state
+
+
+def read_spans(tmp_path):
+    with open(tmp_path / "trace.jsonl", encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+
+def test_spans_nest_and_go_to_the_trace_file(monkeypatch, tmp_path):
+    use_tracer(monkeypatch, tmp_path)
+
+    @traced("dispatch_command", lambda command: {"command": command})
+    def dispatch_command(command):
+        with span("llm", agent="scene_generator") as llm_span:
+            llm_span.set("prompt_tokens", 12)
+
+    in_span("turn", lambda: dispatch_command("generate_scene"), command="go")
+
+    llm, command, turn = read_spans(tmp_path)
+    assert (llm["name"], command["name"], turn["name"]) == (
+        "llm",
+        "dispatch_command",
+        "turn",
+    )
+    assert llm["parent"] == command["span"]
+    assert command["parent"] == turn["span"]
+    assert llm["trace"] == turn["trace"]
+    assert command["command"] == "generate_scene"
+    assert llm["prompt_tokens"] == 12
+
+
+def test_turn_spans_cover_awaiting_an_async_turn(monkeypatch, tmp_path):
+    use_tracer(monkeypatch, tmp_path)
+
+    async def turn():
+        await asyncio.sleep(0.01)
+        with span("llm", agent="narrator"):
+            pass
+        return "done"
+
+    assert asyncio.run(in_span("turn", turn, command="look")) == "done"
+
+    llm, turn_span = read_spans(tmp_path)
+    assert llm["parent"] == turn_span["span"]
+    assert turn_span["duration_ms"] >= 10
+
+
+def test_metrics_have_percentiles_per_command(monkeypatch, tmp_path):
+    test_tracer = use_tracer(monkeypatch, tmp_path)
+
+    for command in ["look", "look", "go"]:
+        in_span("turn", lambda: None, command=command)
+    with span("llm", agent="narrator", model="llama", cache_hit=False) as llm_span:
+        llm_span.set("prompt_tokens", 100)
+        llm_span.set("queue_ms", 250)
+
+    assert set(test_tracer.percentiles("turn")) == {"look", "go"}
+
+    metrics = (tmp_path / "metrics.prom").read_text()
+    assert (
+        'dungeonmaster_span_seconds{span="turn",command="look",quantile="0.95"}'
+        in metrics
+    )
+    assert 'dungeonmaster_span_seconds_count{span="turn",command="look"} 2' in metrics
+
+    text = test_tracer.prometheus_text()
+    assert (
+        'dungeonmaster_llm_tokens_total{agent="narrator",model="llama",kind="prompt"} 100'
+        in text
+    )
+    assert 'dungeonmaster_llm_queue_seconds_total{agent="narrator"} 0.250000' in text
+
+
+def test_turns_served_locally_are_counted(monkeypatch, tmp_path):
+    test_tracer = use_tracer(monkeypatch, tmp_path)
+    assert test_tracer.local_fraction() is None
+
+    for served in ["local", "local", "local", "narrator"]:
+        in_span("turn", lambda: None, command="go", served=served)
+
+    assert test_tracer.local_fraction() == 0.75
+    text = test_tracer.prometheus_text()
+    assert 'dungeonmaster_turns_total{served="local"} 3' in text
+
+
+def test_builtin_and_unknown_turns_are_not_counted_as_local(monkeypatch, tmp_path):
+    test_tracer = use_tracer(monkeypatch, tmp_path)
+
+    narrator = Narrator()
+    for action in ["inventory", "xyzzy", "look", "dance wildly"]:
+        dispatch_user_action(action, valid_game_state, narrator, say=lambda text: None)
+
+    assert test_tracer.local_fraction() is None
+    assert test_tracer.turns == {"builtin": 2, "none": 2}
+    assert set(test_tracer.percentiles("turn")) == {"inventory", "look", "other"}
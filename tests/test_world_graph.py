@@ -0,0 +1,57 @@
+import os
+import sys
+
+script_dir = os.path.dirname(__file__)
+root_dir = os.path.abspath(os.path.join(script_dir, ".."))
+sys.path.append(root_dir)
+
+from lib.world_graph import WorldGraph
+from tests.fixtures.fixtures import valid_scene
+from utils import find_exit
+
+hallway = {
+    "id": "hallway",
+    "title": "Hallway",
+    "description": "A long, dusty hallway.",
+    "exits": [
+        {"id": "wooden_door", "direction": "north", "description": "Wooden door"},
+        {"id": "archway", "direction": "east", "description": "A stone archway"},
+    ],
+}
+
+
+def test_connect_records_the_exit_and_the_way_back():
+    world = WorldGraph(":memory:")
+    south = find_exit(valid_scene, "go south")
+
+    world.connect(valid_scene, south, world.add_scene(hallway))
+
+    assert world.destination(valid_scene, south) == hallway
+    assert world.destination(hallway, find_exit(hallway, "go north")) == valid_scene
+    assert world.destination(hallway, find_exit(hallway, "go east")) is None
+
+
+def test_add_scene_keeps_clashing_ids_apart():
+    world = WorldGraph(":memory:")
+
+    first = world.add_scene(hallway)
+    second = world.add_scene({**hallway, "description": "A different hallway."})
+
+    assert first["id"] == "hallway"
+    assert second["id"] == "hallway_2"
+    assert world.scene("hallway") == hallway
+    # Storing the same scene again is not a clash
+    assert world.add_scene(hallway)["id"] == "hallway"
+
+
+def test_scenes_evicted_from_the_cache_come_back_from_the_store(tmp_path):
+    world = WorldGraph(str(tmp_path / "world.sqlite3"), cache_size=1)
+
+    world.put_scene(valid_scene)
+    world.put_scene(hallway)
+
+    assert list(world.cache) == ["hallway"]
+    assert world.scene("starting_room") == valid_scene
+
+    reopened = WorldGraph(str(tmp_path / "world.sqlite3"))
+    assert reopened.scene("hallway") == hallway
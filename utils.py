@@ -1,7 +1,7 @@
 import dis
 import json
 
-from typing import Dict, TYPE_CHECKING
+from typing import Dict, Tuple, TYPE_CHECKING
 
 if TYPE_CHECKING:
     from game_state import GameState
@@ -76,3 +76,93 @@ def scene_to_text(scene: dict) -> str:
         scene_description += f"\n\nInternal Notes:\n{scene["internal_notes"]}"
 
     return scene_description
+
+
+def scene_to_compact_text(
+    scene: dict, description: str | None = None, notes: str | None = None
+) -> str:
+    """A shorter scene_to_text for prompts: whitespace collapsed, exits on one line.
+
+    `description` and `notes` replace the scene's own, e.g. with trimmed versions.
+    """
+    description = scene["description"] if description is None else description
+    notes = scene.get("internal_notes", "") if notes is None else notes
+
+    lines = []
+    if "title" in scene:
+        lines.append(scene["title"])
+    lines.append(" ".join(description.split()))
+
+    exits = [
+        f"{exit_data['direction']} ({exit_data['description']})"
+        for exit_data in scene.get("exits", [])
+        if "hidden" not in exit_data
+    ]
+    if exits:
+        lines.append(f"Exits: {'; '.join(exits)}")
+
+    if notes:
+        lines.append(f"Internal Notes: {' '.join(str(notes).split())}")
+
+    return "\n".join(lines)
+
+
+DIRECTION_ALIASES = {
+    "n": "north",
+    "s": "south",
+    "e": "east",
+    "w": "west",
+    "u": "up",
+    "d": "down",
+    "ne": "northeast",
+    "nw": "northwest",
+    "se": "southeast",
+    "sw": "southwest",
+}
+
+
+OPPOSITE_DIRECTIONS = {
+    "north": "south",
+    "south": "north",
+    "east": "west",
+    "west": "east",
+    "northeast": "southwest",
+    "southwest": "northeast",
+    "northwest": "southeast",
+    "southeast": "northwest",
+    "up": "down",
+    "down": "up",
+    "in": "out",
+    "out": "in",
+}
+
+
+def exit_key(scene: dict, exit_data: dict) -> Tuple[str, str]:
+    "Identifies an exit of a scene: the scene id plus the exit id, or its direction if it has no id."
+    return (scene.get("id", ""), exit_data.get("id") or exit_data["direction"])
+
+
+def find_exit(scene: dict, user_action: str) -> dict | None:
+    """Find the visible exit a `go ...` action refers to, by direction or id.
+
+    Returns None when nothing matches, so the narrator can deal with anything
+    more creative than "go north" or "go through door_2".
+    """
+    words = user_action.lower().split()
+    if words and words[0] == "go":
+        words = words[1:]
+    while words and words[0] in ("to", "the", "through", "into"):
+        words = words[1:]
+    target = DIRECTION_ALIASES.get(" ".join(words), " ".join(words))
+    if not target:
+        return None
+
+    for exit_data in scene.get("exits", []):
+        if "hidden" in exit_data:
+            continue
+        if target in (
+            exit_data.get("direction", "").lower(),
+            exit_data.get("id", "").lower(),
+        ):
+            return exit_data
+    return None